@@ -0,0 +1 @@
+"""Benchmarks of HubLabBot, run with `bench <name>` from dev shell."""
@@ -0,0 +1,147 @@
+"""Benchmark of engines: threaded WSGI app against ASGI app under concurrent deliveries.
+
+Both engines get the same burst of signed `status` deliveries against fake GitHub and GitLab APIs
+with latency: WSGI app is called from thread pool, ASGI app from one event loop. Reports wall
+time, p50 and p99 latency of delivery (since start of burst, queueing included) and throughput.
+
+Usage: `bench engines [--deliveries N] [--threads N] [--connections N] [--latency-ms N]
+[--state failure|success] [--prs N] [--log-kib N]`.
+"""
+from typing import Any, Dict, List, Tuple
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from webob import Request  # type: ignore
+
+from hublabbot.const import CORRELATION_KEY, OUTBOX_KEY
+from hublabbot.app import make_app
+from hublabbot.aio.app import AsgiApp
+from hublabbot.standin.server import StandinServer
+from bench.standin.github import FakeGithub
+from bench.standin.gitlab import FakeGitlab
+from bench.handlers import REPO_PATH, _make_settings
+from bench.util import github_request, dump_json
+
+
+async def _call_asgi(app: AsgiApp, request: Request) -> int:
+	scope = {
+		'type': 'http',
+		'method': request.method,
+		'path': request.path_info,
+		'query_string': request.query_string.encode(),
+		'headers': [(name.lower().encode(), value.encode()) for name, value in request.headers.items()],
+		'server': ('127.0.0.1', 8080)}
+	messages: List[Dict[str, Any]] = []
+
+	async def receive() -> Dict[str, Any]:
+		return {'type': 'http.request', 'body': request.body}
+
+	async def send(message: Dict[str, Any]) -> None:
+		messages.append(message)
+
+	await app(scope, receive, send)
+	status: int = messages[0]['status']
+	return status
+
+
+def _run_wsgi(app: Any, requests: List[Request], threads: int) -> List[Tuple[float, int]]:
+	start = time.perf_counter()
+
+	def timed(request: Request) -> Tuple[float, int]:
+		status = int(request.get_response(app).status_int)
+		return time.perf_counter() - start, status
+
+	with ThreadPoolExecutor(threads) as executor:
+		return list(executor.map(timed, requests))
+
+
+def _run_asgi(app: AsgiApp, requests: List[Request]) -> List[Tuple[float, int]]:
+	start = time.perf_counter()
+
+	async def timed(request: Request) -> Tuple[float, int]:
+		status = await _call_asgi(app, request)
+		return time.perf_counter() - start, status
+
+	async def run() -> List[Tuple[float, int]]:
+		try:
+			return list(await asyncio.gather(*(timed(request) for request in requests)))
+		finally:
+			await app.close()
+
+	return asyncio.run(run())
+
+
+def _print(name: str, wall: float, results: List[Tuple[float, int]]) -> None:
+	times = sorted(duration for duration, _ in results)
+	errors = sum(1 for _, status in results if status >= 500)
+	print(f'{name:<6} {wall:>8.2f} {times[len(times) // 2] * 1000:>9.1f}'
+	      + f' {times[min(len(times) * 99 // 100, len(times) - 1)] * 1000:>9.1f}'
+	      + f' {len(results) / wall:>11.1f} {errors:>6}')
+
+
+def main(args: List[str]) -> None:
+	"""Run benchmark."""
+	parser = argparse.ArgumentParser(prog='bench engines', description=__doc__.splitlines()[0])
+	parser.add_argument('--deliveries', type=int, default=1000, help='count of concurrent deliveries')
+	parser.add_argument('--threads', type=int, default=32, help='thread pool size of WSGI engine')
+	parser.add_argument('--connections', type=int, default=100,
+	                    help='connections per backend of ASGI engine')
+	parser.add_argument('--latency-ms', type=float, default=20, help='latency of fake APIs')
+	parser.add_argument('--state', choices=('failure', 'success'), default='failure',
+	                    help='state of delivered statuses')
+	parser.add_argument('--prs', type=int, default=100, help='count of open PRs')
+	parser.add_argument('--log-kib', type=int, default=64, help='size of job log in KiB')
+	options = parser.parse_args(args)
+	with tempfile.TemporaryDirectory() as tmpdir:
+		fake_github = FakeGithub(REPO_PATH, pr_count=options.prs)
+		fake_gitlab = FakeGitlab(REPO_PATH, log_size=options.log_kib * 1024)
+		latency = options.latency_ms / 1000
+		with StandinServer(fake_github, latency) as github_standin, \
+		     StandinServer(fake_gitlab, latency) as gitlab_standin:
+			fake_github.target_url = github_standin.url
+			fake_gitlab.target_url = gitlab_standin.url
+			settings = _make_settings(tmpdir, github_standin.url, gitlab_standin.url)
+			wsgi_app: Any = make_app(settings)
+			repository = {'full_name': REPO_PATH, 'path_with_namespace': REPO_PATH}
+			delivery_ids = itertools.count()
+
+			def make_requests() -> List[Request]:
+				requests = []
+				for n in range(options.deliveries):
+					sha = fake_github.pr_sha(1 + n % options.prs)
+					requests.append(github_request('status', dump_json({
+						'sha': sha, 'state': options.state, 'description': 'Pipeline on GitLab',
+						'target_url': f'{gitlab_standin.url}/{REPO_PATH}/-/pipelines/{1 + n % 20}',
+						'commit': {'sha': sha}, 'repository': repository}), str(next(delivery_ids))))
+				return requests
+
+			def reset() -> None:
+				fake_github.merged.clear()
+				fake_github.comments.clear()
+				wsgi_app.app.registry.settings[CORRELATION_KEY].clear()
+				wsgi_app.app.registry.settings[OUTBOX_KEY].clear()
+				github_standin.reset_calls()
+				gitlab_standin.reset_calls()
+
+			print(f'{"engine":<6} {"wall, s":>8} {"p50, ms":>9} {"p99, ms":>9} {"deliveries/s":>11}'
+			      + f' {"errors":>6}')
+			reset()
+			requests = make_requests()
+			start = time.perf_counter()
+			results = _run_wsgi(wsgi_app, requests, options.threads)
+			_print('wsgi', time.perf_counter() - start, results)
+			reset()
+			asgi_app = AsgiApp(wsgi_app, options.threads, options.connections)
+			requests = make_requests()
+			start = time.perf_counter()
+			results = _run_asgi(asgi_app, requests)
+			_print('asgi', time.perf_counter() - start, results)
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,265 @@
+"""Benchmark of webhook handlers against fake GitHub and GitLab APIs.
+
+Reports wall time, peak memory and exact count of outbound calls per event. Results are saved
+as JSON, pass previous results as baseline to diff them.
+
+Usage: `bench handlers [--repeat N] [--latency-ms N] [--prs N] [--pipelines N] [--log-kib N]
+[--save PATH] [--baseline PATH]`.
+"""
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import itertools
+import tracemalloc
+from pathlib import PurePath
+from urllib.parse import urlencode
+
+import pygit2
+from webob import Request  # type: ignore
+
+from hublabbot.const import CORRELATION_KEY, OUTBOX_KEY
+from hublabbot.settings import HubLabBotSettings
+from hublabbot.app import get_assets_path, make_app
+from hublabbot.standin.server import StandinServer
+from bench.standin.git import is_git_path
+from bench.standin.github import FakeGithub
+from bench.standin.gitlab import FakeGitlab
+from bench.util import GH_SECRET, GL_SECRET, github_request, gitlab_request, dump_json
+
+
+REPO_PATH = 'bench/repo'
+"""Path of benchmark repo in GitHub and GitLab."""
+RESULTS_PATH = 'tools/log/bench/handlers.json'
+"""Default path to save results."""
+
+
+class Case(NamedTuple):
+	"""Benchmark case."""
+
+	name: str
+	"""Name of case, handler and event."""
+	make_request: Callable[[str], Request]
+	"""Makes request by delivery ID."""
+	reset: Callable[[], None]
+	"""Resets state of fake APIs before each run."""
+
+
+class Env(NamedTuple):
+	"""Environment of benchmark."""
+
+	app: Any
+	github: FakeGithub
+	gitlab: FakeGitlab
+	github_standin: StandinServer
+	gitlab_standin: StandinServer
+
+
+def _init_git(tmpdir: str, fake_github: FakeGithub, pr_num: int) -> None:
+	github_repo = pygit2.init_repository(os.path.join(tmpdir, 'github', f'{REPO_PATH}.git'), bare=True)
+	pygit2.init_repository(os.path.join(tmpdir, 'gitlab', f'{REPO_PATH}.git'), bare=True)
+	blob = github_repo.create_blob(b'benchmark\n')
+	builder = github_repo.TreeBuilder()
+	builder.insert('README', blob, pygit2.GIT_FILEMODE_BLOB)
+	signature = pygit2.Signature('bench', 'bench@localhost')
+	commit = github_repo.create_commit(None, signature, signature, 'Initial', builder.write(), [])
+	github_repo.references.create(f'refs/pull/{pr_num}/head', commit)
+	fake_github.head_shas[pr_num] = str(commit)
+
+
+def _make_settings(tmpdir: str, github_url: str, gitlab_url: str) -> HubLabBotSettings:
+	settings_path = os.path.join(tmpdir, 'hublabbot.json')
+	with open(settings_path, 'w') as f:
+		json.dump({
+			'base_url': 'http://127.0.0.1:8080',
+			'gh_base_url': github_url,
+			'gh_api_url': github_url,
+			'gl_base_url': gitlab_url,
+			# measure evaluation of Pipeline Hook and deletion of branch, not their queueing
+			'pipeline_debounce_window': 0,
+			'branch_delete_window': 0,
+			'repos': [{
+				'gh_repo_path': REPO_PATH,
+				'gl_repo_path': REPO_PATH,
+				'gh_auto_merge_pr': {'delay': 0},
+				'gh_show_gitlab_ci_fail': {},
+				'gh_gitlab_ci_for_external_pr': True,
+				'gl_auto_cancel_pipelines': True,
+				'gl_auto_delete_branches': True,
+				'gl_delete_pipeline_btn': True}]}, f)
+	os.environ.update({
+		'GITHUB_TOKEN': 'bench-token',
+		'GITHUB_BOT_TOKEN': 'bench-bot-token',
+		'GITHUB_SECRET': GH_SECRET,
+		'GITLAB_TOKEN': 'bench-gitlab-token',
+		'GITLAB_SECRET': GL_SECRET})
+	return HubLabBotSettings(PurePath(settings_path), PurePath(get_assets_path()))
+
+
+def _button_request(params: Dict[str, str], method: str) -> Request:
+	return Request.blank(f'/api/gitlab_button?{urlencode(params)}', method=method,
+	                     headers={'X-Gitlab-Token': GL_SECRET})
+
+
+def _cases(env: Env) -> List[Case]:
+	github = env.github
+	gitlab = env.gitlab
+	repository = {'full_name': REPO_PATH, 'path_with_namespace': REPO_PATH}
+	# PRs are listed by number desc, so scan for PR #1 is the longest
+	sha = github.pr_sha(1)
+	gitlab.pipeline_sha = sha
+	external_pr = github.pr_json(2)
+
+	def status(state: str) -> bytes:
+		return dump_json({
+			'sha': sha, 'state': state, 'description': 'Pipeline on GitLab',
+			'target_url': f'{env.gitlab_standin.url}/{REPO_PATH}/-/pipelines/{gitlab.pipeline_count}',
+			'commit': {'sha': sha}, 'repository': repository})
+
+	def pipeline(ref: str, state: str = 'running') -> bytes:
+		builds = [{'id': gitlab.pipeline_count, 'stage': 'test', 'status': 'failed'}]
+		return dump_json({
+			'object_kind': 'pipeline', 'project': repository,
+			'object_attributes': {'id': gitlab.pipeline_count, 'ref': ref, 'sha': sha, 'tag': False,
+			                      'status': state, 'source': 'push'},
+			'builds': builds if state == 'failed' else []})
+
+	def reset() -> None:
+		github.merged.clear()
+		gitlab.canceled.clear()
+		gitlab.deleted_branches.clear()
+		env.app.app.registry.settings[CORRELATION_KEY].clear()
+		# done comments are suppressed as duplicates
+		env.app.app.registry.settings[OUTBOX_KEY].clear()
+
+	reset_ids = itertools.count()
+
+	def reset_correlated() -> None:
+		"""Deliver PR #1 and its failed pipeline, so handlers resolve them from correlation cache."""
+		reset()
+		github_request('pull_request', dump_json({
+			'action': 'edited', 'pull_request': github.pr_json(1), 'repository': repository}),
+			f'reset-{next(reset_ids)}').get_response(env.app)
+		gitlab_request('Pipeline Hook', pipeline('branch-1', 'failed'),
+		               f'reset-{next(reset_ids)}').get_response(env.app)
+
+	return [
+		Case('payload_status failure', lambda d: github_request('status', status('failure'), d), reset),
+		Case('payload_status success', lambda d: github_request('status', status('success'), d), reset),
+		Case('payload_status failure correlated', lambda d: github_request(
+			'status', status('failure'), d), reset_correlated),
+		Case('payload_status success correlated', lambda d: github_request(
+			'status', status('success'), d), reset_correlated),
+		Case('payload_pull_request opened', lambda d: github_request('pull_request', dump_json({
+			'action': 'opened', 'pull_request': external_pr, 'repository': repository}), d), reset),
+		Case('payload_pull_request closed', lambda d: github_request('pull_request', dump_json({
+			'action': 'closed', 'pull_request': external_pr, 'repository': repository}), d), reset),
+		Case('payload_delete', lambda d: github_request('delete', dump_json({
+			'ref': 'branch-3', 'ref_type': 'branch', 'repository': repository}), d), reset),
+		Case('payload_pipeline_hook PR', lambda d: gitlab_request(
+			'Pipeline Hook', pipeline('branch-1'), d), reset),
+		Case('payload_pipeline_hook PR correlated', lambda d: gitlab_request(
+			'Pipeline Hook', pipeline('branch-1'), d), reset_correlated),
+		Case('payload_pipeline_hook no PR', lambda d: gitlab_request(
+			'Pipeline Hook', pipeline('feature'), d), reset),
+		Case('button_api_delete_pipeline', lambda d: _button_request(
+			{'repo_path': REPO_PATH, 'pipeline_id': '1'}, 'DELETE'), reset),
+		Case('button_api_is_enabled', lambda d: _button_request(
+			{'repo_path': REPO_PATH, 'is_enabled': '1'}, 'GET'), reset)]
+
+
+def _run_case(env: Env, case: Case, repeat: int, delivery_ids: 'itertools.count[int]'
+) -> Dict[str, Any]:
+	times: List[float] = []
+	errors = 0
+	env.github_standin.reset_calls()
+	env.gitlab_standin.reset_calls()
+	for _ in range(repeat):
+		case.reset()
+		request = case.make_request(str(next(delivery_ids)))
+		start = time.perf_counter()
+		response = request.get_response(env.app)
+		times.append(time.perf_counter() - start)
+		if response.status_int >= 500:
+			errors += 1
+	calls = {'github': 0, 'gitlab': 0, 'git': 0}
+	for backend, standin in (('github', env.github_standin), ('gitlab', env.gitlab_standin)):
+		for (_, path), count in standin.reset_calls().items():
+			calls['git' if is_git_path(path) else backend] += count
+	case.reset()
+	request = case.make_request(str(next(delivery_ids)))
+	tracemalloc.start()
+	request.get_response(env.app)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	times.sort()
+	return {
+		'mean_ms': sum(times) / len(times) * 1000,
+		'median_ms': times[len(times) // 2] * 1000,
+		'peak_kib': peak / 1024,
+		'errors': errors,
+		'calls': {backend: count / repeat for backend, count in calls.items()}}
+
+
+def _print(results: Dict[str, Dict[str, Any]],
+           baseline: Optional[Dict[str, Dict[str, Any]]]) -> None:
+	print(f'{"case":<36} {"mean, ms":>9} {"median, ms":>10} {"peak, KiB":>10} {"errors":>6}'
+	      + f' {"GH calls":>8} {"GL calls":>8} {"git calls":>9}')
+	for name, result in results.items():
+		calls = result['calls']
+		print(f'{name:<36} {result["mean_ms"]:>9.2f} {result["median_ms"]:>10.2f}'
+		      + f' {result["peak_kib"]:>10.1f} {result["errors"]:>6} {calls["github"]:>8.1f}'
+		      + f' {calls["gitlab"]:>8.1f} {calls["git"]:>9.1f}')
+		if baseline is not None and name in baseline:
+			base = baseline[name]
+			time_delta = (result['median_ms'] / base['median_ms'] - 1) * 100 if base['median_ms'] else 0
+			call_deltas = ', '.join(f'{backend} {calls[backend] - base["calls"][backend]:+.1f}'
+			                        for backend in calls)
+			print(f'{"":<36} median {time_delta:+.1f}% vs baseline, calls: {call_deltas}')
+
+
+def main(args: List[str]) -> None:
+	"""Run benchmark."""
+	parser = argparse.ArgumentParser(prog='bench handlers', description=__doc__.splitlines()[0])
+	parser.add_argument('--repeat', type=int, default=20, help='runs per case')
+	parser.add_argument('--latency-ms', type=float, default=0, help='latency of fake APIs')
+	parser.add_argument('--prs', type=int, default=100, help='count of open PRs')
+	parser.add_argument('--pipelines', type=int, default=20, help='count of running pipelines')
+	parser.add_argument('--log-kib', type=int, default=256, help='size of job log in KiB')
+	parser.add_argument('--save', default=RESULTS_PATH, help='path to save results')
+	parser.add_argument('--baseline', help='path to previous results to diff with')
+	options = parser.parse_args(args)
+	baseline = None
+	if options.baseline is not None:
+		with open(options.baseline) as f:
+			baseline = json.load(f)['results']
+	with tempfile.TemporaryDirectory() as tmpdir:
+		fake_github = FakeGithub(REPO_PATH, pr_count=options.prs,
+		                         tokens={'bench-bot-token': 'bench-bot'},
+		                         git_root=os.path.join(tmpdir, 'github'))
+		fake_gitlab = FakeGitlab(REPO_PATH, pipeline_count=options.pipelines,
+		                         log_size=options.log_kib * 1024,
+		                         git_root=os.path.join(tmpdir, 'gitlab'))
+		_init_git(tmpdir, fake_github, 2)
+		latency = options.latency_ms / 1000
+		with StandinServer(fake_github, latency) as github_standin, \
+		     StandinServer(fake_gitlab, latency) as gitlab_standin:
+			fake_github.target_url = github_standin.url
+			fake_gitlab.target_url = gitlab_standin.url
+			settings = _make_settings(tmpdir, github_standin.url, gitlab_standin.url)
+			env = Env(make_app(settings), fake_github, fake_gitlab, github_standin, gitlab_standin)
+			delivery_ids = itertools.count()
+			results = {case.name: _run_case(env, case, options.repeat, delivery_ids)
+			           for case in _cases(env)}
+	_print(results, baseline)
+	os.makedirs(os.path.dirname(options.save) or '.', exist_ok=True)
+	with open(options.save, 'w') as f:
+		json.dump({'config': vars(options), 'results': results}, f, indent='\t', sort_keys=True)
+	print(f'Results saved to {options.save}.')
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
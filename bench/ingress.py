@@ -0,0 +1,88 @@
+"""Microbenchmark of ingress path: verify, dispatch and decode of webhook payloads.
+
+Usage: `bench ingress [repeat]`.
+"""
+from typing import Callable, List, Tuple
+import sys
+import json
+import itertools
+
+from webob import Request  # type: ignore
+
+from hublabbot.util import JsonDict, json_loads, orjson
+from hublabbot.app import make_app
+from bench.util import make_settings, github_request, gitlab_request, measure, dump_json
+
+
+REPOS = [{
+	'gh_repo_path': 'bench/repo',
+	'gl_repo_path': 'bench/repo',
+	'gh_auto_merge_pr': {},
+	'gh_show_gitlab_ci_fail': {},
+	'gl_auto_cancel_pipelines': True}]
+
+
+def _repository() -> JsonDict:
+	repository: JsonDict = {'full_name': 'bench/repo', 'path_with_namespace': 'bench/repo'}
+	repository.update({f'{name}_url': f'https://api.github.com/repos/bench/repo/{name}'
+	                   for name in ('hooks', 'issues', 'pulls', 'commits', 'branches', 'tags')})
+	return repository
+
+
+def _push_payload(commits: int) -> JsonDict:
+	return {
+		'ref': 'refs/heads/master',
+		'repository': _repository(),
+		'commits': [{
+			'id': f'{n:040x}',
+			'message': 'Commit message\n\n' + 'Long description. ' * 20,
+			'added': [f'src/module_{n}_{i}.py' for i in range(10)],
+			'modified': [f'src/other_{n}_{i}.py' for i in range(10)]} for n in range(commits)]}
+
+
+def _status_payload() -> JsonDict:
+	return {
+		'sha': 'f' * 40,
+		'state': 'pending',
+		'description': 'Pipeline running on GitLab',
+		'target_url': 'https://gitlab.com/bench/repo/pipelines/1',
+		'commit': {'sha': 'f' * 40, 'commit': {'message': 'Commit message'}},
+		'branches': [{'name': f'branch-{n}', 'commit': {'sha': f'{n:040x}'}} for n in range(30)],
+		'repository': _repository()}
+
+
+def _pipeline_payload() -> JsonDict:
+	return {
+		'object_kind': 'pipeline',
+		'object_attributes': {'id': 1, 'ref': 'master', 'tag': False, 'sha': 'f' * 40,
+		                      'status': 'success', 'source': 'push'},
+		'project': _repository(),
+		'builds': [{'id': n, 'stage': 'test', 'name': f'job-{n}', 'status': 'success'}
+		           for n in range(50)]}
+
+
+def main(args: List[str]) -> None:
+	"""Run benchmark."""
+	repeat = int(args[0]) if len(args) >= 1 else 200
+	app = make_app(make_settings(REPOS))
+	delivery_ids = (str(n) for n in itertools.count())
+	cases: List[Tuple[str, bytes, Callable[[bytes, str], Request]]] = [
+		('GH push (unhandled)', dump_json(_push_payload(2000)),
+		 lambda body, delivery_id: github_request('push', body, delivery_id)),
+		('GH status pending', dump_json(_status_payload()),
+		 lambda body, delivery_id: github_request('status', body, delivery_id)),
+		('GL Pipeline Hook success', dump_json(_pipeline_payload()),
+		 lambda body, delivery_id: gitlab_request('Pipeline Hook', body, delivery_id))]
+	print(f'JSON decoder: {"orjson" if orjson is not None else "json"}, repeat: {repeat}.')
+	print(f'{"case":<28} {"size":>10} {"request, ms":>12} {"json, ms":>10} {"decoder, ms":>12}')
+	for name, body, make_request in cases:
+		request_mean, _ = measure(lambda: make_request(body, next(delivery_ids)).get_response(app),
+		                          repeat)
+		json_mean, _ = measure(lambda: json.loads(body), repeat)
+		decoder_mean, _ = measure(lambda: json_loads(body), repeat)
+		print(f'{name:<28} {len(body):>10} {request_mean * 1000:>12.3f} {json_mean * 1000:>10.3f}'
+		      + f' {decoder_mean * 1000:>12.3f}')
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,95 @@
+"""Benchmark of auto-merge: PRs merged on own timers against merge queue.
+
+Burst of signed success `status` deliveries of labelled PRs goes to app against fake GitHub,
+whose base branch requires PRs to be up to date: after every merge other open PRs are behind.
+With merge queue, PRs behind are updated through API, success status of updated head is
+delivered after `--ci-ms` (CI run). Reports merged PRs, refused merge calls, branch updates,
+GitHub calls and wall time until queue is drained.
+
+Usage: `bench merge_queue [--prs N] [--latency-ms N] [--ci-ms N]`.
+"""
+from typing import Any, Dict, List
+import sys
+import time
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from hublabbot.app import make_app
+from hublabbot.store import MemoryStore
+from hublabbot.scheduler import LeaderElector, Scheduler
+from hublabbot.standin.server import StandinServer
+from bench.standin.github import FakeGithub
+from bench.util import make_settings, github_request, dump_json
+
+
+REPO_PATH = 'bench/repo'
+"""Path of benchmark repo in GitHub and GitLab."""
+
+
+def _run(merge_queue: bool, options: argparse.Namespace) -> Dict[str, Any]:
+	fake_github = FakeGithub(REPO_PATH, pr_count=options.prs)
+	fake_github.require_up_to_date = True
+	with StandinServer(fake_github, options.latency_ms / 1000) as github_standin:
+		fake_github.target_url = github_standin.url
+		settings = make_settings([{
+			'gh_repo_path': REPO_PATH, 'gl_repo_path': REPO_PATH,
+			'gh_auto_merge_pr': {'delay': 0, 'sweep_interval': 0, 'merge_queue': merge_queue,
+			                     'authors_white_list': [fake_github.login]}}],
+			gh_api_url=github_standin.url, gh_base_url=github_standin.url)
+		store = MemoryStore()
+		elector = LeaderElector(store, 15)
+		elector.renew()
+		# jobs are run by benchmark, scheduler isn't started
+		scheduler = Scheduler(store, elector)
+		app = make_app(settings, scheduler)
+		delivery_ids = itertools.count()
+		repository = {'full_name': REPO_PATH}
+
+		def deliver(number: int) -> None:
+			sha = fake_github.pr_sha(number)
+			github_request('status', dump_json({
+				'sha': sha, 'state': 'success', 'description': 'Pipeline on GitLab',
+				'target_url': f'https://gitlab.com/{REPO_PATH}/-/pipelines/{number}',
+				'commit': {'sha': sha}, 'repository': repository}),
+				str(next(delivery_ids))).get_response(app)
+
+		start = time.perf_counter()
+		with ThreadPoolExecutor(options.prs) as executor:
+			list(executor.map(deliver, range(1, options.prs + 1)))
+		delivered = 0
+		while merge_queue and len(fake_github.merged) < options.prs:
+			elector.renew()
+			scheduler.run_due(wait_jobs=True)
+			if len(fake_github.updated_branches) > delivered:
+				# CI of updated head
+				time.sleep(options.ci_ms / 1000)
+				for number in fake_github.updated_branches[delivered:]:
+					deliver(number)
+				delivered = len(fake_github.updated_branches)
+			elif len(store.scan('job:')) == 0:
+				break
+			else:
+				time.sleep(0.01)
+		wall = time.perf_counter() - start
+		calls = sum(count for (method, _), count in github_standin.reset_calls().items())
+		return {'merged': len(fake_github.merged), 'refused': fake_github.failed_merges,
+		        'updates': len(fake_github.updated_branches), 'calls': calls, 'wall': wall}
+
+
+def main(args: List[str]) -> None:
+	"""Run benchmark."""
+	parser = argparse.ArgumentParser(prog='bench merge_queue', description=__doc__.splitlines()[0])
+	parser.add_argument('--prs', type=int, default=10, help='count of PRs going green at once')
+	parser.add_argument('--latency-ms', type=float, default=20, help='latency of fake API')
+	parser.add_argument('--ci-ms', type=float, default=100, help='duration of CI of updated head')
+	options = parser.parse_args(args)
+	print(f'{"mode":<7} {"merged":>6} {"refused":>7} {"updates":>7} {"GH calls":>8} {"wall, s":>8}')
+	for name, merge_queue in (('timers', False), ('queue', True)):
+		result = _run(merge_queue, options)
+		print(f'{name:<7} {result["merged"]:>6} {result["refused"]:>7} {result["updates"]:>7}'
+		      + f' {result["calls"]:>8} {result["wall"]:>8.2f}')
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,89 @@
+"""Benchmark of coalescing of identical concurrent API reads (single flight).
+
+Burst of `--deliveries` signed failure `status` deliveries of same commit (like statuses of
+several CI contexts) goes at once to app against fake GitHub and GitLab, with coalescing
+of reads off and on. Each delivery scans PRs, reads pipeline's jobs and log of failed job.
+Reports GitHub and GitLab calls, saved (coalesced) reads and wall time of burst.
+
+Usage: `bench single_flight [--deliveries N] [--prs N] [--latency-ms N]`.
+"""
+from typing import Any, Dict, List
+import sys
+import time
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from hublabbot.app import make_app
+from hublabbot.store import MemoryStore
+from hublabbot.scheduler import LeaderElector, Scheduler
+from hublabbot.metrics import COALESCED_READS
+from hublabbot.standin.server import StandinServer
+from bench.standin.github import FakeGithub
+from bench.standin.gitlab import FakeGitlab
+from bench.util import make_settings, github_request, dump_json
+
+
+REPO_PATH = 'bench/repo'
+"""Path of benchmark repo in GitHub and GitLab."""
+
+
+def _run(coalesce: bool, options: argparse.Namespace, fake_github: FakeGithub,
+         github_standin: StandinServer, gitlab_standin: StandinServer) -> Dict[str, Any]:
+	settings = make_settings([{
+		'gh_repo_path': REPO_PATH, 'gl_repo_path': REPO_PATH, 'gh_show_gitlab_ci_fail': {}}],
+		gh_api_url=github_standin.url, gh_base_url=github_standin.url,
+		gl_base_url=gitlab_standin.url, coalesce_api_reads=coalesce)
+	store = MemoryStore()
+	app = make_app(settings, Scheduler(store, LeaderElector(store, 15)))
+	# PRs are listed by number desc, so scan for PR #1 is the longest
+	sha = fake_github.pr_sha(1)
+	repository = {'full_name': REPO_PATH}
+	delivery_ids = itertools.count()
+
+	def deliver(context: int) -> None:
+		github_request('status', dump_json({
+			'sha': sha, 'state': 'failure', 'description': 'Pipeline on GitLab',
+			'context': f'ci/gitlab/{context}',
+			'target_url': f'{gitlab_standin.url}/{REPO_PATH}/-/pipelines/1',
+			'commit': {'sha': sha}, 'repository': repository}),
+			f'{coalesce}-{next(delivery_ids)}').get_response(app)
+
+	github_standin.reset_calls()
+	gitlab_standin.reset_calls()
+	saved = sum(COALESCED_READS.value(backend) for backend in ('github', 'gitlab'))
+	start = time.perf_counter()
+	with ThreadPoolExecutor(options.deliveries) as executor:
+		list(executor.map(deliver, range(options.deliveries)))
+	wall = time.perf_counter() - start
+	return {
+		'github': sum(github_standin.reset_calls().values()),
+		'gitlab': sum(gitlab_standin.reset_calls().values()),
+		'saved': sum(COALESCED_READS.value(backend) for backend in ('github', 'gitlab')) - saved,
+		'wall': wall}
+
+
+def main(args: List[str]) -> None:
+	"""Run benchmark."""
+	parser = argparse.ArgumentParser(prog='bench single_flight', description=__doc__.splitlines()[0])
+	parser.add_argument('--deliveries', type=int, default=8, help='count of deliveries at once')
+	parser.add_argument('--prs', type=int, default=100, help='count of open PRs')
+	parser.add_argument('--latency-ms', type=float, default=50, help='latency of fake APIs')
+	options = parser.parse_args(args)
+	fake_github = FakeGithub(REPO_PATH, pr_count=options.prs)
+	fake_gitlab = FakeGitlab(REPO_PATH)
+	fake_gitlab.pipeline_sha = fake_github.pr_sha(1)
+	latency = options.latency_ms / 1000
+	with StandinServer(fake_github, latency) as github_standin, \
+	     StandinServer(fake_gitlab, latency) as gitlab_standin:
+		fake_github.target_url = github_standin.url
+		fake_gitlab.target_url = gitlab_standin.url
+		print(f'{"coalescing":<10} {"GH calls":>8} {"GL calls":>8} {"saved":>6} {"wall, s":>8}')
+		for name, coalesce in (('off', False), ('on', True)):
+			result = _run(coalesce, options, fake_github, github_standin, gitlab_standin)
+			print(f'{name:<10} {result["github"]:>8} {result["gitlab"]:>8} {result["saved"]:>6.0f}'
+			      + f' {result["wall"]:>8.2f}')
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
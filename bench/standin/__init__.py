@@ -0,0 +1 @@
+"""Package for fake GitHub, GitLab and Redis servers of benchmarks."""
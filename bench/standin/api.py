@@ -0,0 +1,59 @@
+"""Module for base of fake APIs served by `hublabbot.standin.server.StandinServer`."""
+from typing import Callable, Dict, List, Match, NamedTuple, Optional, Tuple
+import re
+from urllib.parse import urlsplit, parse_qs
+
+from hublabbot.standin.server import json_response
+from bench.standin.git import is_git_path, git_http_backend
+
+
+Route = Tuple[str, str, str]
+"""Type - `(method, path regex, name of handler method)`."""
+
+
+class FakeRequest(NamedTuple):
+	"""Request to handler of `FakeApi`."""
+
+	match: Match[str]
+	"""Match of path regex."""
+	query: Dict[str, str]
+	"""Query params, first value of each."""
+	headers: Dict[str, str]
+	"""Headers with lowercase names."""
+	body: bytes
+	"""Request body."""
+
+
+class FakeApi:
+	"""Base of fake APIs, routes requests to handler methods.
+
+	It is `hublabbot.standin.server.Responder`.
+
+	Handlers take `FakeRequest` and return `(status, headers, body)`.
+	Requests of git smart HTTP are served from `git_root`, if it is set.
+	"""
+
+	routes: List[Route] = []
+	"""Routes of API."""
+
+	def __init__(self, git_root: Optional[str] = None):
+		self.git_root = git_root
+		"""Dir with bare repos, like `{git_root}/{namespace}/{repo name}.git`."""
+		self.target_url = ''
+		"""URL of stand-in, set it after stand-in started."""
+		self._routes = [(method, re.compile(regex), name) for method, regex, name in self.routes]
+
+	def __call__(self, method: str, path: str, headers: Dict[str, str],
+	             body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+		"""Route request to handler."""
+		if self.git_root is not None and is_git_path(path):
+			return git_http_backend(self.git_root, method, path, headers, body)
+		parts = urlsplit(path)
+		query = {name: values[0] for name, values in parse_qs(parts.query).items()}
+		for route_method, regex, name in self._routes:
+			match = regex.fullmatch(parts.path)
+			if route_method == method and match is not None:
+				handler: Callable[[FakeRequest], Tuple[int, Dict[str, str], bytes]] = getattr(self, name)
+				lower_headers = {header.lower(): value for header, value in headers.items()}
+				return handler(FakeRequest(match, query, lower_headers, body))
+		return json_response(404, b'{"message": "404 Not Found"}')
@@ -0,0 +1,56 @@
+"""Module for git smart HTTP in stand-ins, served by `git http-backend`."""
+from typing import Dict, Tuple
+import os
+import subprocess
+from urllib.parse import urlsplit
+
+
+def is_git_path(path: str) -> bool:
+	"""Check `path` is request of git smart HTTP protocol."""
+	path = urlsplit(path).path
+	return path.endswith(('/info/refs', '/git-upload-pack', '/git-receive-pack'))
+
+
+def git_http_backend(project_root: str, method: str, path: str, headers: Dict[str, str],
+                     body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+	"""Serve git smart HTTP request with `git http-backend` CGI, push is allowed.
+
+	Args:
+		project_root: Dir with bare repos, like `{project_root}/{namespace}/{repo name}.git`.
+		method: HTTP method.
+		path: Path with query.
+		headers: Request headers.
+		body: Request body.
+
+	Returns:
+		`(status, headers, body)`.
+
+	"""
+	parts = urlsplit(path)
+	lower_headers = {name.lower(): value for name, value in headers.items()}
+	env = {
+		'PATH': os.environ.get('PATH', ''),
+		'GIT_PROJECT_ROOT': project_root,
+		'GIT_HTTP_EXPORT_ALL': '1',
+		'REMOTE_USER': 'standin',
+		'REMOTE_ADDR': '127.0.0.1',
+		'REQUEST_METHOD': method,
+		'PATH_INFO': parts.path,
+		'QUERY_STRING': parts.query,
+		'CONTENT_TYPE': lower_headers.get('content-type', ''),
+		'CONTENT_LENGTH': str(len(body))}
+	if 'content-encoding' in lower_headers:
+		env['HTTP_CONTENT_ENCODING'] = lower_headers['content-encoding']
+	output = subprocess.run(['git', 'http-backend'], input=body, env=env,
+	                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False).stdout
+	separator = b'\r\n\r\n' if b'\r\n\r\n' in output else b'\n\n'
+	raw_headers, _, resp_body = output.partition(separator)
+	status = 200
+	resp_headers: Dict[str, str] = {}
+	for line in raw_headers.decode('latin-1').splitlines():
+		name, _, value = line.partition(':')
+		if name.lower() == 'status':
+			status = int(value.split()[0])
+		elif name != '':
+			resp_headers[name] = value.strip()
+	return status, resp_headers, resp_body
@@ -0,0 +1,265 @@
+"""Module for fake GitHub REST API with synthetic repo."""
+from typing import Dict, List, Optional, Set, Tuple
+import json
+import time
+import hashlib
+from threading import Lock
+
+from hublabbot.util import JsonDict
+from hublabbot.standin.server import json_response
+from bench.standin.api import FakeApi, FakeRequest, Route
+
+
+_Response = Tuple[int, Dict[str, str], bytes]
+_REPO = r'/repos/(?P<repo>[^/]+/[^/]+)'
+
+
+def fake_sha(seed: str) -> str:
+	"""Returns fake commit sha for `seed`."""
+	return hashlib.sha1(seed.encode()).hexdigest()
+
+
+class FakeGithub(FakeApi):
+	"""Fake GitHub REST API and GraphQL query of auto-merge candidates, served at root of URL.
+
+	Repo has `pr_count` open PRs with numbers from `1`, every PR has label `label` and it is made
+	by `login`. PRs with even numbers are external.
+
+	Attributes:
+		repo_path: Path like {namespace}/{repo name}.
+		pr_count: Count of open PRs.
+		per_page: Page size of lists.
+		tokens: Logins of users by tokens, unknown tokens are `login`.
+		login: Default login.
+		label: Label of PRs.
+		head_shas: Overrided head shas of PRs, by PR number.
+		statuses: Overrided states of head commit statuses of PRs, by PR number, default is
+			`'SUCCESS'`. Combined status of commit, which isn't head of PR, is pending.
+		merged: Numbers of merged PRs.
+		comments: Posted comments as `(PR number, body)`.
+		apps: Public keys (PEM) of GitHub Apps by App ID, every App is installed on every repo
+			and ID of installation is ID of App.
+		token_ttl: Lifetime of minted installation tokens, in seconds.
+		uninstalled: IDs of Apps, which aren't installed on repos.
+		installation_tokens: Minted installation tokens as `(installation ID, token)`.
+		require_up_to_date: Base branch requires PRs to be up to date, open PRs are behind
+			after every merge, PR behind isn't merged.
+		behind: Numbers of PRs behind base branch.
+		updated_branches: Numbers of PRs updated with base branch by API, in order.
+		failed_merges: Count of refused merges.
+
+	"""
+
+	routes: List[Route] = [
+		('GET', r'/user', '_get_user'),
+		('GET', _REPO, '_get_repo'),
+		('GET', _REPO + r'/pulls', '_get_pulls'),
+		('GET', _REPO + r'/pulls/(?P<number>\d+)', '_get_pull'),
+		('PUT', _REPO + r'/pulls/(?P<number>\d+)/merge', '_merge_pull'),
+		('PUT', _REPO + r'/pulls/(?P<number>\d+)/update-branch', '_update_branch'),
+		('POST', _REPO + r'/issues/(?P<number>\d+)/comments', '_create_comment'),
+		('GET', _REPO + r'/branches/(?P<branch>.+)', '_get_branch'),
+		('GET', _REPO + r'/commits/(?P<sha>\w+)', '_get_commit'),
+		('GET', _REPO + r'/commits/(?P<sha>\w+)/status', '_get_combined_status'),
+		('POST', r'/graphql', '_graphql'),
+		('GET', _REPO + r'/installation', '_get_installation'),
+		('POST', r'/app/installations/(?P<id>\d+)/access_tokens', '_create_installation_token')]
+
+	def __init__(self, repo_path: str, pr_count: int = 30, per_page: int = 30,
+	             tokens: Optional[Dict[str, str]] = None, login: str = 'standin',
+	             label: str = 'auto-merge', git_root: Optional[str] = None,
+	             apps: Optional[Dict[int, str]] = None, token_ttl: float = 3600):
+		super().__init__(git_root)
+		self.repo_path = repo_path
+		self.pr_count = pr_count
+		self.per_page = per_page
+		self.tokens = tokens or {}
+		self.login = login
+		self.label = label
+		self.head_shas: Dict[int, str] = {}
+		self.statuses: Dict[int, str] = {}
+		self.merged: Set[int] = set()
+		self.comments: List[Tuple[int, str]] = []
+		self.apps = apps or {}
+		self.token_ttl = token_ttl
+		self.installation_tokens: List[Tuple[int, str]] = []
+		self.uninstalled: Set[int] = set()
+		self.require_up_to_date = False
+		self.behind: Set[int] = set()
+		self.updated_branches: List[int] = []
+		self.failed_merges = 0
+		self._lock = Lock()
+
+	def pr_sha(self, number: int) -> str:
+		"""Returns head sha of PR."""
+		return self.head_shas.get(number, fake_sha(f'pr-{number}'))
+
+	def branch_sha(self, branch: str) -> str:
+		"""Returns head sha of branch, branches `branch-{N}` are heads of PRs."""
+		if branch.startswith('branch-') and branch[len('branch-'):].isdigit():
+			return self.pr_sha(int(branch[len('branch-'):]))
+		return fake_sha(f'branch-{branch}')
+
+	def _repo_json(self, repo_path: str) -> JsonDict:
+		return {
+			'id': 1,
+			'name': repo_path.split('/')[1],
+			'full_name': repo_path,
+			'owner': {'login': repo_path.split('/')[0]},
+			'url': f'{self.target_url}/repos/{repo_path}',
+			'html_url': f'https://github.com/{repo_path}'}
+
+	def pr_json(self, number: int) -> JsonDict:
+		"""Returns JSON of PR."""
+		head_repo = f'fork-{number}/repo' if number % 2 == 0 else self.repo_path
+		url = f'{self.target_url}/repos/{self.repo_path}'
+		return {
+			'id': number,
+			'number': number,
+			'url': f'{url}/pulls/{number}',
+			'issue_url': f'{url}/issues/{number}',
+			'html_url': f'https://github.com/{self.repo_path}/pull/{number}',
+			'title': f'PR #{number}',
+			'state': 'closed' if number in self.merged else 'open',
+			'merged': number in self.merged,
+			'mergeable': True,
+			'mergeable_state': 'behind' if number in self.behind else 'clean',
+			'user': {'login': self.login, 'id': 1},
+			'labels': [{'id': 1, 'name': self.label, 'color': '852576'}],
+			'head': {'sha': self.pr_sha(number), 'ref': f'branch-{number}',
+			         'repo': self._repo_json(head_repo)},
+			'base': {'sha': self.branch_sha('master'), 'ref': 'master',
+			         'repo': self._repo_json(self.repo_path)}}
+
+	def _get_user(self, request: FakeRequest) -> _Response:
+		token = request.headers.get('authorization', '').split(' ')[-1]
+		login = self.tokens.get(token, self.login)
+		return json_response(200, {'login': login, 'id': 1, 'type': 'User',
+		                           'html_url': f'https://github.com/{login}',
+		                           'avatar_url': f'https://github.com/{login}.png'})
+
+	def _get_repo(self, request: FakeRequest) -> _Response:
+		return json_response(200, self._repo_json(request.match['repo']))
+
+	def _get_pulls(self, request: FakeRequest) -> _Response:
+		page = int(request.query.get('page', 1))
+		per_page = int(request.query.get('per_page', self.per_page))
+		last_page = max((self.pr_count + per_page - 1) // per_page, 1)
+		numbers = range(self.pr_count - (page - 1) * per_page,
+		                max(self.pr_count - page * per_page, 0), -1)
+		url = f'{self.target_url}/repos/{request.match["repo"]}/pulls?per_page={per_page}'
+		links = [f'<{url}&page={last_page}>; rel="last"']
+		if page < last_page:
+			links.append(f'<{url}&page={page + 1}>; rel="next"')
+		return json_response(200, [self.pr_json(n) for n in numbers],
+		                     {'Link': ', '.join(links)})
+
+	def _get_pull(self, request: FakeRequest) -> _Response:
+		return json_response(200, self.pr_json(int(request.match['number'])))
+
+	def _get_commit(self, request: FakeRequest) -> _Response:
+		sha = request.match['sha']
+		return json_response(200, {
+			'sha': sha, 'url': f'{self.target_url}/repos/{request.match["repo"]}/commits/{sha}'})
+
+	def _get_combined_status(self, request: FakeRequest) -> _Response:
+		sha = request.match['sha']
+		numbers = [n for n in range(1, self.pr_count + 1) if self.pr_sha(n) == sha]
+		state = self.statuses.get(numbers[0], 'SUCCESS') if len(numbers) > 0 else 'PENDING'
+		return json_response(200, {'state': state.lower(), 'sha': sha, 'total_count': 0, 'statuses': []})
+
+	def _merge_pull(self, request: FakeRequest) -> _Response:
+		number = int(request.match['number'])
+		sha = json.loads(request.body or b'{}').get('sha')
+		with self._lock:
+			if sha is not None and sha != self.pr_sha(number):
+				self.failed_merges += 1
+				return json_response(409, {'message': 'Head branch was modified.'})
+			if self.require_up_to_date and number in self.behind:
+				self.failed_merges += 1
+				return json_response(405, {'message': 'Head branch is out of date.'})
+			self.merged.add(number)
+			if self.require_up_to_date:
+				self.behind |= set(range(1, self.pr_count + 1)) - self.merged
+		return json_response(200, {'sha': self.pr_sha(number), 'merged': True,
+		                           'message': 'Pull Request successfully merged'})
+
+	def _update_branch(self, request: FakeRequest) -> _Response:
+		number = int(request.match['number'])
+		expected_sha = json.loads(request.body or b'{}').get('expected_head_sha')
+		with self._lock:
+			if expected_sha is not None and expected_sha != self.pr_sha(number):
+				return json_response(422, {'message': 'expected head sha didn\'t match current head ref.'})
+			self.behind.discard(number)
+			self.updated_branches.append(number)
+			self.head_shas[number] = fake_sha(f'pr-{number}-update-{len(self.updated_branches)}')
+		return json_response(202, {'message': 'Updating pull request branch.',
+		                           'url': f'https://github.com/{self.repo_path}/pull/{number}'})
+
+	def _create_comment(self, request: FakeRequest) -> _Response:
+		number = int(request.match['number'])
+		comment = json.loads(request.body)['body']
+		with self._lock:
+			self.comments.append((number, comment))
+		return json_response(201, {'id': len(self.comments), 'body': comment,
+		                           'user': {'login': self.login}})
+
+	def _get_branch(self, request: FakeRequest) -> _Response:
+		branch = request.match['branch']
+		return json_response(200, {'name': branch, 'protected': branch == 'master',
+		                           'commit': {'sha': self.branch_sha(branch)}})
+
+	def _graphql(self, request: FakeRequest) -> _Response:
+		"""Answers `hublabbot.github.github_webhook.AUTO_MERGE_CANDIDATES_QUERY`."""
+		variables = json.loads(request.body)['variables']
+		page_size = 100
+		start = int(variables['cursor'] or 0)
+		numbers = [n for n in range(1, self.pr_count + 1) if n not in self.merged]
+		if variables['label'] != self.label:
+			numbers = []
+		nodes = [{
+			'number': n,
+			'author': {'login': self.login},
+			'mergeable': 'MERGEABLE',
+			'headRefOid': self.pr_sha(n),
+			'commits': {'nodes': [{'commit': {'status': {'state': self.statuses.get(n, 'SUCCESS')}}}]}
+		} for n in numbers[start:start + page_size]]
+		has_next = start + page_size < len(numbers)
+		return json_response(200, {'data': {'repository': {'pullRequests': {
+			'pageInfo': {'hasNextPage': has_next, 'endCursor': str(start + page_size)},
+			'nodes': nodes}}}})
+
+	def _verify_jwt(self, request: FakeRequest) -> Optional[int]:
+		"""Returns ID of App, which signed JWT in 'Authorization: Bearer', `None` if it's invalid."""
+		import jwt  # type: ignore
+		token = request.headers.get('authorization', '').partition('Bearer ')[2]
+		try:
+			app_id = int(jwt.decode(token, options={'verify_signature': False})['iss'])
+			if app_id not in self.apps:
+				return None
+			jwt.decode(token, self.apps[app_id], algorithms=['RS256'])
+		except (jwt.InvalidTokenError, KeyError, ValueError):
+			return None
+		return app_id
+
+	def _get_installation(self, request: FakeRequest) -> _Response:
+		app_id = self._verify_jwt(request)
+		if app_id is None:
+			return json_response(401, {'message': 'A JSON web token could not be decoded'})
+		if app_id in self.uninstalled:
+			return json_response(404, {'message': 'Not Found'})
+		return json_response(200, {'id': app_id, 'app_id': app_id,
+		                           'account': {'login': request.match['repo'].split('/')[0]}})
+
+	def _create_installation_token(self, request: FakeRequest) -> _Response:
+		installation_id = int(request.match['id'])
+		if self._verify_jwt(request) != installation_id:
+			return json_response(401, {'message': 'A JSON web token could not be decoded'})
+		if installation_id in self.uninstalled:
+			return json_response(404, {'message': 'Not Found'})
+		with self._lock:
+			token = f'ghs_standin{installation_id}x{len(self.installation_tokens)}'
+			self.installation_tokens.append((installation_id, token))
+			self.tokens[token] = f'standin-app-{installation_id}[bot]'
+		expires_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + self.token_ttl))
+		return json_response(201, {'token': token, 'expires_at': expires_at})
@@ -0,0 +1,199 @@
+"""Module for fake GitLab v4 API with synthetic project."""
+from typing import Dict, List, Optional, Set, Tuple
+import time
+from urllib.parse import unquote
+from threading import Lock
+
+from hublabbot.util import JsonDict
+from hublabbot.standin.server import json_response
+from bench.standin.api import FakeApi, FakeRequest, Route
+from bench.standin.github import fake_sha
+
+
+_Response = Tuple[int, Dict[str, str], bytes]
+_PROJECT = r'/api/v4/projects/(?P<project>[^/]+)'
+
+
+def fake_log(size: int, sections: int = 5) -> bytes:
+	"""Returns fake log of GitLab CI job with sections and ANSI escape codes, about `size` bytes."""
+	lines: List[str] = []
+	timestamp = 1600000000
+	line_count = max(size // 60, sections)
+	for section in range(sections):
+		lines.append(f'section_start:{timestamp}:step_{section}\r\x1b[0K\x1b[32;1mStep {section}\x1b[0;m')
+		for number in range(line_count // sections):
+			lines.append(f'\x1b[0K[step {section}] line {number}: some output of build tool')
+		timestamp += 10 + section * 30
+		lines.append(f'section_end:{timestamp}:step_{section}\r\x1b[0K')
+	lines.append('\x1b[31;1mERROR: Job failed: exit code 1\x1b[0;m')
+	return '\n'.join(lines).encode() + b'\n'
+
+
+class FakeGitlab(FakeApi):
+	"""Fake GitLab v4 API, stand-in serves it at root of URL.
+
+	Project has `pipeline_count` running pipelines with IDs from `1` on every ref, pipeline with
+	biggest ID is newest. Pipelines listed without ref are spread over `pipeline_refs`.
+	Every pipeline has one failed job with ID equal to pipeline ID. Branch `master` is protected.
+	Successful pipelines took `pipeline_duration`, running ones started one minute ago.
+
+	Attributes:
+		project_path: Path like {namespace}/{repo name}.
+		pipeline_count: Count of running pipelines on every ref.
+		per_page: Page size of lists.
+		log_size: Size of job's log in bytes.
+		pipeline_sha: Sha of pipelines.
+		canceled: IDs of canceled pipelines.
+		deleted_pipelines: IDs of deleted pipelines.
+		deleted_branches: Names of deleted branches.
+		pipeline_refs: Refs of pipelines listed without ref.
+		pipeline_duration: Duration of successful pipelines, in seconds.
+		branches: Names of listed branches, except deleted ones.
+
+	"""
+
+	routes: List[Route] = [
+		('GET', _PROJECT, '_get_project'),
+		('GET', _PROJECT + r'/pipelines', '_list_pipelines'),
+		('GET', _PROJECT + r'/pipelines/(?P<id>\d+)', '_get_pipeline'),
+		('DELETE', _PROJECT + r'/pipelines/(?P<id>\d+)', '_delete_pipeline'),
+		('POST', _PROJECT + r'/pipelines/(?P<id>\d+)/cancel', '_cancel_pipeline'),
+		('GET', _PROJECT + r'/pipelines/(?P<id>\d+)/jobs', '_list_pipeline_jobs'),
+		('GET', _PROJECT + r'/jobs/(?P<id>\d+)', '_get_job'),
+		('GET', _PROJECT + r'/jobs/(?P<id>\d+)/trace', '_get_trace'),
+		('GET', _PROJECT + r'/repository/branches', '_list_branches'),
+		('GET', _PROJECT + r'/repository/branches/(?P<branch>.+)', '_get_branch'),
+		('DELETE', _PROJECT + r'/repository/branches/(?P<branch>.+)', '_delete_branch'),
+		('GET', _PROJECT + r'/protected_branches', '_list_protected_branches'),
+		('GET', _PROJECT + r'/hooks', '_list_hooks')]
+
+	def __init__(self, project_path: str, pipeline_count: int = 20, per_page: int = 20,
+	             log_size: int = 64 * 1024, git_root: Optional[str] = None):
+		super().__init__(git_root)
+		self.project_path = project_path
+		self.pipeline_count = pipeline_count
+		self.per_page = per_page
+		self.log_size = log_size
+		self.pipeline_sha = fake_sha('pipeline')
+		self.canceled: Set[int] = set()
+		self.deleted_pipelines: Set[int] = set()
+		self.deleted_branches: Set[str] = set()
+		self.pipeline_refs = ['master']
+		self.pipeline_duration = 600.0
+		self.branches = ['master']
+		self._lock = Lock()
+		self._log = fake_log(log_size)
+
+	def _web_url(self, path: str) -> str:
+		return f'{self.target_url}/{self.project_path}/-/{path}'
+
+	def pipeline_json(self, pipeline_id: int, ref: str = 'master',
+	                  status: str = 'running') -> JsonDict:
+		"""Returns JSON of pipeline."""
+		now = time.time()
+		started = now - self.pipeline_duration if status == 'success' else now - 60
+		return {
+			'id': pipeline_id,
+			'sha': self.pipeline_sha,
+			'ref': ref,
+			'status': 'canceled' if pipeline_id in self.canceled else status,
+			'source': 'push',
+			'yaml_errors': None,
+			'created_at': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(started)),
+			'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(now)),
+			'web_url': self._web_url(f'pipelines/{pipeline_id}')}
+
+	def job_json(self, job_id: int) -> JsonDict:
+		"""Returns JSON of failed job."""
+		return {
+			'id': job_id,
+			'name': 'test',
+			'stage': 'test',
+			'status': 'failed',
+			'web_url': self._web_url(f'jobs/{job_id}'),
+			'pipeline': {'id': job_id, 'sha': self.pipeline_sha, 'ref': 'master'}}
+
+	def _get_project(self, request: FakeRequest) -> _Response:
+		path = unquote(request.match['project'])
+		return json_response(200, {'id': 1, 'path_with_namespace': path,
+		                           'web_url': f'{self.target_url}/{path}'})
+
+	def _list_pipelines(self, request: FakeRequest) -> _Response:
+		page = int(request.query.get('page', 1))
+		per_page = int(request.query.get('per_page', self.per_page))
+		ref = request.query.get('ref')
+		status = request.query.get('status')
+		last_page = max((self.pipeline_count + per_page - 1) // per_page, 1)
+		if status not in (None, 'running', 'success') or request.query.get('scope') == 'tags':
+			return json_response(200, [], {'X-Page': '1', 'X-Total-Pages': '1', 'X-Total': '0'})
+		ids = range(self.pipeline_count - (page - 1) * per_page,
+		            max(self.pipeline_count - page * per_page, 0), -1)
+		headers = {'X-Page': str(page), 'X-Per-Page': str(per_page),
+		           'X-Total': str(self.pipeline_count), 'X-Total-Pages': str(last_page)}
+		if page < last_page:
+			headers['X-Next-Page'] = str(page + 1)
+			query = '&'.join(f'{name}={value}' for name, value in request.query.items() if name != 'page')
+			headers['Link'] = (f'<{self.target_url}/api/v4/projects/{request.match["project"]}/pipelines'
+			                   + f'?{query}&page={page + 1}>; rel="next"')
+		return json_response(200, [self.pipeline_json(
+			i, ref or self.pipeline_refs[(i - 1) % len(self.pipeline_refs)], status or 'running')
+			for i in ids], headers)
+
+	def _get_pipeline(self, request: FakeRequest) -> _Response:
+		return json_response(200, self.pipeline_json(int(request.match['id'])))
+
+	def _delete_pipeline(self, request: FakeRequest) -> _Response:
+		with self._lock:
+			self.deleted_pipelines.add(int(request.match['id']))
+		return 204, {}, b''
+
+	def _cancel_pipeline(self, request: FakeRequest) -> _Response:
+		pipeline_id = int(request.match['id'])
+		with self._lock:
+			self.canceled.add(pipeline_id)
+		return json_response(201, self.pipeline_json(pipeline_id))
+
+	def _list_pipeline_jobs(self, request: FakeRequest) -> _Response:
+		return json_response(200, [self.job_json(int(request.match['id']))])
+
+	def _get_job(self, request: FakeRequest) -> _Response:
+		return json_response(200, self.job_json(int(request.match['id'])))
+
+	def _get_trace(self, request: FakeRequest) -> _Response:
+		return 200, {'Content-Type': 'text/plain'}, self._log
+
+	def _list_branches(self, request: FakeRequest) -> _Response:
+		page = int(request.query.get('page', 1))
+		per_page = int(request.query.get('per_page', self.per_page))
+		with self._lock:
+			names = [name for name in self.branches if name not in self.deleted_branches]
+		last_page = max((len(names) + per_page - 1) // per_page, 1)
+		headers = {'X-Page': str(page), 'X-Per-Page': str(per_page),
+		           'X-Total': str(len(names)), 'X-Total-Pages': str(last_page)}
+		if page < last_page:
+			headers['X-Next-Page'] = str(page + 1)
+			headers['Link'] = (f'<{self.target_url}/api/v4/projects/{request.match["project"]}'
+			                   + f'/repository/branches?per_page={per_page}&page={page + 1}>; rel="next"')
+		branches = [{'name': name, 'protected': name == 'master', 'default': name == 'master'}
+		            for name in names[(page - 1) * per_page:page * per_page]]
+		return json_response(200, branches, headers)
+
+	def _get_branch(self, request: FakeRequest) -> _Response:
+		branch = unquote(request.match['branch'])
+		if branch in self.deleted_branches:
+			return json_response(404, {'message': '404 Branch Not Found'})
+		return json_response(200, {'name': branch, 'protected': branch == 'master'})
+
+	def _delete_branch(self, request: FakeRequest) -> _Response:
+		branch = unquote(request.match['branch'])
+		with self._lock:
+			if branch in self.deleted_branches:
+				return json_response(404, {'message': '404 Branch Not Found'})
+			self.deleted_branches.add(branch)
+		return 204, {}, b''
+
+	def _list_protected_branches(self, request: FakeRequest) -> _Response:
+		return json_response(200, [{'id': 1, 'name': 'master'}])
+
+	def _list_hooks(self, request: FakeRequest) -> _Response:
+		return json_response(200, [])
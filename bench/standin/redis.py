@@ -0,0 +1,183 @@
+"""Module for stand-in of Redis server, used to test `hublabbot.store.RedisStore`."""
+from typing import Any, Dict, List, Optional, Tuple
+import re
+import time
+import fnmatch
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from threading import Lock, Thread
+
+from hublabbot.store import RedisStore
+
+
+class FakeRedis:
+	"""Threaded RESP server on localhost, supports commands used by `hublabbot.store.RedisStore`.
+
+	Supported: `PING`, `AUTH`, `SELECT`, `GET`, `SET` (with `NX`, `XX`, `PX`, `EX`), `DEL`,
+	`SCAN` (in one batch), `MGET` and `EVAL` of `RedisStore.LEASE_SCRIPT` and
+	`RedisStore.REPLACE_SCRIPT`.
+
+	Attributes:
+		password: Password required by `AUTH`, `None` - not required.
+		calls: Count of calls by command.
+
+	"""
+
+	def __init__(self, password: Optional[str] = None, host: str = '127.0.0.1', port: int = 0):
+		self.password = password
+		self.calls: Dict[str, int] = {}
+		self._lock = Lock()
+		self._data: Dict[int, Dict[bytes, Tuple[Optional[float], bytes]]] = {}
+		self._server = ThreadingTCPServer((host, port), self._make_handler())
+		self._server.daemon_threads = True
+		self._thread: Optional[Thread] = None
+
+	@property
+	def url(self) -> str:
+		"""URL of server for `hublabbot.store.make_store`."""
+		host, port = self._server.server_address[:2]
+		if isinstance(host, bytes):
+			host = host.decode()
+		auth = f':{self.password}@' if self.password is not None else ''
+		return f'redis://{auth}{host}:{port}/0'
+
+	def _db(self, db: int) -> Dict[bytes, Tuple[Optional[float], bytes]]:
+		data = self._data.setdefault(db, {})
+		now = time.monotonic()
+		expired = [key for key, (expires_at, _) in data.items()
+		           if expires_at is not None and expires_at <= now]
+		for key in expired:
+			del data[key]
+		return data
+
+	def execute(self, db: int, args: List[bytes]) -> Any:
+		"""Execute command `args` in database `db`.
+
+		Returns:
+			Reply: `str` - status, `Exception` - error, `int`, `bytes`, `list` or `None`.
+
+		"""
+		command = args[0].upper().decode()
+		with self._lock:
+			self.calls[command] = self.calls.get(command, 0) + 1
+			data = self._db(db)
+			if command == 'PING':
+				return 'PONG'
+			if command == 'GET':
+				item = data.get(args[1])
+				return item[1] if item is not None else None
+			if command == 'SET':
+				return self._set(data, args[1], args[2], [arg.upper() for arg in args[3:]])
+			if command == 'DEL':
+				return sum(1 for key in args[1:] if data.pop(key, None) is not None)
+			if command == 'MGET':
+				items = [data.get(key) for key in args[1:]]
+				return [item[1] if item is not None else None for item in items]
+			if command == 'SCAN':
+				pattern = args[args.index(b'MATCH') + 1].decode() if b'MATCH' in args else '*'
+				# escaped char of Redis glob to set of `fnmatch`
+				pattern = re.sub(r'\\(.)', r'[\1]', pattern)
+				return [b'0', [key for key in data if fnmatch.fnmatchcase(key.decode(), pattern)]]
+			if command == 'EVAL' and args[1].decode() == RedisStore.REPLACE_SCRIPT:
+				key, expected, value, ttl_ms = args[3], args[4], args[5], args[6]
+				item = data.get(key)
+				if item is None or item[1] != expected:
+					return 0
+				self._set(data, key, value, [b'PX', ttl_ms] if ttl_ms != b'' else [])
+				return 1
+			if command == 'EVAL':
+				if args[1].decode() != RedisStore.LEASE_SCRIPT:
+					return Exception('ERR only lease and replace scripts are supported by stand-in')
+				name, owner, ttl_ms = args[3], args[4], args[5]
+				item = data.get(name)
+				if item is not None and item[1] != owner:
+					return 0
+				self._set(data, name, owner, [b'PX', ttl_ms])
+				return 1
+		return Exception(f'ERR unknown command \'{command}\'')
+
+	@staticmethod
+	def _set(data: Dict[bytes, Tuple[Optional[float], bytes]], key: bytes, value: bytes,
+	         options: List[bytes]) -> Optional[str]:
+		if (b'NX' in options and key in data) or (b'XX' in options and key not in data):
+			return None
+		expires_at = None
+		if b'PX' in options:
+			expires_at = time.monotonic() + int(options[options.index(b'PX') + 1]) / 1000
+		elif b'EX' in options:
+			expires_at = time.monotonic() + int(options[options.index(b'EX') + 1])
+		data[key] = (expires_at, value)
+		return 'OK'
+
+	def _make_handler(self) -> Any:
+		server = self
+
+		class Handler(StreamRequestHandler):
+			def _read_command(self) -> Optional[List[bytes]]:
+				line = self.rfile.readline()
+				if not line.startswith(b'*'):
+					return None
+				args = []
+				for _ in range(int(line[1:-2])):
+					size = int(self.rfile.readline()[1:-2])
+					args.append(self.rfile.read(size + 2)[:-2])
+				return args
+
+			def _write(self, reply: Any) -> None:
+				self.wfile.write(b''.join(_encode(reply)))
+
+			def handle(self) -> None:
+				db = 0
+				authorized = server.password is None
+				while True:
+					args = self._read_command()
+					if args is None:
+						return
+					command = args[0].upper()
+					if command == b'AUTH':
+						authorized = args[-1].decode() == server.password
+						self._write('OK' if authorized else Exception('WRONGPASS invalid password'))
+					elif not authorized:
+						self._write(Exception('NOAUTH Authentication required.'))
+					elif command == b'SELECT':
+						db = int(args[1])
+						self._write('OK')
+					else:
+						self._write(server.execute(db, args))
+
+		return Handler
+
+	def start(self) -> 'FakeRedis':
+		"""Start server in background thread."""
+		self._thread = Thread(target=self._server.serve_forever, daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self) -> None:
+		"""Stop server."""
+		self._server.shutdown()
+		self._server.server_close()
+
+	def __enter__(self) -> 'FakeRedis':
+		"""Start server."""
+		return self.start()
+
+	def __exit__(self, *args: Any) -> None:
+		"""Stop server."""
+		self.stop()
+
+
+def _encode(reply: Any) -> List[bytes]:
+	if reply is None:
+		return [b'$-1\r\n']
+	if isinstance(reply, str):
+		return [b'+%b\r\n' % reply.encode()]
+	if isinstance(reply, Exception):
+		return [b'-%b\r\n' % str(reply).encode()]
+	if isinstance(reply, int):
+		return [b':%d\r\n' % reply]
+	if isinstance(reply, bytes):
+		return [b'$%d\r\n%b\r\n' % (len(reply), reply)]
+	chunks = [b'*%d\r\n' % len(reply)]
+	for item in reply:
+		chunks += _encode(item)
+	return chunks
@@ -0,0 +1,158 @@
+"""Benchmark of startup time: import time per module and time-to-bind-port.
+
+Server is started in subprocess against fake GitHub API (settings fetch bot's login on start).
+Fails with exit code `1` if median time exceeds budget.
+
+Usage: `bench startup [--repeat N] [--top N] [--import-budget-ms N] [--bind-budget-ms N]
+[--save PATH]`.
+"""
+from typing import Dict, List, Tuple
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+
+from hublabbot.standin.server import StandinServer
+from bench.standin.github import FakeGithub
+from bench.util import GH_SECRET, GL_SECRET
+
+
+ENTRY_MODULE = 'hublabbot.main'
+"""Module imported by `hublabbot` entry point."""
+RESULTS_PATH = 'tools/log/bench/startup.json'
+"""Default path to save results."""
+BIND_TIMEOUT = 30
+"""Timeout of server start, in seconds."""
+
+
+def _median(values: List[float]) -> float:
+	return sorted(values)[len(values) // 2]
+
+
+def _import_times() -> Dict[str, Tuple[float, float]]:
+	"""Import time of every module imported by entry module.
+
+	Returns:
+		Self and cumulative time in ms by module name.
+
+	"""
+	proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {ENTRY_MODULE}'],
+	                      stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+	times: Dict[str, Tuple[float, float]] = {}
+	for line in proc.stderr.decode().splitlines():
+		if not line.startswith('import time:') or 'self [us]' in line:
+			continue
+		self_us, cumulative_us, name = line[len('import time:'):].split('|')
+		times[name.strip()] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+	return times
+
+
+def _free_port() -> int:
+	with socket.socket() as sock:
+		sock.bind(('127.0.0.1', 0))
+		port: int = sock.getsockname()[1]
+		return port
+
+
+def _time_to_bind(settings_path: str, env: Dict[str, str]) -> float:
+	"""Start server and wait until its port accepts connections.
+
+	Returns:
+		Time from process spawn to bound port, in ms.
+
+	"""
+	port = _free_port()
+	start = time.perf_counter()
+	proc = subprocess.Popen([sys.executable, '-m', ENTRY_MODULE, settings_path],
+	                        env=dict(env, HUBLABBOT_PORT=str(port)),
+	                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	try:
+		while time.perf_counter() - start < BIND_TIMEOUT:
+			if proc.poll() is not None:
+				raise RuntimeError(f'Server exited with code {proc.returncode}!')
+			try:
+				socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+				return (time.perf_counter() - start) * 1000
+			except OSError:
+				time.sleep(0.002)
+		raise RuntimeError(f'Server not started in {BIND_TIMEOUT} seconds!')
+	finally:
+		proc.terminate()
+		proc.wait()
+
+
+def _interpreter_start() -> float:
+	start = time.perf_counter()
+	subprocess.run([sys.executable, '-c', 'pass'], check=True)
+	return (time.perf_counter() - start) * 1000
+
+
+def main(args: List[str]) -> None:
+	"""Run benchmark."""
+	parser = argparse.ArgumentParser(prog='bench startup', description=__doc__.splitlines()[0])
+	parser.add_argument('--repeat', type=int, default=5, help='runs per measure')
+	parser.add_argument('--top', type=int, default=10, help='count of slowest packages to show')
+	parser.add_argument('--import-budget-ms', type=float, default=500,
+	                    help=f'budget of {ENTRY_MODULE} import time')
+	parser.add_argument('--bind-budget-ms', type=float, default=2000,
+	                    help='budget of time-to-bind-port')
+	parser.add_argument('--save', default=RESULTS_PATH, help='path to save results')
+	options = parser.parse_args(args)
+	runs = [_import_times() for _ in range(options.repeat)]
+	modules = {name: (_median([run[name][0] for run in runs if name in run]),
+	                  _median([run[name][1] for run in runs if name in run]))
+	           for name in runs[0]}
+	import_ms = modules[ENTRY_MODULE][1]
+	with tempfile.TemporaryDirectory() as tmpdir:
+		fake_github = FakeGithub('bench/repo', tokens={'bench-bot-token': 'bench-bot'})
+		with StandinServer(fake_github) as github_standin:
+			settings_path = os.path.join(tmpdir, 'hublabbot.json')
+			with open(settings_path, 'w') as f:
+				json.dump({
+					'base_url': 'http://127.0.0.1:8080',
+					'gh_base_url': github_standin.url,
+					'gh_api_url': github_standin.url,
+					'gl_base_url': github_standin.url,
+					'repos': [{
+						'gh_repo_path': 'bench/repo',
+						'gl_repo_path': 'bench/repo',
+						'gl_auto_cancel_pipelines': True}]}, f)
+			env = dict(os.environ,
+			           GITHUB_TOKEN='bench-token',
+			           GITHUB_BOT_TOKEN='bench-bot-token',
+			           GITHUB_SECRET=GH_SECRET,
+			           GITLAB_TOKEN='bench-gitlab-token',
+			           GITLAB_SECRET=GL_SECRET)
+			bind_ms = _median([_time_to_bind(settings_path, env) for _ in range(options.repeat)])
+	interpreter_ms = _median([_interpreter_start() for _ in range(options.repeat)])
+
+	print(f'{"module":<48} {"self, ms":>9} {"cumul., ms":>10}')
+	own = sorted((name for name in modules if name.split('.')[0] == 'hublabbot'),
+	             key=lambda name: -modules[name][1])
+	packages = sorted((name for name in modules if '.' not in name and name != 'hublabbot'),
+	                  key=lambda name: -modules[name][1])[:options.top]
+	for name in own + packages:
+		print(f'{name:<48} {modules[name][0]:>9.1f} {modules[name][1]:>10.1f}')
+	print(f'\nInterpreter start: {interpreter_ms:.1f} ms.')
+	print(f'Import of {ENTRY_MODULE}: {import_ms:.1f} ms (budget {options.import_budget_ms:.0f} ms).')
+	print(f'Time-to-bind-port: {bind_ms:.1f} ms (budget {options.bind_budget_ms:.0f} ms).')
+	os.makedirs(os.path.dirname(options.save) or '.', exist_ok=True)
+	with open(options.save, 'w') as f:
+		json.dump({'config': vars(options), 'results': {
+			'interpreter_ms': interpreter_ms,
+			'import_ms': import_ms,
+			'bind_ms': bind_ms,
+			'modules': modules}}, f, indent='\t', sort_keys=True)
+	print(f'Results saved to {options.save}.')
+	over_budget = import_ms > options.import_budget_ms or bind_ms > options.bind_budget_ms
+	if over_budget:
+		print('Startup time budget exceeded!', file=sys.stderr)
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
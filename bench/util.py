@@ -0,0 +1,117 @@
+"""Module for benchmark helpers."""
+from typing import Any, Callable, Dict, List, Tuple
+import json
+import hmac
+import hashlib
+import time
+import tempfile
+from pathlib import Path
+
+from webob import Request  # type: ignore
+
+import hublabbot
+from hublabbot.settings import HubLabBotSettings, RepoOptions
+from hublabbot.util import set_frozen_attr, JsonDict
+
+
+GH_SECRET = 'bench-github-secret'
+"""GitHub secret of benchmark settings."""
+GL_SECRET = 'bench-gitlab-secret'
+"""GitLab secret of benchmark settings."""
+
+
+def make_settings(repos: List[JsonDict], **overrides: Any) -> HubLabBotSettings:
+	"""Make settings without settings file, environ and GitHub API calls.
+
+	Args:
+		repos: List of repo options, like in settings file.
+		overrides: Values of `HubLabBotSettings` attributes.
+
+	"""
+	settings = HubLabBotSettings.__new__(HubLabBotSettings)
+	values: Dict[str, Any] = {
+		'assets_path': Path(hublabbot.__file__).parent / 'assets',
+		'base_url': 'http://127.0.0.1:8080',
+		'port': 8080,
+		'gh_bot_token': 'bench-bot-token',
+		'gh_bot_login': 'bench-bot',
+		'gh_bot_profile_url': 'https://github.com/bench-bot',
+		'gh_bot_avatar_url': 'https://github.com/bench-bot.png',
+		'gh_base_url': 'https://github.com',
+		'gh_api_url': 'https://api.github.com',
+		'gh_token': 'bench-token',
+		'gh_login': 'bench',
+		'gh_secret': GH_SECRET,
+		'gl_base_url': 'https://gitlab.com',
+		'gl_token': 'bench-gitlab-token',
+		'gl_secret': GL_SECRET,
+		'delivery_cache_size': 1024,
+		'delivery_cache_ttl': 3600,
+		'max_payload_size': 25 * 1024 * 1024,
+		'journal_path': None,
+		'slow_request_log_path': None,
+		'slow_request_threshold': 5,
+		'admin_token': None,
+		'profile_dir': tempfile.gettempdir(),
+		'state_store': 'memory://',
+		'leader_lease_ttl': 15,
+		'pipeline_debounce_window': 3,
+		'branch_delete_window': 5,
+		'branch_delete_concurrency': 8,
+		'delivery_capacity': 16,
+		'coalesce_api_reads': True,
+		'correlation_cache_size': 4096,
+		'correlation_cache_ttl': 24 * 60 * 60,
+		'outbox_path': None,
+		'snapshot_path': None,
+		'snapshot_interval': 300,
+		'snapshot_max_age': 60 * 60,
+		'gh_apps': [],
+		'gh_app_tokens': None}
+	values.update(overrides)
+	for attr, value in values.items():
+		set_frozen_attr(settings, attr, value)
+	repo_list = [RepoOptions(options, values['gh_login'], values['gh_bot_login']) for options in repos]
+	set_frozen_attr(settings, 'repos', repo_list)
+	set_frozen_attr(settings, '_gh_repos', {r.gh_repo_path: r for r in repo_list})
+	set_frozen_attr(settings, '_gl_repos', {r.gl_repo_path: r for r in repo_list})
+	return settings
+
+
+def github_request(event: str, body: bytes, delivery_id: str) -> Request:
+	"""Make signed GitHub webhook request."""
+	signature = hmac.new(GH_SECRET.encode(), body, hashlib.sha1).hexdigest()
+	return Request.blank('/webhook/github', method='POST', body=body, headers={
+		'Content-Type': 'application/json',
+		'X-Github-Event': event,
+		'X-GitHub-Delivery': delivery_id,
+		'X-Hub-Signature': f'sha1={signature}'})
+
+
+def gitlab_request(event: str, body: bytes, delivery_id: str) -> Request:
+	"""Make GitLab webhook request."""
+	return Request.blank('/webhook/gitlab', method='POST', body=body, headers={
+		'Content-Type': 'application/json',
+		'X-Gitlab-Event': event,
+		'X-Gitlab-Event-UUID': delivery_id,
+		'X-Gitlab-Token': GL_SECRET})
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Tuple[float, float]:
+	"""Call `func` `repeat` times.
+
+	Returns:
+		Mean and min time of call in seconds.
+
+	"""
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	return sum(times) / len(times), min(times)
+
+
+def dump_json(data: Any) -> bytes:
+	"""Encode JSON compactly, like GitHub and GitLab do it."""
+	return json.dumps(data, separators=(',', ':')).encode()
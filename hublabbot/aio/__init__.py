@@ -0,0 +1 @@
+"""Optional asyncio engine of HubLabBot, see `hublabbot.aio.app`."""
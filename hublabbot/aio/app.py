@@ -0,0 +1,410 @@
+"""Module for HubLabBot's ASGI app - optional asyncio engine.
+
+GitHub `status` deliveries (GitLab CI fail-reports and auto-merges - the handlers, which wait
+most on GitHub and GitLab) are handled natively: calls are sent by async clients over one pooled
+session per backend, and independent calls are sent concurrently. Other routes of
+`hublabbot.view` are served by WSGI app from `hublabbot.app.make_app` in thread pool, so both
+engines share registry: delivery cache, correlation cache, scheduler and outbox.
+
+Usage with any ASGI server: `uvicorn --factory hublabbot.aio.app:create_app`, settings path is
+read from environ `HUBLABBOT_SETTINGS` (default is `hublabbot.json`).
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+import io
+import json
+import os
+import sys
+import time
+import asyncio
+import traceback
+from pathlib import PurePath
+from concurrent.futures import ThreadPoolExecutor
+
+from hublabbot.const import (GITHUB_ENDPOINT, DELIVERIES_KEY, SCHEDULER_KEY,
+                             CORRELATION_KEY, OUTBOX_KEY, FAIR_QUEUE_KEY, CI_TIMINGS_KEY)
+from hublabbot.util import JsonDict, json_loads
+from hublabbot.settings import HubLabBotSettings, RepoOptions
+from hublabbot.metrics import REQUESTS, REQUEST_DURATION, REQUESTS_IN_PROGRESS, CI_LOG_BYTES
+from hublabbot.delivery import DeliveryCache, claim_delivery, finish_delivery
+from hublabbot.correlation import CorrelationCache
+from hublabbot.fairness import FairQueue
+from hublabbot.ci_timings import CiTimings, slowest_sections
+from hublabbot.scheduler import Scheduler, MERGE_JOB
+from hublabbot.outbox import Outbox, MERGE_ACTION, COMMENT_ACTION
+from hublabbot.profiling import ProfilingMiddleware
+from hublabbot.github.github_webhook import render_gitlabci_fail
+from hublabbot.github.merge_queue import MergeQueue, enqueue, dequeue_failed
+from hublabbot.gitlab.gitlab_webhook import parse_gitlabci_log, parse_gitlabci_sections
+from hublabbot.aio.http import AsyncSession
+from hublabbot.aio.clients import AsyncGithub, AsyncGitlab
+
+
+Scope = Dict[str, Any]
+"""Type - ASGI connection scope."""
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+"""Type - ASGI receive callable."""
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+"""Type - ASGI send callable."""
+Headers = Dict[str, str]
+"""Type - request headers with lowercase names."""
+
+
+class HttpError(Exception):
+	"""Response with error status, like `pyramid.httpexceptions`."""
+
+	def __init__(self, status: int, title: str):
+		super().__init__(title)
+		self.status = status
+		"""HTTP status code."""
+
+
+class AsgiApp:
+	"""ASGI app, `status` deliveries are handled natively, other routes by `wsgi_app` in thread pool.
+
+	Args:
+		wsgi_app: App made by `hublabbot.app.make_app`.
+		threads: Size of thread pool of WSGI app.
+		connection_limit: Maximum count of concurrent connections to GitHub and to GitLab.
+
+	"""
+
+	def __init__(self, wsgi_app: ProfilingMiddleware, threads: int = 32, connection_limit: int = 100):
+		self.wsgi_app = wsgi_app
+		"""App made by `hublabbot.app.make_app`."""
+		self.registry: JsonDict = wsgi_app.app.registry.settings  # type: ignore
+		"""Registry settings of WSGI app."""
+		self.settings: HubLabBotSettings = self.registry['hublabbot']
+		"""`hublabbot.settings.HubLabBotSettings`."""
+		self.connection_limit = connection_limit
+		"""Maximum count of concurrent connections per backend."""
+		self._executor = ThreadPoolExecutor(threads, thread_name_prefix='hublabbot-wsgi')
+		self._sessions: List[AsyncSession] = []
+		self._github: Optional[AsyncGithub] = None
+		self._gitlab: Optional[AsyncGitlab] = None
+
+	@property
+	def github(self) -> AsyncGithub:
+		"""Async GitHub client with bot credentials, made in loop of first request."""
+		if self._github is None:
+			session = AsyncSession('github', self.connection_limit)
+			self._sessions.append(session)
+			self._github = AsyncGithub(session, self.settings.gh_api_url, self.settings.gh_bot_token,
+			                           self.settings.gh_app_tokens)
+		return self._github
+
+	@property
+	def gitlab(self) -> AsyncGitlab:
+		"""Async GitLab client, made in loop of first request."""
+		if self._gitlab is None:
+			session = AsyncSession('gitlab', self.connection_limit)
+			self._sessions.append(session)
+			self._gitlab = AsyncGitlab(session, self.settings.gl_base_url, self.settings.gl_token)
+		return self._gitlab
+
+	async def close(self) -> None:
+		"""Close sessions and thread pool."""
+		for session in self._sessions:
+			await session.close()
+		self._sessions.clear()
+		self._github = None
+		self._gitlab = None
+		self._executor.shutdown(wait=False)
+
+	async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+		"""Handle ASGI connection."""
+		if scope['type'] == 'lifespan':
+			await self._lifespan(receive, send)
+			return
+		assert scope['type'] == 'http'
+		body = b''
+		while True:
+			message = await receive()
+			body += message.get('body', b'')
+			if not message.get('more_body', False):
+				break
+		headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+		           for name, value in scope['headers']}
+		if (scope['method'] == 'POST' and scope['path'] == '/' + GITHUB_ENDPOINT
+		    and headers.get('x-github-event') == 'status'):
+			status, response_headers, content = await self._github_status(headers, body)
+		else:
+			status, response_headers, content = await asyncio.get_running_loop().run_in_executor(
+				self._executor, self._call_wsgi, scope, body)
+		await send({'type': 'http.response.start', 'status': status,
+		            'headers': [(name.encode('latin-1'), value.encode('latin-1'))
+		                        for name, value in response_headers]})
+		await send({'type': 'http.response.body', 'body': content})
+
+	async def _lifespan(self, receive: Receive, send: Send) -> None:
+		while True:
+			message = await receive()
+			if message['type'] == 'lifespan.startup':
+				await send({'type': 'lifespan.startup.complete'})
+			elif message['type'] == 'lifespan.shutdown':
+				await self.close()
+				await send({'type': 'lifespan.shutdown.complete'})
+				return
+
+	def _call_wsgi(self, scope: Scope, body: bytes) -> Tuple[int, List[Tuple[str, str]], bytes]:
+		server = scope.get('server') or ('localhost', 80)
+		environ: Dict[str, Any] = {
+			'REQUEST_METHOD': scope['method'],
+			'SCRIPT_NAME': scope.get('root_path', ''),
+			'PATH_INFO': scope['path'],
+			'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+			'SERVER_NAME': server[0],
+			'SERVER_PORT': str(server[1]),
+			'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+			'CONTENT_LENGTH': str(len(body)),
+			'wsgi.version': (1, 0),
+			'wsgi.url_scheme': scope.get('scheme', 'http'),
+			'wsgi.input': io.BytesIO(body),
+			'wsgi.errors': sys.stderr,
+			'wsgi.multithread': True,
+			'wsgi.multiprocess': False,
+			'wsgi.run_once': False}
+		for name, value in scope['headers']:
+			key = name.decode('latin-1').upper().replace('-', '_')
+			if key == 'CONTENT_TYPE':
+				environ['CONTENT_TYPE'] = value.decode('latin-1')
+			elif key != 'CONTENT_LENGTH':
+				environ[f'HTTP_{key}'] = value.decode('latin-1')
+		started: List[Any] = []
+
+		def start_response(status: str, headers: List[Tuple[str, str]], exc_info: Any = None) -> None:
+			started[:] = [int(status.split(' ', 1)[0]), headers]
+
+		chunks = self.wsgi_app(environ, start_response)
+		try:
+			content = b''.join(chunks)
+		finally:
+			close = getattr(chunks, 'close', None)
+			if close is not None:
+				close()
+		return started[0], started[1], content
+
+	async def _github_status(self, headers: Headers, body: bytes
+	) -> Tuple[int, List[Tuple[str, str]], bytes]:
+		"""Handle 'X-Github-Event: status' like `hublabbot.view.github.GithubPayloadView`."""
+		REQUESTS_IN_PROGRESS.inc('github')
+		start = time.perf_counter()
+		status = 'EXCEPTION'
+		try:
+			result = await self._dispatch_status(headers, body)
+			status = result.get('status', 'none')
+			return 200, [('Content-Type', 'application/json')], json.dumps(result).encode()
+		except HttpError as err:
+			return err.status, [('Content-Type', 'text/plain')], str(err).encode()
+		except Exception as exc:
+			traceback.print_exception(type(exc), exc, exc.__traceback__)
+			lines = traceback.format_exception_only(type(exc), exc)
+			content = json.dumps({'status': 'ERROR', 'error': lines if len(lines) > 1 else lines[0]})
+			return 500, [('Content-Type', 'application/json')], content.encode()
+		finally:
+			REQUEST_DURATION.observe(time.perf_counter() - start, 'github', 'status', 'payload_status')
+			REQUESTS.inc('github', 'status', 'payload_status', status)
+			REQUESTS_IN_PROGRESS.dec('github')
+
+	async def _dispatch_status(self, headers: Headers, body: bytes) -> JsonDict:
+		"""Like `hublabbot.view.github.GithubPayloadView.dispatch`, with same shared helpers."""
+		from hublabbot.view.github import verify_delivery
+		if len(body) > self.settings.max_payload_size:
+			raise HttpError(413, 'Request Entity Too Large')
+		if not verify_delivery(self.registry, headers.get('x-hub-signature'), headers, body):
+			raise HttpError(401, 'Unauthorized')
+		delivery_id = headers.get('x-github-delivery')
+		if delivery_id is None:
+			return await self._dispatch_status_payload(body)
+		deliveries: DeliveryCache = self.registry[DELIVERIES_KEY]
+		duplicate = claim_delivery(deliveries, 'github', delivery_id)
+		if duplicate is not None:
+			return duplicate
+		result = None
+		try:
+			result = await self._dispatch_status_payload(body)
+		finally:
+			finish_delivery(deliveries, 'github', delivery_id, result)
+		return result
+
+	async def _dispatch_status_payload(self, body: bytes) -> JsonDict:
+		from hublabbot.view.github import check_event
+		payload: JsonDict = {}
+
+		def decode_repo_options() -> RepoOptions:
+			# payload is decoded only if event is enabled in some repo
+			payload.update(json_loads(body))
+			return self.settings.get_repo_by_github(payload['repository']['full_name'])
+
+		ignored = check_event(self.settings, 'status', decode_repo_options)
+		if ignored is not None:
+			return ignored
+		repo_options = self.settings.get_repo_by_github(payload['repository']['full_name'])
+		fair_queue: FairQueue = self.registry[FAIR_QUEUE_KEY]
+		async with fair_queue.slot_async(repo_options):
+			if payload['state'] in ('failure', 'error'):
+				await self._dequeue_failed(repo_options, payload['sha'])
+				result = await self._show_gitlabci_fail(repo_options, payload)
+			elif payload['state'] == 'pending':
+				result = {'status': 'RUNNING'}
+			else:
+				result = await self._auto_merge_pr(repo_options, payload['commit']['sha'])
+		return result
+
+	async def _get_pr_by_sha(self, repo_path: str, sha: str) -> Optional[JsonDict]:
+		correlation: CorrelationCache = self.registry[CORRELATION_KEY]
+		pr_number = correlation.pr_by_sha(repo_path, sha)
+		if pr_number is not None:
+			pr = await self.github.get_pull(repo_path, pr_number)
+			# PR pushed or closed since it was recorded
+			if pr['head']['sha'] == sha and pr['state'] == 'open':
+				return pr
+		found = await self.github.find_pull(repo_path, sha)
+		if found is not None:
+			correlation.record_pr_sha(repo_path, sha, found['number'])
+		return found
+
+	async def _dequeue_failed(self, repo_options: RepoOptions, sha: str) -> None:
+		"""Like `hublabbot.view.github.GithubPayloadView._dequeue_failed`."""
+		options = repo_options.gh_auto_merge_pr
+		if options is None or not options.merge_queue:
+			return
+		repo_path = repo_options.gh_repo_path
+		scheduler: Scheduler = self.registry[SCHEDULER_KEY]
+		entries = MergeQueue(scheduler.store, repo_path).entries()
+		if len(entries) == 0:
+			return
+		# lookup is async, so PR is looked up in advance, if `sha` isn't queued sha
+		pr_number: Optional[int] = None
+		if all(entry.sha != sha for entry in entries):
+			pr = await self._get_pr_by_sha(repo_path, sha)
+			pr_number = pr['number'] if pr is not None else None
+		dequeue_failed(scheduler, repo_path, sha, lambda: pr_number)
+
+	async def _show_gitlabci_fail(self, repo_options: RepoOptions, payload: JsonDict) -> JsonDict:
+		"""Like `hublabbot.view.github.GithubPayloadView._show_gitlabci_fail`.
+
+		PR is looked up concurrently with pipeline and failed job.
+		"""
+		repo_path = repo_options.gh_repo_path
+		gl_repo_path = repo_options.gl_repo_path
+		if repo_options.gh_show_gitlab_ci_fail is None:
+			return {
+				'status': 'IGNORE',
+				'note': f'Repo option gh_show_gitlab_ci_fail disabled for repo {repo_path}.'}
+		if payload['state'] == 'error' and payload['description'] == 'Pipeline canceled on GitLab':
+			return {'status': 'IGNORE'}
+		sha: str = payload['sha']
+		pipeline_id = int(payload['target_url'].split('/')[-1])
+		correlation: CorrelationCache = self.registry[CORRELATION_KEY]
+		recorded = correlation.pipeline(gl_repo_path, pipeline_id)
+		failed_job: Optional[JsonDict]
+		pr: Optional[JsonDict]
+		if recorded is not None and len(recorded.failed_job_ids) > 0:
+			failed_job, pr = await asyncio.gather(
+				self.gitlab.get_job(gl_repo_path, recorded.failed_job_ids[0]),
+				self._get_pr_by_sha(repo_path, sha))
+		else:
+			pipeline, failed_jobs, pr = await asyncio.gather(
+				self.gitlab.get_pipeline(gl_repo_path, pipeline_id),
+				self.gitlab.list_failed_jobs(gl_repo_path, pipeline_id),
+				self._get_pr_by_sha(repo_path, sha))
+			if pr is not None and pipeline.get('yaml_errors') is not None:
+				return await self._post_gitlabci_fail(repo_path, pr, 'yaml_errors', pipeline['web_url'],
+				                                      pipeline['yaml_errors'])
+			failed_job = failed_jobs[0] if len(failed_jobs) > 0 else None
+		if pr is None:
+			return {
+				'status': 'IGNORE',
+				'note': f'Commit "{sha}" not found in Pull Requests.'}
+		assert failed_job is not None
+		raw_log = await self.gitlab.get_job_trace(gl_repo_path, failed_job['id'])
+		CI_LOG_BYTES.inc(amount=len(raw_log))
+		failed_job_log = parse_gitlabci_log(raw_log, repo_options.gh_show_gitlab_ci_fail.max_lines)
+		sections = parse_gitlabci_sections(raw_log)
+		ci_timings: CiTimings = self.registry[CI_TIMINGS_KEY]
+		ci_timings.record(gl_repo_path, failed_job['name'], sections)
+		return await self._post_gitlabci_fail(
+			repo_path, pr, failed_job['stage'], failed_job['web_url'], failed_job_log,
+			slowest_sections(sections, repo_options.gh_show_gitlab_ci_fail.slowest_sections))
+
+	async def _post_gitlabci_fail(self, repo_path: str, pr: JsonDict, failed_stage: str,
+	                              failed_job_url: str, failed_job_log: str,
+	                              sections: Sequence[Tuple[str, float]] = ()) -> JsonDict:
+		body = render_gitlabci_fail(self.settings.assets_path, failed_stage, failed_job_url,
+		                            failed_job_log, sections)
+		number: int = pr['number']
+
+		async def post() -> None:
+			await self.github.create_comment(repo_path, number, body)
+			print(f'GH:{repo_path}: Comment with GitLab CI fail-report posted to PR#{number}.')
+
+		return await self._perform(COMMENT_ACTION, f'{repo_path}#{number}:{failed_job_url}',
+		                           {'repo': repo_path, 'pr': number, 'body': body}, post, once=True)
+
+	async def _auto_merge_pr(self, repo_options: RepoOptions, sha: str) -> JsonDict:
+		"""Like `hublabbot.github.github_webhook.GithubWebhook.auto_merge_pr`."""
+		repo_path = repo_options.gh_repo_path
+		options = repo_options.gh_auto_merge_pr
+		if options is None:
+			return {
+				'status': 'IGNORE',
+				'note': f'Repo option gh_auto_merge_pr disabled for repo {repo_path}.'}
+		found = await self._get_pr_by_sha(repo_path, sha)
+		pr = found
+		if found is not None and 'mergeable' not in found:
+			# PR from list has no mergeable state
+			pr = await self.github.get_pull(repo_path, found['number'])
+		if pr is None or pr['state'] == 'closed' or not pr['mergeable']:
+			return {'status': 'IGNORE'}
+		if pr['user']['login'] not in options.authors_white_list:
+			return {'status': 'IGNORE'}
+		if options.required_label_name not in [label['name'] for label in pr['labels']]:
+			return {'status': 'IGNORE'}
+		number: int = pr['number']
+		scheduler: Scheduler = self.registry[SCHEDULER_KEY]
+		if options.merge_queue:
+			return enqueue(scheduler, repo_path, number, pr['head']['sha'], options.delay)
+		if options.delay > 0:
+			scheduler.schedule(MERGE_JOB, f'{repo_path}#{number}', {'repo': repo_path, 'pr': number},
+			                   options.delay)
+			return {'status': 'OK'}
+
+		async def merge() -> None:
+			status = await self.github.merge_pull(repo_path, number, pr['head']['sha'])
+			if not status.get('merged'):
+				raise RuntimeError(f'GH:{repo_path}: PR#{number} fail to merge - "{status.get("message")}"!')
+			print(f'GH:{repo_path}: PR#{number} merged.')
+
+		return await self._perform(MERGE_ACTION, f'{repo_path}#{number}',
+		                           {'repo': repo_path, 'pr': number, 'sha': pr['head']['sha']}, merge)
+
+	async def _perform(self, kind: str, key: str, payload: JsonDict,
+	                   action: Callable[[], Awaitable[None]], once: bool = False) -> JsonDict:
+		"""Like `hublabbot.outbox.perform`, first attempt is coroutine."""
+		outbox: Outbox = self.registry[OUTBOX_KEY]
+		if await outbox.submit_async(kind, key, payload, action, once):
+			return {'status': 'OK'}
+		return {'status': 'OK', 'note': f'Action {kind} {key} is pending for retry.'}
+
+
+def make_asgi_app(settings: HubLabBotSettings, scheduler: Optional[Scheduler] = None,
+                  threads: int = 32) -> AsgiApp:
+	"""Make HubLabBot's ASGI app.
+
+	Args:
+		settings: `hublabbot.settings.HubLabBotSettings`.
+		scheduler: `hublabbot.scheduler.Scheduler`, see `hublabbot.app.make_app`.
+		threads: Size of thread pool of routes served by WSGI app.
+
+	"""
+	from hublabbot.app import make_app
+	return AsgiApp(make_app(settings, scheduler), threads)
+
+
+def create_app() -> AsgiApp:
+	"""Factory for ASGI servers, starts HubLabBot like `hublabbot.main.main`."""
+	from hublabbot.app import get_assets_path
+	from hublabbot.main import start
+	settings_path = os.environ.get('HUBLABBOT_SETTINGS', 'hublabbot.json')
+	settings = HubLabBotSettings(PurePath(settings_path), PurePath(get_assets_path()))
+	return AsgiApp(start(settings))
@@ -0,0 +1,152 @@
+"""Module for async GitHub and GitLab API clients, only calls used by `hublabbot.aio.app`."""
+from typing import Any, List, Optional
+import re
+import asyncio
+from urllib.parse import quote
+
+import requests
+
+from hublabbot.util import JsonDict
+from hublabbot.github.installation import InstallationTokens
+from hublabbot.aio.http import AsyncSession
+
+
+class ApiError(Exception):
+	"""Error status of API call, `status` is checked by `hublabbot.outbox.is_retryable`.
+
+	Args:
+		status: HTTP status code.
+		data: Body of response.
+
+	"""
+
+	def __init__(self, status: int, data: str):
+		super().__init__(f'{status} {data}')
+		self.status = status
+		"""HTTP status code."""
+		self.data = data
+		"""Body of response."""
+
+
+def _check(response: requests.Response) -> requests.Response:
+	if response.status_code >= 400:
+		raise ApiError(response.status_code, response.text)
+	return response
+
+
+class AsyncGithub:
+	"""Async GitHub REST API client.
+
+	Args:
+		session: `hublabbot.aio.http.AsyncSession`.
+		api_url: URL of GitHub API.
+		token: GitHub Personal access token.
+		tokens: Installation tokens of GitHub Apps, preferred to `token` in repos with Apps.
+
+	"""
+
+	PER_PAGE = 100
+	"""Page size of lists."""
+
+	def __init__(self, session: AsyncSession, api_url: str, token: str,
+	             tokens: Optional[InstallationTokens] = None):
+		self.session = session
+		self.api_url = api_url.rstrip('/')
+		self.token = token
+		self.tokens = tokens
+
+	async def _token(self, repo_path: str) -> str:
+		if self.tokens is None:
+			return self.token
+		token = self.tokens.cached_token(repo_path)
+		if token is None:
+			# lookup and minting are blocking calls, once per installation and hour
+			token = await asyncio.get_running_loop().run_in_executor(None, self.tokens.token, repo_path)
+		return token if token is not None else self.token
+
+	async def _call(self, method: str, repo_path: str, url: str,
+	                json_body: Any = None) -> requests.Response:
+		if not url.startswith('http'):
+			url = self.api_url + url
+		headers = {'Authorization': f'token {await self._token(repo_path)}',
+		           'Accept': 'application/vnd.github.v3+json', 'User-Agent': 'HubLabBot'}
+		return _check(await self.session.request(method, url, headers, json_body))
+
+	async def get_pull(self, repo_path: str, number: int) -> JsonDict:
+		"""Get PR."""
+		pr: JsonDict = (await self._call('GET', repo_path, f'/repos/{repo_path}/pulls/{number}')).json()
+		return pr
+
+	async def find_pull(self, repo_path: str, sha: str) -> Optional[JsonDict]:
+		"""Find open PR by head sha.
+
+		First page of PRs is fetched alone, if PR isn't there, other pages are fetched concurrently.
+
+		Returns:
+			PR from list (without `mergeable`) or `None`.
+
+		"""
+		url = f'/repos/{repo_path}/pulls?per_page={self.PER_PAGE}'
+		first = await self._call('GET', repo_path, url)
+		pages: List[List[JsonDict]] = [first.json()]
+		found = next((pr for pr in pages[0] if pr['head']['sha'] == sha), None)
+		if found is not None:
+			return found
+		last = re.search(r'[?&]page=(\d+)>; rel="last"', first.headers.get('Link', ''))
+		if last is not None:
+			responses = await asyncio.gather(*(self._call('GET', repo_path, f'{url}&page={page}')
+			                                   for page in range(2, int(last.group(1)) + 1)))
+			pages += [response.json() for response in responses]
+		return next((pr for page in pages for pr in page if pr['head']['sha'] == sha), None)
+
+	async def merge_pull(self, repo_path: str, number: int, sha: str) -> JsonDict:
+		"""Merge PR, if its head is `sha`."""
+		status: JsonDict = (await self._call(
+			'PUT', repo_path, f'/repos/{repo_path}/pulls/{number}/merge', {'sha': sha})).json()
+		return status
+
+	async def create_comment(self, repo_path: str, number: int, body: str) -> JsonDict:
+		"""Post comment to PR."""
+		comment: JsonDict = (await self._call(
+			'POST', repo_path, f'/repos/{repo_path}/issues/{number}/comments', {'body': body})).json()
+		return comment
+
+
+class AsyncGitlab:
+	"""Async GitLab API v4 client.
+
+	Args:
+		session: `hublabbot.aio.http.AsyncSession`.
+		base_url: URL of GitLab instance.
+		token: GitLab Personal access token.
+
+	"""
+
+	def __init__(self, session: AsyncSession, base_url: str, token: str):
+		self.session = session
+		self.api_url = base_url.rstrip('/') + '/api/v4'
+		self._headers = {'PRIVATE-TOKEN': token, 'User-Agent': 'HubLabBot'}
+
+	async def _call(self, method: str, repo_path: str, path: str) -> requests.Response:
+		url = f'{self.api_url}/projects/{quote(repo_path, safe="")}{path}'
+		return _check(await self.session.request(method, url, self._headers))
+
+	async def get_pipeline(self, repo_path: str, pipeline_id: int) -> JsonDict:
+		"""Get pipeline."""
+		pipeline: JsonDict = (await self._call('GET', repo_path, f'/pipelines/{pipeline_id}')).json()
+		return pipeline
+
+	async def list_failed_jobs(self, repo_path: str, pipeline_id: int) -> List[JsonDict]:
+		"""List failed jobs of pipeline, newest first."""
+		jobs: List[JsonDict] = (await self._call(
+			'GET', repo_path, f'/pipelines/{pipeline_id}/jobs?scope=failed')).json()
+		return jobs
+
+	async def get_job(self, repo_path: str, job_id: int) -> JsonDict:
+		"""Get job."""
+		job: JsonDict = (await self._call('GET', repo_path, f'/jobs/{job_id}')).json()
+		return job
+
+	async def get_job_trace(self, repo_path: str, job_id: int) -> bytes:
+		"""Get log of job."""
+		return (await self._call('GET', repo_path, f'/jobs/{job_id}/trace')).content
@@ -0,0 +1,181 @@
+"""Module for pooled HTTP/1.1 client on asyncio streams.
+
+It speaks HTTP itself, no async client library is required. Responses are
+`requests.Response` objects, so calls are reported to observers of `hublabbot.client`
+like calls of instrumented sessions.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import ssl
+import json
+import time
+import asyncio
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from hublabbot.client import OutboundCall, notify_observers
+
+
+_Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+_Origin = Tuple[str, str, int]
+RETRIED_METHODS = ('GET', 'HEAD', 'OPTIONS')
+"""Methods sent again on other connection, if reused connection fails after response started."""
+
+
+class StaleConnectionError(ConnectionError):
+	"""Connection closed before any byte of response was read, so request wasn't processed."""
+
+
+class AsyncSession:
+	"""HTTP session with pool of keep-alive connections per origin.
+
+	Args:
+		backend: `'github'` or `'gitlab'`, reported to observers.
+		limit: Maximum count of concurrent connections per origin, other calls wait.
+		timeout: Timeout of call, in seconds.
+
+	"""
+
+	def __init__(self, backend: str, limit: int = 100, timeout: float = 30):
+		self.backend = backend
+		"""`'github'` or `'gitlab'`."""
+		self.limit = limit
+		"""Maximum count of concurrent connections per origin."""
+		self.timeout = timeout
+		"""Timeout of call, in seconds."""
+		self._idle: Dict[_Origin, List[_Connection]] = {}
+		self._slots: Dict[_Origin, asyncio.Semaphore] = {}
+		self._ssl_context: Optional[ssl.SSLContext] = None
+
+	async def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None,
+	                  json_body: Any = None) -> requests.Response:
+		"""Send request and read whole response.
+
+		Args:
+			method: HTTP method.
+			url: Full URL.
+			headers: Request headers.
+			json_body: JSON body of request, `None` - without body.
+
+		Returns:
+			Response, any status.
+
+		"""
+		parts = urlsplit(url)
+		origin = (parts.scheme, parts.hostname or '',
+		          parts.port or (443 if parts.scheme == 'https' else 80))
+		target = parts.path or '/'
+		if parts.query:
+			target += '?' + parts.query
+		body = json.dumps(json_body).encode() if json_body is not None else b''
+		head = {'Host': parts.netloc, 'Accept-Encoding': 'identity', 'Content-Length': str(len(body))}
+		if json_body is not None:
+			head['Content-Type'] = 'application/json'
+		head.update(headers or {})
+		request = f'{method} {target} HTTP/1.1\r\n'.encode()
+		request += b''.join(f'{name}: {value}\r\n'.encode() for name, value in head.items())
+		request += b'\r\n' + body
+		response = None
+		error = None
+		start = time.perf_counter()
+		try:
+			slot = self._slots.setdefault(origin, asyncio.Semaphore(self.limit))
+			async with slot:
+				response = await asyncio.wait_for(self._send(origin, request, method), self.timeout)
+			response.url = url
+			return response
+		except BaseException as err:
+			error = err
+			raise
+		finally:
+			notify_observers(OutboundCall(
+				backend=self.backend,
+				method=method,
+				url=url,
+				status=response.status_code if response is not None else None,
+				duration=time.perf_counter() - start,
+				response=response,
+				error=error))
+
+	async def _connect(self, origin: _Origin) -> _Connection:
+		scheme, host, port = origin
+		if scheme != 'https':
+			return await asyncio.open_connection(host, port)
+		if self._ssl_context is None:
+			self._ssl_context = ssl.create_default_context()
+		return await asyncio.open_connection(host, port, ssl=self._ssl_context)
+
+	async def _send(self, origin: _Origin, request: bytes, method: str) -> requests.Response:
+		idle = self._idle.setdefault(origin, [])
+		while idle:
+			reader, writer = idle.pop()
+			try:
+				writer.write(request)
+				return await self._read_response(origin, reader, writer, method)
+			except (ConnectionError, asyncio.IncompleteReadError) as err:
+				writer.close()
+				# part of response is read, so request (e.g. merge or comment) may be processed
+				if not isinstance(err, StaleConnectionError) and method not in RETRIED_METHODS:
+					raise
+		reader, writer = await self._connect(origin)
+		try:
+			writer.write(request)
+			return await self._read_response(origin, reader, writer, method)
+		except BaseException:
+			writer.close()
+			raise
+
+	async def _read_response(self, origin: _Origin, reader: asyncio.StreamReader,
+	                         writer: asyncio.StreamWriter, method: str) -> requests.Response:
+		try:
+			await writer.drain()
+		except ConnectionError as err:
+			raise StaleConnectionError('Connection closed before request was sent') from err
+		try:
+			status_line = await reader.readuntil(b'\r\n')
+		except asyncio.IncompleteReadError as err:
+			if err.partial != b'':
+				raise
+			raise StaleConnectionError('Connection closed before response') from err
+		version, status = status_line.decode('latin-1').split(' ', 2)[:2]
+		headers: CaseInsensitiveDict[str] = CaseInsensitiveDict()
+		while True:
+			line = (await reader.readuntil(b'\r\n'))[:-2].decode('latin-1')
+			if line == '':
+				break
+			name, _, value = line.partition(':')
+			headers[name.strip()] = value.strip()
+		keep_alive = version == 'HTTP/1.1' and headers.get('Connection', '').lower() != 'close'
+		if method == 'HEAD' or status in ('204', '304'):
+			content = b''
+		elif headers.get('Transfer-Encoding', '').lower() == 'chunked':
+			chunks = []
+			while True:
+				size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+				chunks.append(await reader.readexactly(size + 2))
+				if size == 0:
+					break
+			content = b''.join(chunk[:-2] for chunk in chunks)
+		elif 'Content-Length' in headers:
+			content = await reader.readexactly(int(headers['Content-Length']))
+		else:
+			content = await reader.read()
+			keep_alive = False
+		if keep_alive:
+			self._idle[origin].append((reader, writer))
+		else:
+			writer.close()
+		response = requests.Response()
+		response.status_code = int(status)
+		response.headers = headers
+		response._content = content
+		response.encoding = 'utf-8'
+		return response
+
+	async def close(self) -> None:
+		"""Close idle connections."""
+		for connections in self._idle.values():
+			for _, writer in connections:
+				writer.close()
+		self._idle.clear()
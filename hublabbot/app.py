@@ -0,0 +1,180 @@
+"""Module for HubLabBot's WSGI app."""
+from typing import Any, Dict, Optional
+import sys
+import atexit
+from pathlib import Path
+
+from pyramid.config import Configurator  # type: ignore
+
+from hublabbot.const import (DELIVERIES_KEY, JOURNAL_KEY, TRACES_KEY, STORE_KEY, SCHEDULER_KEY,
+                             CORRELATION_KEY, OUTBOX_KEY, FAIR_QUEUE_KEY, CI_TIMINGS_KEY)
+from hublabbot.util import JsonDict
+from hublabbot.settings import HubLabBotSettings
+from hublabbot.delivery import DeliveryCache
+from hublabbot.journal import Journal
+from hublabbot.tracing import SlowRequestLog
+from hublabbot.profiling import ProfilingMiddleware
+from hublabbot.store import make_store
+from hublabbot.correlation import CorrelationCache
+from hublabbot.fairness import FairQueue
+from hublabbot.snapshot import Snapshotter
+from hublabbot.ci_timings import CiTimings
+from hublabbot.outbox import (Outbox, MERGE_ACTION, COMMENT_ACTION, SYNC_ACTION, CANCEL_ACTION,
+                              DELETE_BRANCH_ACTION)
+from hublabbot.scheduler import (LeaderElector, Scheduler, MERGE_JOB, PIPELINE_JOB, SWEEP_JOB,
+                                 JANITOR_JOB, MERGE_QUEUE_JOB, BRANCH_DELETE_JOB)
+from hublabbot.github.github_webhook import GithubWebhook
+from hublabbot.gitlab.gitlab_webhook import GitlabWebhook
+import hublabbot.client as client
+import hublabbot.metrics as metrics
+import hublabbot.tracing as tracing
+
+
+def get_assets_path() -> str:
+	"""Returns path to assets dir, package is installed unzipped (see `zip_safe` in setup.py)."""
+	if sys.version_info >= (3, 9):
+		from importlib.resources import files
+		return str(files('hublabbot') / 'assets')
+	return str(Path(__file__).parent / 'assets')
+
+
+def make_scheduler(settings: HubLabBotSettings) -> Scheduler:
+	"""Make and start `hublabbot.scheduler.Scheduler` in store `settings.state_store`.
+
+	Register jobs before they are due, delayed auto-merges and debounced pipeline evaluations
+	are registered by `make_app`.
+
+	Args:
+		settings: `hublabbot.settings.HubLabBotSettings`.
+
+	"""
+	store = make_store(settings.state_store)
+	atexit.register(store.close)
+	elector = LeaderElector(store, settings.leader_lease_ttl).start()
+	return Scheduler(store, elector).start()
+
+
+def make_outbox(settings: HubLabBotSettings) -> Outbox:
+	"""Make `hublabbot.outbox.Outbox` in `settings.outbox_path` and start retries.
+
+	Args:
+		settings: `hublabbot.settings.HubLabBotSettings`.
+
+	"""
+	outbox = Outbox(settings.outbox_path)
+	outbox.register(MERGE_ACTION, 'github', lambda action: GithubWebhook(
+		settings, action['repo']).merge_pr(action['pr'], action.get('sha')))
+	outbox.register(COMMENT_ACTION, 'github', lambda action: GithubWebhook(
+		settings, action['repo']).comment_pr(action['pr'], action['body']))
+	outbox.register(SYNC_ACTION, 'git', lambda action: GithubWebhook(
+		settings, action['repo']).push_pr_to_gitlab(action['pr']))
+	outbox.register(CANCEL_ACTION, 'gitlab', lambda action: GitlabWebhook(
+		settings, action['repo']).cancel_pipeline(action['pipeline']))
+	outbox.register(DELETE_BRANCH_ACTION, 'gitlab', lambda action: GitlabWebhook(
+		settings, action['repo']).remove_branch(action['branch']))
+	atexit.register(outbox.close)
+	return outbox.start()
+
+
+def make_app(settings: HubLabBotSettings,
+             scheduler: Optional[Scheduler] = None) -> ProfilingMiddleware:
+	"""Make HubLabBot's WSGI app.
+
+	Args:
+		settings: `hublabbot.settings.HubLabBotSettings`.
+		scheduler: `hublabbot.scheduler.Scheduler`, default is `make_scheduler(settings)`.
+
+	"""
+	if scheduler is None:
+		scheduler = make_scheduler(settings)
+	store = scheduler.store
+	correlation = CorrelationCache(settings.correlation_cache_size, settings.correlation_cache_ttl)
+	outbox = make_outbox(settings)
+
+	def merge_job(job: JsonDict) -> None:
+		GithubWebhook(settings, job['repo'], correlation=correlation,
+		              outbox=outbox).merge_scheduled_pr(job['pr'])
+
+	def merge_queue_job(job: JsonDict) -> None:
+		GithubWebhook(settings, job['repo'], correlation=correlation,
+		              outbox=outbox).process_merge_queue(scheduler)
+
+	def pipeline_job(job: JsonDict) -> None:
+		GitlabWebhook(settings, job['repo'], correlation, outbox).auto_cancel_pipelines(
+			job['id'], job['ref'], job['source'])
+
+	def sweep_job(job: JsonDict) -> None:
+		options = settings.get_repo_by_github(job['repo']).gh_auto_merge_pr
+		if options is None or options.sweep_interval <= 0:
+			return
+		try:
+			GithubWebhook(settings, job['repo'], outbox=outbox).sweep_auto_merge_prs(scheduler)
+		finally:
+			scheduler.schedule(SWEEP_JOB, job['repo'], job, options.sweep_interval)
+
+	def janitor_job(job: JsonDict) -> None:
+		options = settings.get_repo_by_gitlab(job['repo']).gl_pipeline_janitor
+		if options is None:
+			return
+		try:
+			GitlabWebhook(settings, job['repo'], outbox=outbox).sweep_pipelines()
+		finally:
+			scheduler.schedule(JANITOR_JOB, job['repo'], job, options.interval)
+
+	def branch_delete_job(job: JsonDict) -> None:
+		GitlabWebhook(settings, job['repo'], outbox=outbox).delete_queued_branches(store)
+
+	scheduler.register(MERGE_JOB, merge_job)
+	scheduler.register(MERGE_QUEUE_JOB, merge_queue_job)
+	scheduler.register(PIPELINE_JOB, pipeline_job)
+	scheduler.register(SWEEP_JOB, sweep_job)
+	scheduler.register(JANITOR_JOB, janitor_job)
+	scheduler.register(BRANCH_DELETE_JOB, branch_delete_job)
+	for repo_options in settings.repos:
+		options = repo_options.gh_auto_merge_pr
+		if options is not None and options.sweep_interval > 0:
+			# pending sweep isn't postponed by restart of replica
+			scheduler.schedule(SWEEP_JOB, repo_options.gh_repo_path, {'repo': repo_options.gh_repo_path},
+			                   options.sweep_interval, replace=False)
+		if repo_options.gl_pipeline_janitor is not None:
+			scheduler.schedule(JANITOR_JOB, repo_options.gl_repo_path, {'repo': repo_options.gl_repo_path},
+			                   repo_options.gl_pipeline_janitor.interval, replace=False)
+	fair_queue = FairQueue(settings.delivery_capacity)
+	deliveries = DeliveryCache(settings.delivery_cache_size, settings.delivery_cache_ttl,
+	                           store if store.shared else None)
+	if settings.snapshot_path is not None:
+		snapshotter = Snapshotter(settings.snapshot_path, settings.snapshot_interval,
+		                          settings.snapshot_max_age)
+		snapshotter.register('correlation', correlation.dump, correlation.warm)
+		snapshotter.register('deliveries', deliveries.dump, deliveries.warm)
+		atexit.register(snapshotter.close)
+		snapshotter.start()
+	registry_settings: Dict[str, Any] = {
+		'hublabbot': settings,
+		STORE_KEY: store,
+		SCHEDULER_KEY: scheduler,
+		CORRELATION_KEY: correlation,
+		OUTBOX_KEY: outbox,
+		FAIR_QUEUE_KEY: fair_queue,
+		CI_TIMINGS_KEY: CiTimings(),
+		DELIVERIES_KEY: deliveries}
+	client.set_single_flight(settings.coalesce_api_reads)
+	client.add_observer(metrics.observe_outbound_call)
+	client.add_observer(fair_queue.observe_call)
+	if settings.journal_path is not None:
+		journal = Journal(settings.journal_path)
+		client.add_observer(journal.record_response)
+		atexit.register(journal.close)
+		registry_settings[JOURNAL_KEY] = journal
+	if settings.slow_request_log_path is not None:
+		client.add_observer(tracing.observe_outbound_call)
+		registry_settings[TRACES_KEY] = SlowRequestLog(settings.slow_request_log_path,
+		                                               settings.slow_request_threshold)
+	with Configurator(settings=registry_settings) as config:
+		config.include('hublabbot.view.github')
+		config.include('hublabbot.view.gitlab')
+		config.include('hublabbot.view.home')
+		config.include('hublabbot.view.favicon')
+		config.include('hublabbot.view.metrics')
+		config.include('hublabbot.view.admin')
+		return ProfilingMiddleware(config.make_wsgi_app())
@@ -0,0 +1,140 @@
+"""Module for in-memory caches."""
+from typing import Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+import time
+import traceback
+from collections import OrderedDict
+from threading import Lock
+
+
+K = TypeVar('K')
+V = TypeVar('V')
+Entries = List[Tuple[K, float, V]]
+"""Type - entries of cache: key, seconds to expiration, value; least recently used first."""
+
+
+class TTLCache(Generic[K, V]):
+	"""Thread-safe bounded LRU cache, entries expire after `ttl` seconds.
+
+	Attributes:
+		maxsize: Maximum count of entries, least recently used entries evicted first.
+		ttl: Time to live of entry in seconds.
+
+	"""
+
+	def __init__(self, maxsize: int, ttl: float, timer: Callable[[], float] = time.monotonic):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self._timer = timer
+		self._lock = Lock()
+		self._data: 'OrderedDict[K, Tuple[float, V]]' = OrderedDict()
+		self._loader: Optional[Callable[[], Entries[K, V]]] = None
+
+	def _load(self) -> None:
+		# entries of `warm` are loaded on first access, before entries set since
+		loader = self._loader
+		if loader is None:
+			return
+		self._loader = None
+		now = self._timer()
+		try:
+			entries = loader()
+		except Exception:
+			# cache stays cold
+			traceback.print_exc()
+			return
+		data = self._data
+		self._data = OrderedDict((key, (now + min(ttl, self.ttl), value))
+		                         for key, ttl, value in entries if ttl > 0)
+		for key, item in data.items():
+			self._data[key] = item
+			self._data.move_to_end(key)
+		while len(self._data) > self.maxsize:
+			self._data.popitem(last=False)
+
+	def _expire(self, now: float) -> None:
+		while len(self._data) > 0:
+			key, (expires_at, _) = next(iter(self._data.items()))
+			if expires_at > now:
+				break
+			del self._data[key]
+
+	def get(self, key: K) -> Optional[V]:
+		"""Get value by `key` and mark it as recently used.
+
+		Returns:
+			Value or `None` if not found or expired.
+
+		"""
+		with self._lock:
+			self._load()
+			now = self._timer()
+			item = self._data.get(key)
+			if item is None:
+				return None
+			if item[0] <= now:
+				del self._data[key]
+				return None
+			self._data.move_to_end(key)
+			return item[1]
+
+	def set(self, key: K, value: V) -> None:
+		"""Set `value` by `key`, evict expired and least recently used entries."""
+		with self._lock:
+			self._load()
+			now = self._timer()
+			self._data[key] = (now + self.ttl, value)
+			self._data.move_to_end(key)
+			self._expire(now)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+
+	def pop(self, key: K) -> Optional[V]:
+		"""Remove entry by `key`.
+
+		Returns:
+			Removed value or `None` if not found.
+
+		"""
+		with self._lock:
+			self._load()
+			item = self._data.pop(key, None)
+			return None if item is None else item[1]
+
+	def clear(self) -> None:
+		"""Remove all entries, including not yet loaded ones of `warm`."""
+		with self._lock:
+			self._loader = None
+			self._data.clear()
+
+	def items(self) -> Dict[K, V]:
+		"""Returns copy of all not expired entries."""
+		with self._lock:
+			self._load()
+			now = self._timer()
+			self._expire(now)
+			return {key: value for key, (expires_at, value) in self._data.items() if expires_at > now}
+
+	def dump(self) -> Entries[K, V]:
+		"""Returns not expired entries, least recently used first, see `warm`."""
+		with self._lock:
+			self._load()
+			now = self._timer()
+			return [(key, expires_at - now, value)
+			        for key, (expires_at, value) in self._data.items() if expires_at > now]
+
+	def warm(self, loader: Callable[[], Entries[K, V]]) -> None:
+		"""Warm cache lazily, `loader` is called on first access of cache.
+
+		Args:
+			loader: Returns entries like `dump` of previous run (e.g. from `hublabbot.snapshot`),
+				their time to live is capped by `ttl`.
+
+		"""
+		with self._lock:
+			self._loader = loader
+
+	def __len__(self) -> int:
+		"""Returns count of entries, including not yet evicted expired ones."""
+		with self._lock:
+			self._load()
+			return len(self._data)
@@ -0,0 +1,90 @@
+"""Module for timings of GitLab CI sections.
+
+Durations of sections are parsed from every job log HubLabBot fetches (see
+`hublabbot.gitlab.gitlab_webhook.parse_gitlabci_sections`) and aggregated per repo, job and
+section: as histogram `hublabbot_ci_section_duration_seconds` on `/metrics` and as summary
+on admin route `/admin/ci_sections`, see `hublabbot.view.admin`. Section and job names can be
+dynamic (IDs, matrix values), so at most `MAX_SECTIONS_PER_JOB` sections of job and
+`MAX_JOBS_PER_REPO` jobs of repo are tracked, others are aggregated as `OTHER`.
+"""
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+from threading import Lock
+
+from hublabbot.util import JsonDict
+from hublabbot.metrics import CI_SECTION_DURATION
+
+
+MAX_SECTIONS_PER_JOB = 20
+"""Maximum count of tracked sections of job, others are tracked as `OTHER`."""
+MAX_JOBS_PER_REPO = 50
+"""Maximum count of tracked jobs of repo, others are tracked as `OTHER`."""
+OTHER = 'other'
+"""Name of job or section, which aggregates untracked ones."""
+
+
+class CiTimings:
+	"""Aggregated durations of GitLab CI sections by repo, job and section."""
+
+	def __init__(self) -> None:
+		self._lock = Lock()
+		# per (repo, job, section): [count, total, max]
+		self._stats: Dict[Tuple[str, str, str], List[float]] = {}
+		# tracked jobs by repo and tracked sections by (repo, job), bounded by limits
+		self._jobs: Dict[str, Set[str]] = {}
+		self._sections: Dict[Tuple[str, str], Set[str]] = {}
+
+	@staticmethod
+	def _tracked(names: Set[str], name: str, limit: int) -> str:
+		if name in names:
+			return name
+		if len(names) < limit:
+			names.add(name)
+			return name
+		return OTHER
+
+	def record(self, gl_repo_path: str, job: str, sections: Sequence[Tuple[str, float]]) -> None:
+		"""Record durations of sections of job's log.
+
+		Args:
+			gl_repo_path: Path like {namespace}/{repo name} in GitLab.
+			job: Name of job.
+			sections: Name and duration in seconds of sections.
+
+		"""
+		with self._lock:
+			job = self._tracked(self._jobs.setdefault(gl_repo_path, set()), job, MAX_JOBS_PER_REPO)
+			tracked = self._sections.setdefault((gl_repo_path, job), set())
+			sections = [(self._tracked(tracked, section, MAX_SECTIONS_PER_JOB), duration)
+			            for section, duration in sections]
+			for section, duration in sections:
+				stats = self._stats.setdefault((gl_repo_path, job, section), [0, 0.0, 0.0])
+				stats[0] += 1
+				stats[1] += duration
+				stats[2] = max(stats[2], duration)
+		for section, duration in sections:
+			CI_SECTION_DURATION.observe(duration, gl_repo_path, job, section)
+
+	def summary(self, gl_repo_path: Optional[str] = None, limit: Optional[int] = None
+	) -> List[JsonDict]:
+		"""Returns aggregated sections, most time consuming first.
+
+		Args:
+			gl_repo_path: Only sections of this repo, `None` - of all repos.
+			limit: Maximum count of sections, `None` - all.
+
+		Returns:
+			List of `{'repo', 'job', 'section', 'count', 'total', 'mean', 'max'}`, in seconds.
+
+		"""
+		with self._lock:
+			stats = [(key, list(values)) for key, values in self._stats.items()
+			         if gl_repo_path is None or key[0] == gl_repo_path]
+		stats.sort(key=lambda item: item[1][1], reverse=True)
+		return [{'repo': repo, 'job': job, 'section': section, 'count': int(count), 'total': total,
+		         'mean': total / count, 'max': maximum}
+		        for (repo, job, section), (count, total, maximum) in stats[:limit]]
+
+
+def slowest_sections(sections: Sequence[Tuple[str, float]], count: int) -> List[Tuple[str, float]]:
+	"""Returns `count` longest sections, longest first."""
+	return sorted(sections, key=lambda section: section[1], reverse=True)[:count]
@@ -0,0 +1,221 @@
+"""Module for GitHub and GitLab API clients with instrumented HTTP sessions.
+
+Every outbound HTTP call of clients is reported to observers, see `add_observer`.
+Identical concurrent reads (same method, URL with query, headers including credential) are
+coalesced into single flight: followers wait for call of first one and share its response,
+see `set_single_flight`.
+PyGithub and python-gitlab are imported on first use of `github_client` and `gitlab_client`,
+they are slow to import.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+import copy
+import time
+from dataclasses import dataclass
+from threading import Event, Lock
+
+import requests
+
+if TYPE_CHECKING:
+	from github import Github  # type: ignore
+	from gitlab import Gitlab  # type: ignore
+
+
+@dataclass(frozen=True)
+class OutboundCall:
+	"""Immutable record of outbound HTTP call.
+
+	Attributes:
+		backend: `'github'` or `'gitlab'`.
+		method: HTTP method.
+		url: Full URL of request.
+		status: HTTP status code, `None` if request failed without response.
+		duration: Duration of call in seconds.
+		response: Response object, `None` if request failed without response.
+		error: Exception raised by request, `None` if response received.
+
+	"""
+
+	backend: str
+	method: str
+	url: str
+	status: Optional[int]
+	duration: float
+	response: Optional[requests.Response]
+	error: Optional[BaseException]
+
+
+Observer = Callable[[OutboundCall], None]
+"""Type - callback, called after every outbound HTTP call."""
+_observers: List[Observer] = []
+
+
+def add_observer(observer: Observer) -> None:
+	"""Add `observer` of outbound HTTP calls. Observers called in thread of call, keep it cheap."""
+	if observer not in _observers:
+		_observers.append(observer)
+
+
+def remove_observer(observer: Observer) -> None:
+	"""Remove `observer` of outbound HTTP calls."""
+	_observers.remove(observer)
+
+
+def notify_observers(call: OutboundCall) -> None:
+	"""Report `call` to observers, for HTTP clients other than instrumented sessions."""
+	for observer in list(_observers):
+		observer(call)
+
+
+COALESCED_METHODS = ('GET', 'HEAD')
+"""HTTP methods of reads, which are coalesced by single flight."""
+_single_flight = True
+_flights: Dict[Tuple[Any, ...], '_Flight'] = {}
+_flights_lock = Lock()
+_writes = 0
+
+
+class _Flight:
+	def __init__(self) -> None:
+		self.done = Event()
+		self.response: Optional[requests.Response] = None
+		self.error: Optional[BaseException] = None
+
+
+def set_single_flight(enabled: bool) -> None:
+	"""Enable or disable coalescing of identical concurrent reads, it's enabled by default."""
+	global _single_flight
+	_single_flight = enabled
+
+
+def _count_coalesced(backend: str) -> None:
+	# metrics module imports this module
+	from hublabbot.metrics import COALESCED_READS
+	COALESCED_READS.inc(backend)
+
+
+class InstrumentedSession(requests.Session):
+	"""Requests session, which reports every call to observers and coalesces identical reads."""
+
+	def __init__(self, backend: str):
+		super().__init__()
+		self.backend = backend
+		"""`'github'` or `'gitlab'`."""
+
+	def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+		"""Overrided `requests.Session.send`, coalesces identical concurrent reads.
+
+		Followers of read in flight get copy of its response (or its error), they aren't
+		reported to observers. Streamed reads aren't coalesced. Read isn't joined to flight
+		started before last write finished, so it never gets state older than its own writes.
+		"""
+		global _writes
+		if not _single_flight or request.method not in COALESCED_METHODS or kwargs.get('stream'):
+			try:
+				return self._send(request, **kwargs)
+			finally:
+				if request.method not in COALESCED_METHODS:
+					with _flights_lock:
+						_writes += 1
+		with _flights_lock:
+			key = (_writes, request.method, request.url, tuple(sorted(request.headers.items())))
+			flight = _flights.get(key)
+			leader = flight is None
+			if flight is None:
+				flight = _flights[key] = _Flight()
+		if not leader:
+			flight.done.wait()
+			_count_coalesced(self.backend)
+			if flight.error is not None:
+				raise flight.error
+			return copy.copy(flight.response)  # type: ignore
+		try:
+			flight.response = self._send(request, **kwargs)
+			return flight.response
+		except BaseException as err:
+			flight.error = err
+			raise
+		finally:
+			with _flights_lock:
+				del _flights[key]
+			flight.done.set()
+
+	def _send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+		# reports call to observers
+		response = None
+		error = None
+		start = time.perf_counter()
+		try:
+			response = super().send(request, **kwargs)
+			return response
+		except BaseException as err:
+			error = err
+			raise
+		finally:
+			call = OutboundCall(
+				backend=self.backend,
+				method=str(request.method),
+				url=str(request.url),
+				status=response.status_code if response is not None else None,
+				duration=time.perf_counter() - start,
+				response=response,
+				error=error)
+			notify_observers(call)
+
+
+def _instrument(session: requests.Session, backend: str) -> InstrumentedSession:
+	instrumented = InstrumentedSession(backend)
+	instrumented.auth = session.auth
+	instrumented.adapters = session.adapters
+	return instrumented
+
+
+_github_instrumented = False
+_github_lock = Lock()
+
+
+def _instrument_github() -> None:
+	global _github_instrumented
+	from github.Requester import (Requester, HTTPRequestsConnectionClass,  # type: ignore
+	                              HTTPSRequestsConnectionClass)
+
+	class GithubHTTPConnection(HTTPRequestsConnectionClass):  # type: ignore
+		def __init__(self, *args: Any, **kwargs: Any):
+			super().__init__(*args, **kwargs)
+			self.session = _instrument(self.session, 'github')
+
+	class GithubHTTPSConnection(HTTPSRequestsConnectionClass):  # type: ignore
+		def __init__(self, *args: Any, **kwargs: Any):
+			super().__init__(*args, **kwargs)
+			self.session = _instrument(self.session, 'github')
+
+	with _github_lock:
+		if not _github_instrumented:
+			Requester.injectConnectionClasses(GithubHTTPConnection, GithubHTTPSConnection)
+			_github_instrumented = True
+
+
+def github_client(token: str, api_url: str) -> Github:
+	"""Make GitHub API client.
+
+	Args:
+		token: GitHub Personal access token.
+		api_url: URL of GitHub API, see `hublabbot.settings.HubLabBotSettings.gh_api_url`.
+
+	"""
+	from github import Github  # type: ignore
+	if not _github_instrumented:
+		_instrument_github()
+	return Github(token, base_url=api_url)
+
+
+def gitlab_client(base_url: str, token: str) -> Gitlab:
+	"""Make GitLab API client.
+
+	Args:
+		base_url: URL of GitLab instance.
+		token: GitLab Personal access token.
+
+	"""
+	from gitlab import Gitlab  # type: ignore
+	return Gitlab(base_url, private_token=token, session=InstrumentedSession('gitlab'))
@@ -9,3 +9,29 @@ GITLAB_ENDPOINT = 'webhook/gitlab'
 """Pyramid route name for our GitLab webhook."""
 GITLAB_BUTTON_API_ENDPOINT = 'api/gitlab_button'
 """Pyramid route name for our GitLab button API."""
+METRICS_ROUTE = 'metrics'
+"""Pyramid route name for metrics in Prometheus text format."""
+ADMIN_PROFILE_ROUTE = 'admin/profile'
+"""Pyramid route name for admin route to control profiling."""
+ADMIN_BACKFILL_ROUTE = 'admin/backfill'
+"""Pyramid route name for admin route to backfill external PRs to GitLab."""
+ADMIN_CI_SECTIONS_ROUTE = 'admin/ci_sections'
+"""Pyramid route name for admin route of timings of GitLab CI sections."""
+DELIVERIES_KEY = 'hublabbot.deliveries'
+"""Pyramid registry settings key for `hublabbot.delivery.DeliveryCache`."""
+JOURNAL_KEY = 'hublabbot.journal'
+"""Pyramid registry settings key for `hublabbot.journal.Journal`."""
+TRACES_KEY = 'hublabbot.traces'
+"""Pyramid registry settings key for `hublabbot.tracing.SlowRequestLog`."""
+STORE_KEY = 'hublabbot.store'
+"""Pyramid registry settings key for `hublabbot.store.StateStore`."""
+SCHEDULER_KEY = 'hublabbot.scheduler'
+"""Pyramid registry settings key for `hublabbot.scheduler.Scheduler`."""
+CORRELATION_KEY = 'hublabbot.correlation'
+"""Pyramid registry settings key for `hublabbot.correlation.CorrelationCache`."""
+OUTBOX_KEY = 'hublabbot.outbox'
+"""Pyramid registry settings key for `hublabbot.outbox.Outbox`."""
+FAIR_QUEUE_KEY = 'hublabbot.fair_queue'
+"""Pyramid registry settings key for `hublabbot.fairness.FairQueue`."""
+CI_TIMINGS_KEY = 'hublabbot.ci_timings'
+"""Pyramid registry settings key for `hublabbot.ci_timings.CiTimings`."""
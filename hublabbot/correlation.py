@@ -0,0 +1,143 @@
+"""Module for correlation of GitLab pipelines, GitHub commits and PRs.
+
+`CorrelationCache` is filled from every payload HubLabBot sees (pull_request events, Pipeline
+Hooks, results of lookups), so handlers resolve pipeline's failed jobs and commit's PR without
+scans of pipelines and PRs. It's only cache: on miss handlers look up by API as before.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+from dataclasses import dataclass, asdict
+
+from hublabbot.cache import TTLCache
+from hublabbot.util import JsonDict
+from hublabbot.metrics import CORRELATION_LOOKUPS
+
+
+T = TypeVar('T')
+
+
+@dataclass(frozen=True)
+class PipelineInfo:
+	"""Immutable record of GitLab pipeline from Pipeline Hook.
+
+	Attributes:
+		id: ID of pipeline.
+		sha: Sha of pipeline's commit.
+		ref: Branch name.
+		status: Status of pipeline.
+		failed_job_ids: IDs of failed jobs, newest first (like `scope='failed'` jobs list).
+
+	"""
+
+	id: int
+	sha: str
+	ref: str
+	status: str
+	failed_job_ids: Tuple[int, ...]
+
+
+class CorrelationCache:
+	"""Bounded cache of pipeline ID ↔ sha ↔ ref ↔ PR number ↔ failed job IDs.
+
+	Args:
+		maxsize: Maximum count of entries in every index.
+		ttl: Time to live of entry in seconds.
+
+	"""
+
+	def __init__(self, maxsize: int, ttl: float):
+		self._pipelines: TTLCache[Tuple[str, int], PipelineInfo] = TTLCache(maxsize, ttl)
+		self._prs_by_sha: TTLCache[Tuple[str, str], int] = TTLCache(maxsize, ttl)
+		self._prs_by_ref: TTLCache[Tuple[str, str], int] = TTLCache(maxsize, ttl)
+
+	def record_pull_request(self, gh_repo_path: str, pr: JsonDict) -> None:
+		"""Record PR from pull_request event or API.
+
+		Args:
+			gh_repo_path: Path like {namespace}/{repo name} in GitHub.
+			pr: JSON from GitHub with PR dict.
+
+		"""
+		number: int = pr['number']
+		head = pr['head']
+		# branch of fork isn't branch of repo
+		is_internal = head['repo'] is not None and head['repo']['full_name'] == gh_repo_path
+		if pr['state'] == 'closed':
+			self._prs_by_sha.pop((gh_repo_path, head['sha']))
+			if is_internal:
+				self._prs_by_ref.pop((gh_repo_path, head['ref']))
+			return
+		self._prs_by_sha.set((gh_repo_path, head['sha']), number)
+		if is_internal:
+			self._prs_by_ref.set((gh_repo_path, head['ref']), number)
+
+	def record_pr_sha(self, gh_repo_path: str, sha: str, number: int) -> None:
+		"""Record that `sha` is head of open PR `number`."""
+		self._prs_by_sha.set((gh_repo_path, sha), number)
+
+	def forget_pr_ref(self, gh_repo_path: str, ref: str) -> None:
+		"""Forget PR of branch `ref`, e.g. PR closed while its event was missed."""
+		self._prs_by_ref.pop((gh_repo_path, ref))
+
+	def record_pipeline(self, gl_repo_path: str, payload: JsonDict) -> PipelineInfo:
+		"""Record pipeline from Pipeline Hook.
+
+		Args:
+			gl_repo_path: Path like {namespace}/{repo name} in GitLab.
+			payload: JSON payload of Pipeline Hook.
+
+		Returns:
+			Recorded `PipelineInfo`.
+
+		"""
+		attributes = payload['object_attributes']
+		failed_job_ids = sorted((build['id'] for build in payload.get('builds') or []
+		                         if build['status'] == 'failed'), reverse=True)
+		pipeline = PipelineInfo(
+			id=attributes['id'],
+			sha=attributes['sha'],
+			ref=attributes['ref'],
+			status=attributes['status'],
+			failed_job_ids=tuple(failed_job_ids))
+		self._pipelines.set((gl_repo_path, pipeline.id), pipeline)
+		return pipeline
+
+	def pipeline(self, gl_repo_path: str, pipeline_id: int) -> Optional[PipelineInfo]:
+		"""Returns recorded pipeline or `None`."""
+		return self._lookup('pipeline', self._pipelines.get((gl_repo_path, pipeline_id)))
+
+	def pr_by_sha(self, gh_repo_path: str, sha: str) -> Optional[int]:
+		"""Returns number of open PR with head `sha` or `None`."""
+		return self._lookup('pr_by_sha', self._prs_by_sha.get((gh_repo_path, sha)))
+
+	def pr_by_ref(self, gh_repo_path: str, ref: str) -> Optional[int]:
+		"""Returns number of PR from branch `ref` of repo, which was open when recorded, or `None`."""
+		return self._lookup('pr_by_ref', self._prs_by_ref.get((gh_repo_path, ref)))
+
+	def clear(self) -> None:
+		"""Forget all recorded pipelines and PRs."""
+		self._pipelines.clear()
+		self._prs_by_sha.clear()
+		self._prs_by_ref.clear()
+
+	def dump(self) -> Dict[str, List[List[Any]]]:
+		"""Returns JSON entries of indexes for `hublabbot.snapshot.Snapshotter`."""
+		return {
+			'pipelines': [[list(key), ttl, asdict(pipeline)]
+			              for key, ttl, pipeline in self._pipelines.dump()],
+			'prs_by_sha': [[list(key), ttl, number] for key, ttl, number in self._prs_by_sha.dump()],
+			'prs_by_ref': [[list(key), ttl, number] for key, ttl, number in self._prs_by_ref.dump()]}
+
+	def warm(self, load: Callable[[str], List[List[Any]]]) -> None:
+		"""Warm indexes lazily with JSON entries of previous run, see `dump`."""
+		self._pipelines.warm(lambda: [
+			((key[0], key[1]), ttl, PipelineInfo(**dict(pipeline, failed_job_ids=tuple(
+				pipeline['failed_job_ids'])))) for key, ttl, pipeline in load('pipelines')])
+		self._prs_by_sha.warm(lambda: [((key[0], key[1]), ttl, number)
+		                               for key, ttl, number in load('prs_by_sha')])
+		self._prs_by_ref.warm(lambda: [((key[0], key[1]), ttl, number)
+		                               for key, ttl, number in load('prs_by_ref')])
+
+	@staticmethod
+	def _lookup(index: str, value: Optional[T]) -> Optional[T]:
+		CORRELATION_LOOKUPS.inc(index, 'hit' if value is not None else 'miss')
+		return value
@@ -0,0 +1,191 @@
+"""Module for webhook delivery deduplication."""
+from typing import Any, Callable, Dict, List, Optional, Set
+import functools
+from threading import Lock
+
+from pyramid.interfaces import IResponse  # type: ignore
+
+from hublabbot.const import DELIVERIES_KEY
+from hublabbot.cache import TTLCache
+from hublabbot.store import StateStore
+from hublabbot.util import JsonDict
+
+
+_SOURCE_PREFIX = {'github': 'GH', 'gitlab': 'GL'}
+IN_FLIGHT = {'status': 'IGNORE', 'note': 'Delivery is in progress, duplicate suppressed.'}
+"""Result of delivery, which is processed now, it's recorded until handler returns."""
+IN_FLIGHT_TTL = 600
+"""Maximum time of processing of delivery in seconds, marker of crashed replica expires after."""
+
+
+class DeliveryCache:
+	"""Cache of processed deliveries, GitHub and GitLab retries them on timeouts and errors.
+
+	If `store` is set, results are also recorded in shared store, so retry delivered
+	to other replica is suppressed too.
+
+	Attributes:
+		suppressed: Count of suppressed duplicates by source (`'github'` or `'gitlab'`).
+
+	"""
+
+	def __init__(self, maxsize: int, ttl: float, store: Optional[StateStore] = None):
+		self._results: TTLCache[str, JsonDict] = TTLCache(maxsize, ttl)
+		self._ttl = ttl
+		self._store = store
+		self._lock = Lock()
+		self._in_flight: Set[str] = set()
+		self.suppressed: Dict[str, int] = {'github': 0, 'gitlab': 0}
+
+	def get(self, source: str, delivery_id: str) -> Optional[JsonDict]:
+		"""Get recorded result of delivery, counts it as suppressed duplicate.
+
+		Args:
+			source: `'github'` or `'gitlab'`.
+			delivery_id: Value of `X-GitHub-Delivery` or `X-Gitlab-Event-UUID` header.
+
+		Returns:
+			Recorded result, `IN_FLIGHT` if delivery is processed now or `None` if delivery
+			not processed yet.
+
+		"""
+		key = f'{source}:{delivery_id}'
+		result = self._results.get(key)
+		if result is None and self._store is not None:
+			result = self._store.get(f'delivery:{key}')
+		if result is None:
+			with self._lock:
+				if key in self._in_flight:
+					result = IN_FLIGHT
+		if result is not None:
+			with self._lock:
+				self.suppressed[source] += 1
+		return result
+
+	def begin(self, source: str, delivery_id: str) -> bool:
+		"""Atomically mark delivery as processed now, see `record` and `abort`.
+
+		Args:
+			source: `'github'` or `'gitlab'`.
+			delivery_id: Value of `X-GitHub-Delivery` or `X-Gitlab-Event-UUID` header.
+
+		Returns:
+			`True` if delivery is marked, `False` if it's already processed or processed now
+			by other thread or replica.
+
+		"""
+		key = f'{source}:{delivery_id}'
+		with self._lock:
+			marked = key not in self._in_flight
+			self._in_flight.add(key)
+		if marked and self._store is not None:
+			marked = self._store.add(f'delivery:{key}', IN_FLIGHT, IN_FLIGHT_TTL)
+			if not marked:
+				with self._lock:
+					self._in_flight.discard(key)
+		if not marked:
+			with self._lock:
+				self.suppressed[source] += 1
+		return marked
+
+	def abort(self, source: str, delivery_id: str) -> None:
+		"""Unmark failed delivery marked by `begin`, so its retry is processed again."""
+		key = f'{source}:{delivery_id}'
+		if self._store is not None:
+			self._store.delete(f'delivery:{key}')
+		with self._lock:
+			self._in_flight.discard(key)
+
+	def record(self, source: str, delivery_id: str, result: JsonDict) -> None:
+		"""Record result of processed delivery.
+
+		Args:
+			source: `'github'` or `'gitlab'`.
+			delivery_id: Value of `X-GitHub-Delivery` or `X-Gitlab-Event-UUID` header.
+			result: JSON dict returned by handler.
+
+		"""
+		key = f'{source}:{delivery_id}'
+		self._results.set(key, result)
+		if self._store is not None:
+			self._store.set(f'delivery:{key}', result, self._ttl)
+		with self._lock:
+			self._in_flight.discard(key)
+
+	def dump(self) -> Dict[str, List[List[Any]]]:
+		"""Returns JSON entries of recorded results for `hublabbot.snapshot.Snapshotter`."""
+		return {'results': [[key, ttl, result] for key, ttl, result in self._results.dump()]}
+
+	def warm(self, load: Callable[[str], List[List[Any]]]) -> None:
+		"""Warm recorded results lazily with JSON entries of previous run, see `dump`."""
+		self._results.warm(lambda: [(key, ttl, result) for key, ttl, result in load('results')])
+
+
+def claim_delivery(deliveries: DeliveryCache, source: str, delivery_id: str) -> Optional[JsonDict]:
+	"""Claim delivery for processing, see `finish_delivery`.
+
+	Args:
+		deliveries: `DeliveryCache`.
+		source: `'github'` or `'gitlab'`.
+		delivery_id: Value of `X-GitHub-Delivery` or `X-Gitlab-Event-UUID` header.
+
+	Returns:
+		Result of duplicate - recorded one or `IN_FLIGHT`, `None` if delivery is claimed.
+
+	"""
+	recorded = deliveries.get(source, delivery_id)
+	if recorded is not None:
+		print(f'{_SOURCE_PREFIX[source]}: Delivery {delivery_id} already processed,'
+		      + f' duplicate suppressed ({deliveries.suppressed[source]} total).')
+		return recorded
+	if not deliveries.begin(source, delivery_id):
+		print(f'{_SOURCE_PREFIX[source]}: Delivery {delivery_id} is in progress, duplicate suppressed.')
+		return dict(IN_FLIGHT)
+	return None
+
+
+def finish_delivery(deliveries: DeliveryCache, source: str, delivery_id: str,
+                    result: Optional[IResponse]) -> None:
+	"""Record result of delivery claimed by `claim_delivery`.
+
+	Args:
+		deliveries: `DeliveryCache`.
+		source: `'github'` or `'gitlab'`.
+		delivery_id: Value of `X-GitHub-Delivery` or `X-Gitlab-Event-UUID` header.
+		result: Result of handler, `None` or not JSON dict - delivery failed, it's unmarked.
+
+	"""
+	if isinstance(result, dict):
+		deliveries.record(source, delivery_id, result)
+	else:
+		deliveries.abort(source, delivery_id)
+
+
+def deduplicated(source: str) -> Callable[[Callable[[Any], IResponse]], Callable[[Any], IResponse]]:
+	"""Decorator for view's handlers, returns recorded result for already processed delivery.
+
+	View must have `request` and `delivery_id` attributes. Delivery is marked as processed
+	before handler is called, so redelivery received meanwhile is suppressed too. Failed
+	deliveries are unmarked, so their retries are processed again.
+
+	Args:
+		source: `'github'` or `'gitlab'`.
+
+	"""
+	def decorator(handler: Callable[[Any], IResponse]) -> Callable[[Any], IResponse]:
+		@functools.wraps(handler)
+		def wrapper(view: Any) -> IResponse:
+			if view.delivery_id is None:
+				return handler(view)
+			deliveries: DeliveryCache = view.request.registry.settings[DELIVERIES_KEY]
+			duplicate = claim_delivery(deliveries, source, view.delivery_id)
+			if duplicate is not None:
+				return duplicate
+			result = None
+			try:
+				result = handler(view)
+			finally:
+				finish_delivery(deliveries, source, view.delivery_id, result)
+			return result
+		return wrapper
+	return decorator
@@ -0,0 +1,243 @@
+"""Module for fair sharing of delivery processing between repos.
+
+Deliveries of all repos share slots of `FairQueue`. When all slots are busy, deliveries wait
+in per-repo queues served by deficit round robin: every round repo earns `DRR_QUANTUM` multiplied
+by its weight and spends average count of API calls of its deliveries on admission of delivery,
+so repo with flood of expensive deliveries gets its share of slots, not all of them.
+Repo can also be capped in concurrent deliveries and in API calls per minute, see
+`hublabbot.settings.RepoFairShareOption`.
+
+Gate applies to both engines. WSGI views wait in `FairQueue.slot`, blocking their thread, so WSGI
+app needs threaded server - `hublabbot` command serves it by `hublabbot.main.ThreadingWSGIServer`.
+ASGI app (`hublabbot.aio.app`) waits in `FairQueue.slot_async` without blocking event loop.
+"""
+from typing import AsyncIterator, Callable, Deque, Dict, Iterator, Optional
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+from hublabbot.settings import RepoOptions
+from hublabbot.client import OutboundCall
+from hublabbot.metrics import REPO_QUEUE_WAIT, REPO_QUEUE_DEPTH, REPO_API_CALLS
+
+
+DRR_QUANTUM = 10.0
+"""API calls earned by repo of weight `1` in round of deficit round robin."""
+COST_SMOOTHING = 0.2
+"""Weight of last delivery in moving average of API calls per delivery of repo."""
+
+
+class _RepoQueue:
+	def __init__(self, repo_options: RepoOptions):
+		self.repo_path = repo_options.gh_repo_path
+		self.options = repo_options.fair_share
+		self.waiters: Deque[Callable[[], None]] = deque()
+		self.in_ring = False
+		self.active = 0
+		self.deficit = 0.0
+		self.cost = 1.0
+		self.tokens = float(self.options.api_budget or 0)
+		self.refilled = time.monotonic()
+
+	def refill(self) -> None:
+		if self.options.api_budget is None:
+			return
+		now = time.monotonic()
+		self.tokens = min(float(self.options.api_budget),
+		                  self.tokens + (now - self.refilled) * self.options.api_budget / 60)
+		self.refilled = now
+
+	def over_budget(self) -> bool:
+		return self.options.api_budget is not None and self.tokens <= 0
+
+	def eligible(self, capacity: int) -> bool:
+		max_concurrency = self.options.max_concurrency or capacity
+		return self.active < max_concurrency and not self.over_budget()
+
+
+class _Delivery:
+	def __init__(self, queue: _RepoQueue):
+		self.queue = queue
+		self.calls = 0
+
+
+# delivery of current thread or asyncio task, API calls are counted to it
+_delivery: 'contextvars.ContextVar[Optional[_Delivery]]' = contextvars.ContextVar(
+	'hublabbot_fair_delivery', default=None)
+
+
+class FairQueue:
+	"""Slots of delivery processing shared fairly by repos.
+
+	Args:
+		capacity: Count of slots - deliveries processed at once. If `0`, deliveries aren't queued.
+
+	"""
+
+	def __init__(self, capacity: int):
+		self.capacity = capacity
+		"""Count of slots - deliveries processed at once."""
+		self._lock = threading.Lock()
+		self._queues: Dict[str, _RepoQueue] = {}
+		self._ring: Deque[_RepoQueue] = deque()
+		self._active = 0
+		self._timer: Optional[threading.Timer] = None
+
+	def _next(self) -> Optional[_RepoQueue]:
+		# deficit round robin over repos with waiting deliveries
+		skipped = 0
+		while len(self._ring) > 0 and skipped < len(self._ring):
+			queue = self._ring[0]
+			if len(queue.waiters) == 0:
+				self._ring.popleft()
+				queue.in_ring = False
+				queue.deficit = 0.0
+				continue
+			queue.refill()
+			if not queue.eligible(self.capacity):
+				self._ring.rotate(-1)
+				skipped += 1
+				continue
+			if queue.deficit >= queue.cost:
+				queue.deficit -= queue.cost
+				return queue
+			queue.deficit += DRR_QUANTUM * queue.options.weight
+			self._ring.rotate(-1)
+			skipped = 0
+		return None
+
+	def _dispatch(self) -> None:
+		while self._active < self.capacity:
+			queue = self._next()
+			if queue is None:
+				break
+			queue.active += 1
+			self._active += 1
+			queue.waiters.popleft()()
+			REPO_QUEUE_DEPTH.set(len(queue.waiters), queue.repo_path)
+		self._schedule_refill()
+
+	def _schedule_refill(self) -> None:
+		# waiters of repos over budget are dispatched again, when budget is refilled
+		if self._timer is not None or self._active >= self.capacity:
+			return
+		delays = [-queue.tokens * 60 / queue.options.api_budget
+		          for queue in self._ring
+		          if queue.options.api_budget and len(queue.waiters) > 0 and queue.over_budget()]
+		if len(delays) == 0:
+			return
+		self._timer = threading.Timer(min(delays) + 0.01, self._on_refill)
+		self._timer.daemon = True
+		self._timer.start()
+
+	def _on_refill(self) -> None:
+		with self._lock:
+			self._timer = None
+			self._dispatch()
+
+	def _submit(self, repo_options: RepoOptions, admit: Callable[[], None]) -> _RepoQueue:
+		with self._lock:
+			queue = self._queues.get(repo_options.gh_repo_path)
+			if queue is None:
+				queue = self._queues[repo_options.gh_repo_path] = _RepoQueue(repo_options)
+			if not queue.in_ring:
+				self._ring.append(queue)
+				queue.in_ring = True
+			queue.waiters.append(admit)
+			REPO_QUEUE_DEPTH.set(len(queue.waiters), queue.repo_path)
+			self._dispatch()
+		return queue
+
+	def _withdraw(self, queue: _RepoQueue, admit: Callable[[], None]) -> bool:
+		with self._lock:
+			if admit not in queue.waiters:
+				return False
+			queue.waiters.remove(admit)
+			REPO_QUEUE_DEPTH.set(len(queue.waiters), queue.repo_path)
+			return True
+
+	def _release(self, delivery: _Delivery) -> None:
+		queue = delivery.queue
+		with self._lock:
+			queue.active -= 1
+			self._active -= 1
+			queue.cost += COST_SMOOTHING * (max(delivery.calls, 1) - queue.cost)
+			self._dispatch()
+
+	@contextmanager
+	def slot(self, repo_options: RepoOptions) -> Iterator[None]:
+		"""Context manager - wait for slot of repo and hold it, for WSGI engine.
+
+		Wait blocks current thread, so it needs threaded server, see `hublabbot.main.ThreadingWSGIServer`.
+
+		Args:
+			repo_options: `hublabbot.settings.RepoOptions` of delivery.
+
+		"""
+		if self.capacity <= 0:
+			yield
+			return
+		admitted = threading.Event()
+		start = time.perf_counter()
+		queue = self._submit(repo_options, admitted.set)
+		admitted.wait()
+		REPO_QUEUE_WAIT.observe(time.perf_counter() - start, queue.repo_path)
+		delivery = _Delivery(queue)
+		token = _delivery.set(delivery)
+		try:
+			yield
+		finally:
+			_delivery.reset(token)
+			self._release(delivery)
+
+	@asynccontextmanager
+	async def slot_async(self, repo_options: RepoOptions) -> AsyncIterator[None]:
+		"""Async context manager - wait for slot of repo and hold it, for ASGI engine, see `slot`."""
+		if self.capacity <= 0:
+			yield
+			return
+		loop = asyncio.get_running_loop()
+		admitted = loop.create_future()
+
+		def set_admitted() -> None:
+			if not admitted.done():
+				admitted.set_result(None)
+
+		def admit() -> None:
+			loop.call_soon_threadsafe(set_admitted)
+
+		start = time.perf_counter()
+		queue = self._submit(repo_options, admit)
+		try:
+			await admitted
+		except asyncio.CancelledError:
+			# slot taken meanwhile is released
+			if not self._withdraw(queue, admit):
+				self._release(_Delivery(queue))
+			raise
+		REPO_QUEUE_WAIT.observe(time.perf_counter() - start, queue.repo_path)
+		delivery = _Delivery(queue)
+		token = _delivery.set(delivery)
+		try:
+			yield
+		finally:
+			_delivery.reset(token)
+			self._release(delivery)
+
+	def observe_call(self, call: OutboundCall) -> None:
+		"""Observer of outbound calls, counts call to delivery and charges budget of its repo.
+
+		See `hublabbot.client.add_observer`.
+		"""
+		delivery = _delivery.get()
+		if delivery is None:
+			return
+		delivery.calls += 1
+		REPO_API_CALLS.inc(delivery.queue.repo_path)
+		if delivery.queue.options.api_budget is not None:
+			with self._lock:
+				delivery.queue.refill()
+				delivery.queue.tokens -= 1
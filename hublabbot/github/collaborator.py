@@ -1,9 +1,13 @@
 """Module for collaborators setup in GitHub repo."""
-import github.Repository as ghr  # type: ignore
-import github.AuthenticatedUser as gha  # type: ignore
-from github import Github
+from __future__ import annotations
+from typing import TYPE_CHECKING
 
 from hublabbot.settings import RepoOptions
+from hublabbot.client import github_client
+
+if TYPE_CHECKING:
+	import github.Repository as ghr  # type: ignore
+	import github.AuthenticatedUser as gha  # type: ignore
 
 
 def _add(repo: ghr.Repository, bot: gha.AuthenticatedUser) -> None:
@@ -18,11 +22,11 @@ def _remove(repo: ghr.Repository, bot: gha.AuthenticatedUser) -> None:
 	print(f'GH:{repo.full_name}: "{bot.login}" removed from collaborators.')
 
 
-def configure(token: str, bot_token: str, repo_options: RepoOptions) -> None:
+def configure(token: str, bot_token: str, api_url: str, repo_options: RepoOptions) -> None:
 	"""Configure collaborators in GitHub repo."""
-	github = Github(token)
+	github = github_client(token, api_url)
 	repo = github.get_repo(repo_options.gh_repo_path, lazy=True)
-	github_bot = Github(bot_token)
+	github_bot = github_client(bot_token, api_url)
 	bot = github_bot.get_user()
 	if repo_options.gh_auto_merge_pr is not None:
 		if not repo.has_in_collaborators(bot.login):
@@ -1,73 +1,180 @@
 """Module for GitHub webhook functionality."""
-from typing import Optional
-import sys
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, List, Optional, Sequence, Tuple
+import time
+import traceback
 import tempfile
 from string import Template
+from pathlib import Path
 from urllib.parse import urlsplit
-from threading import Timer
 
-import github.PullRequest as ghp  # type: ignore
-from github import Github
-import pygit2
 from pyramid.interfaces import IResponse  # type: ignore
 
 from hublabbot.util import JsonDict
 from hublabbot.settings import HubLabBotSettings
-
-
-class RemotePushCallback(pygit2.RemoteCallbacks):
-	"""Callback for remote push."""
-
-	def __init__(self, gh_repo_path: str, gl_repo_path: str, pr_num: int):
-		self.gh_repo_path = gh_repo_path
-		"""Path like {namespace}/{repo name} in GitHub."""
-		self.gl_repo_path = gl_repo_path
-		"""Path like {namespace}/{repo name} in GitLab."""
-		self.pr_num = pr_num
-		"""Number of PR."""
-
-	def push_update_reference(self, refname: bytes, message: Optional[bytes]) -> None:
-		"""Overrided callback for remote push.
-
-		Args:
-			refname: The name of the reference (on the remote).
-			message: Rejection message from the remote. If None, the update was accepted.
-
-		"""
-		if message is None:
-			print(f'GH:{self.gh_repo_path}: PR#{self.pr_num} ({refname.decode("utf-8")})'
-			      + f' synced to GL:{self.gl_repo_path}.')
-		else:
-			print(f'GH:{self.gh_repo_path}: Fail sync PR#{self.pr_num} ({refname.decode("utf-8")})'
-			      + f' to GL:{self.gl_repo_path} - "{message.decode("utf-8")}"!', file=sys.stderr)
+from hublabbot.client import InstrumentedSession, github_client
+from hublabbot.tracing import span
+from hublabbot.profiling import profiled
+from hublabbot.metrics import GIT_SYNC_BYTES, GIT_SYNC_DURATION, SWEEP_MERGES, MERGE_QUEUE_RESULTS
+from hublabbot.scheduler import Scheduler, MERGE_JOB, MERGE_QUEUE_JOB
+from hublabbot.github.merge_queue import (MergeQueue, QueuedPr, enqueue, RECHECK_DELAY,
+                                          UPDATE_TIMEOUT)
+from hublabbot.correlation import CorrelationCache
+from hublabbot.outbox import Outbox, MERGE_ACTION, COMMENT_ACTION, SYNC_ACTION, perform
+
+if TYPE_CHECKING:
+	import github.PullRequest as ghp  # type: ignore
+
+
+AUTO_MERGE_CANDIDATES_QUERY = '''
+query($owner: String!, $name: String!, $label: String!, $cursor: String) {
+	repository(owner: $owner, name: $name) {
+		pullRequests(states: OPEN, labels: [$label], first: 100, after: $cursor) {
+			pageInfo { hasNextPage endCursor }
+			nodes {
+				number
+				author { login }
+				mergeable
+				headRefOid
+				commits(last: 1) { nodes { commit { status { state } } } }
+			}
+		}
+	}
+}
+'''
+"""GraphQL query of open PRs with label, with all fields required to check auto-merge."""
+
+
+def graphql_url(api_url: str) -> str:
+	"""Returns URL of GitHub GraphQL API by URL of REST API (`/api/v3` of GitHub Enterprise)."""
+	api_url = api_url.rstrip('/')
+	if api_url.endswith('/api/v3'):
+		return api_url[:-len('/v3')] + '/graphql'
+	return api_url + '/graphql'
+
+
+def _format_duration(seconds: float) -> str:
+	minutes, seconds = divmod(int(seconds), 60)
+	hours, minutes = divmod(minutes, 60)
+	return f'{hours}:{minutes:02}:{seconds:02}' if hours > 0 else f'{minutes:02}:{seconds:02}'
+
+
+def render_gitlabci_fail(assets_path: Path, failed_stage: str, failed_job_url: str,
+                         failed_job_log: str, slowest_sections: Sequence[Tuple[str, float]] = ()
+) -> str:
+	"""Render markdown of GitLab CI fail-report from `gitlabci_fail.templ.md`.
+
+	Args:
+		assets_path: Path to assets dir.
+		failed_stage: Stage at which the error occurred.
+		failed_job_url: Fail job URL.
+		failed_job_log: Fail job log.
+		slowest_sections: Name and duration in seconds of slowest sections of fail job,
+			see `hublabbot.ci_timings.slowest_sections`.
+
+	"""
+	gitlabci_fail_tmd = (assets_path / 'gitlabci_fail.templ.md').read_text()
+	gitlabci_fail_templ = Template(gitlabci_fail_tmd)
+	sections_md = ''
+	if len(slowest_sections) > 0:
+		rows = ''.join(f'| `{name}` | {_format_duration(duration)} |\n'
+		               for name, duration in slowest_sections)
+		sections_md = ('<details>\n<summary>Slowest sections</summary>\n\n'
+		               + f'| Section | Time |\n| --- | --- |\n{rows}</details>\n')
+	return gitlabci_fail_templ.substitute(
+		failed_stage=failed_stage,
+		failed_job_log=failed_job_log,
+		failed_job_url=failed_job_url,
+		slowest_sections=sections_md)
 
 
 class GithubWebhook:
 	"""Main class with GitHub functionality."""
 
-	def __init__(self, settings: HubLabBotSettings, repo_path: str, is_admin: bool = False):
+	def __init__(self, settings: HubLabBotSettings, repo_path: str, is_admin: bool = False,
+	             correlation: Optional[CorrelationCache] = None, outbox: Optional[Outbox] = None):
 		self.settings = settings
 		"""`hublabbot.settings.HubLabBotSettings`."""
 		self.repo_path = repo_path
 		"""Path like {namespace}/{repo name} in GitHub."""
 		self.repo_options = self.settings.get_repo_by_github(repo_path)
 		"""`hublabbot.settings.RepoOptions`."""
-		self.github = Github(self.settings.gh_token if is_admin else self.settings.gh_bot_token)
-		"""Github object with bot credentials."""
-
-	def _merge_pr(self, pr: ghp.PullRequest) -> None:
+		self._token = self.settings.gh_token if is_admin else self.settings.get_gh_bot_token(repo_path)
+		self.github = github_client(self._token, self.settings.gh_api_url)
+		"""Github object with bot credentials (installation token of GitHub App, if configured)."""
+		self.correlation = correlation
+		"""`hublabbot.correlation.CorrelationCache`, `None` - lookups by API only."""
+		self.outbox = outbox
+		"""`hublabbot.outbox.Outbox` of merges, comments and pushes, `None` - perform directly."""
+
+	def _has_required_label(self, pr: ghp.PullRequest) -> bool:
 		assert self.repo_options.gh_auto_merge_pr is not None
-		if pr.update() is True:
-			if pr.state == 'closed' or not pr.mergeable:
-				return
-			if self.repo_options.gh_auto_merge_pr.required_label_name not in [l.name for l in pr.labels]:
-				return
-		status = pr.merge()
+		label_name = self.repo_options.gh_auto_merge_pr.required_label_name
+		return label_name in [label.name for label in pr.labels]
+
+	def _merge_pr(self, pr: ghp.PullRequest, sha: Optional[str] = None) -> None:
+		# PR isn't merged, if it's pushed since `sha` was checked
+		status = pr.merge(sha=sha) if sha is not None else pr.merge()
 		if status.merged:
 			print(f'GH:{self.repo_path}: PR#{pr.number} merged.')
 		else:
 			raise RuntimeError(f'GH:{self.repo_path}: PR#{pr.number} fail to merge - "{status.message}"!')
 
+	def _submit_merge(self, pr: ghp.PullRequest, sha: str) -> IResponse:
+		# retries from outbox merge same checked `sha`, see `merge_pr`
+		return perform(self.outbox, MERGE_ACTION, f'{self.repo_path}#{pr.number}',
+		               {'repo': self.repo_path, 'pr': pr.number, 'sha': sha},
+		               lambda: self._merge_pr(pr, sha))
+
+	def merge_pr(self, pr_number: int, sha: Optional[str] = None) -> None:
+		"""Outbox action - merge PR, already merged, closed and unlabelled PRs are skipped.
+
+		Args:
+			pr_number: Number of PR.
+			sha: Expected head sha of PR, whose status was checked, `None` - any.
+
+		"""
+		pr = self.github.get_repo(self.repo_path).get_pull(pr_number)
+		if pr.merged:
+			print(f'GH:{self.repo_path}: PR#{pr_number} already merged.')
+			return
+		if (pr.state == 'closed' or self.repo_options.gh_auto_merge_pr is None
+		    or not self._has_required_label(pr)):
+			print(f'GH:{self.repo_path}: PR#{pr_number} auto-merge canceled.')
+			return
+		self._merge_pr(pr, sha)
+
+	def _comment_pr(self, pr: ghp.PullRequest, body: str) -> None:
+		pr.create_issue_comment(body)
+		print(f'GH:{self.repo_path}: Comment with GitLab CI fail-report posted to PR#{pr.number}.')
+
+	def comment_pr(self, pr_number: int, body: str) -> None:
+		"""Outbox action - post comment to PR, unless same comment is posted by previous attempt.
+
+		Args:
+			pr_number: Number of PR.
+			body: Markdown of comment.
+
+		"""
+		pr = self.github.get_repo(self.repo_path).get_pull(pr_number)
+		if any(comment.body == body for comment in pr.get_issue_comments()):
+			return
+		self._comment_pr(pr, body)
+
+	@profiled
+	def merge_scheduled_pr(self, pr_number: int) -> None:
+		"""Merge PR delayed by `auto_merge_pr`, if it's still open, mergeable and has required label.
+
+		Args:
+			pr_number: Number of PR.
+
+		"""
+		pr = self.github.get_repo(self.repo_path).get_pull(pr_number)
+		if pr.state == 'closed' or not pr.mergeable or not self._has_required_label(pr):
+			print(f'GH:{self.repo_path}: PR#{pr_number} auto-merge canceled.')
+			return
+		self._submit_merge(pr, pr.head.sha)
+
 	def get_pr_by_sha(self, sha: str) -> Optional[ghp.PullRequest]:
 		"""Get PR by head commit sha.
 
@@ -79,11 +186,42 @@ class GithubWebhook:
 
 		"""
 		repo = self.github.get_repo(self.repo_path)
+		if self.correlation is not None:
+			pr_number = self.correlation.pr_by_sha(self.repo_path, sha)
+			if pr_number is not None:
+				pr = repo.get_pull(pr_number)
+				# PR pushed or closed since it was recorded
+				if pr.head.sha == sha and pr.state == 'open':
+					return pr
 		pr_list = [p for p in repo.get_pulls() if p.head.sha == sha]
 		if len(pr_list) == 0:
 			return None
-		else:
-			return pr_list[0]
+		if self.correlation is not None:
+			self.correlation.record_pr_sha(self.repo_path, sha, pr_list[0].number)
+		return pr_list[0]
+
+	def has_open_pr(self, branch_name: str) -> bool:
+		"""Check branch of repo is head branch of open PR.
+
+		Recorded PR of branch is confirmed by API, it's forgotten if closed or not from branch
+		(e.g. close event was missed), then PR is looked up by head of branch.
+
+		Args:
+			branch_name: Branch name.
+
+		Returns:
+			`True` if branch has open PR, `False` if not.
+
+		"""
+		if self.correlation is not None:
+			pr_number = self.correlation.pr_by_ref(self.repo_path, branch_name)
+			if pr_number is not None:
+				pr = self.github.get_repo(self.repo_path).get_pull(pr_number)
+				if (pr.state == 'open' and pr.head.ref == branch_name and pr.head.repo is not None
+				    and pr.head.repo.full_name == self.repo_path):
+					return True
+				self.correlation.forget_pr_ref(self.repo_path, branch_name)
+		return self.get_pr_by_sha(self.get_branch_head(branch_name)) is not None
 
 	def get_branch_head(self, branch_name: str) -> str:
 		"""Get head sha of `branch_name`.
@@ -113,11 +251,12 @@ class GithubWebhook:
 		pr_repo_path: str = pr['head']['repo']['full_name']
 		return pr_repo_path != self.repo_path
 
-	def auto_merge_pr(self, sha: str) -> IResponse:
+	def auto_merge_pr(self, sha: str, scheduler: Scheduler) -> IResponse:
 		"""Action - auto-merge PR.
 
 		Args:
 			sha: SHA of HEAD commit in PR.
+			scheduler: `hublabbot.scheduler.Scheduler` of delayed merges.
 
 		Returns:
 			`{'status': 'OK', ...}` if action was successful,</br>
@@ -134,17 +273,186 @@ class GithubWebhook:
 			return {'status': 'IGNORE'}
 		if pr.user.login not in self.repo_options.gh_auto_merge_pr.authors_white_list:
 			return {'status': 'IGNORE'}
-		if self.repo_options.gh_auto_merge_pr.required_label_name not in [l.name for l in pr.labels]:
+		if not self._has_required_label(pr):
 			return {'status': 'IGNORE'}
+		if self.repo_options.gh_auto_merge_pr.merge_queue:
+			return enqueue(scheduler, self.repo_path, pr.number, sha,
+			               self.repo_options.gh_auto_merge_pr.delay)
 		if self.repo_options.gh_auto_merge_pr.delay > 0:
-			timer = Timer(self.repo_options.gh_auto_merge_pr.delay, lambda: self._merge_pr(pr))
-			timer.start()
-		else:
-			self._merge_pr(pr)
-		return {'status': 'OK'}
+			# merged by leader replica, see `merge_scheduled_pr`
+			scheduler.schedule(MERGE_JOB, f'{self.repo_path}#{pr.number}',
+			                   {'repo': self.repo_path, 'pr': pr.number},
+			                   self.repo_options.gh_auto_merge_pr.delay)
+			return {'status': 'OK'}
+		return self._submit_merge(pr, sha)
+
+	def list_auto_merge_candidates(self) -> List[JsonDict]:
+		"""List open PRs with required label by batched GraphQL query, 100 PRs per request.
+
+		Returns:
+			PR nodes of `AUTO_MERGE_CANDIDATES_QUERY`.
+
+		"""
+		assert self.repo_options.gh_auto_merge_pr is not None
+		owner, name = self.repo_path.split('/', 1)
+		variables = {'owner': owner, 'name': name, 'cursor': None,
+		             'label': self.repo_options.gh_auto_merge_pr.required_label_name}
+		prs: List[JsonDict] = []
+		# PyGithub has no GraphQL API in versions pinned by Nix
+		with InstrumentedSession('github') as session:
+			while True:
+				response = session.post(
+					graphql_url(self.settings.gh_api_url),
+					json={'query': AUTO_MERGE_CANDIDATES_QUERY, 'variables': variables},
+					headers={'Authorization': f'bearer {self._token}'})
+				response.raise_for_status()
+				data: JsonDict = response.json()
+				if 'errors' in data:
+					raise RuntimeError(f'GH:{self.repo_path}: GraphQL query failed - {data["errors"]}!')
+				pull_requests = data['data']['repository']['pullRequests']
+				prs += pull_requests['nodes']
+				if not pull_requests['pageInfo']['hasNextPage']:
+					return prs
+				variables['cursor'] = pull_requests['pageInfo']['endCursor']
+
+	@profiled
+	def sweep_auto_merge_prs(self, scheduler: Scheduler) -> int:
+		"""Merge ready PRs, whose status webhooks were missed.
+
+		PR is ready if it's checked by `auto_merge_pr`: it's mergeable, its author is in white list,
+		it has required label and status of its head commit is success. Ready PRs are merged
+		(at head sha, which was checked) or scheduled to merge, like by `auto_merge_pr`.
+
+		Args:
+			scheduler: `hublabbot.scheduler.Scheduler` of delayed merges.
+
+		Returns:
+			Count of ready PRs.
+
+		"""
+		assert self.repo_options.gh_auto_merge_pr is not None
+		options = self.repo_options.gh_auto_merge_pr
+		ready = [pr for pr in self.list_auto_merge_candidates()
+		         if pr['mergeable'] == 'MERGEABLE'
+		         and pr['author'] is not None and pr['author']['login'] in options.authors_white_list
+		         and any(commit['commit']['status'] is not None
+		                 and commit['commit']['status']['state'] == 'SUCCESS'
+		                 for commit in pr['commits']['nodes'])]
+		for pr in ready:
+			number: int = pr['number']
+			sha: str = pr['headRefOid']
+			print(f'GH:{self.repo_path}: PR#{number} ready to auto-merge found by sweep.')
+			if options.merge_queue:
+				enqueue(scheduler, self.repo_path, number, sha, options.delay)
+				continue
+			if options.delay > 0:
+				# merge already scheduled by webhook isn't delayed again
+				scheduler.schedule(MERGE_JOB, f'{self.repo_path}#{number}',
+				                   {'repo': self.repo_path, 'pr': number}, options.delay, replace=False)
+				continue
+			try:
+				perform(self.outbox, MERGE_ACTION, f'{self.repo_path}#{number}',
+				        {'repo': self.repo_path, 'pr': number, 'sha': sha},
+				        lambda: self.merge_pr(number, sha))
+			except Exception:
+				traceback.print_exc()
+		SWEEP_MERGES.inc(amount=len(ready))
+		return len(ready)
+
+	def _process_queue_head(self, queue: MergeQueue, entry: QueuedPr,
+	                        scheduler: Scheduler) -> Optional[str]:
+		# returns result for head leaving queue or updated, `None` - head waits
+		now = time.time()
+		if entry.ready > now:
+			scheduler.schedule(MERGE_QUEUE_JOB, self.repo_path, {'repo': self.repo_path},
+			                   entry.ready - now)
+			return None
+		repo = self.github.get_repo(self.repo_path)
+		pr = repo.get_pull(entry.pr)
+		if pr.merged or pr.state == 'closed' or not self._has_required_label(pr):
+			print(f'GH:{self.repo_path}: PR#{entry.pr} dropped from merge queue - closed or unlabelled.')
+			return 'dropped'
+		if entry.updated is not None:
+			# head updated with base branch is checked on every run, not only after timeout
+			if repo.get_commit(pr.head.sha).get_combined_status().state in ('failure', 'error'):
+				print(f'GH:{self.repo_path}: PR#{entry.pr} dropped from merge queue - CI of updated head'
+				      + ' failed.')
+				return 'dropped'
+			if now - entry.updated < UPDATE_TIMEOUT:
+				# queued again with new head by status webhook, see `auto_merge_pr`
+				return None
+			print(f'GH:{self.repo_path}: PR#{entry.pr} dropped from merge queue - CI of updated head'
+			      + ' not passed in time.')
+			return 'dropped'
+		if pr.head.sha != entry.sha:
+			# pushed since its status, new head is queued by its status
+			print(f'GH:{self.repo_path}: PR#{entry.pr} dropped from merge queue - head changed.')
+			return 'dropped'
+		if pr.mergeable is None:
+			# mergeability is computed by GitHub after base branch changed
+			scheduler.schedule(MERGE_QUEUE_JOB, self.repo_path, {'repo': self.repo_path}, RECHECK_DELAY)
+			return None
+		if not pr.mergeable:
+			print(f'GH:{self.repo_path}: PR#{entry.pr} dropped from merge queue - conflicts.')
+			return 'dropped'
+		if pr.mergeable_state == 'behind':
+			# base branch must be merged to head, then CI runs again
+			try:
+				pr.update_branch(entry.sha)
+			except Exception:
+				traceback.print_exc()
+				return 'failed'
+			queue.mark_updated(entry)
+			# own key, so processing scheduled by next status isn't postponed by timeout
+			scheduler.schedule(MERGE_QUEUE_JOB, f'{self.repo_path}#{entry.pr}', {'repo': self.repo_path},
+			                   UPDATE_TIMEOUT)
+			print(f'GH:{self.repo_path}: PR#{entry.pr} updated with base branch, waits for CI.')
+			return 'updated'
+		try:
+			result = perform(self.outbox, MERGE_ACTION, f'{self.repo_path}#{entry.pr}',
+			                 {'repo': self.repo_path, 'pr': entry.pr, 'sha': entry.sha},
+			                 lambda: self._merge_pr(pr, entry.sha))
+		except Exception:
+			traceback.print_exc()
+			return 'failed'
+		return 'deferred' if 'note' in result else 'merged'
+
+	@profiled
+	def process_merge_queue(self, scheduler: Scheduler) -> JsonDict:
+		"""Merge PRs from merge queue of repo in order, see `hublabbot.github.merge_queue`.
+
+		Only mergeability of queue head is checked: clean head is merged at queued sha and next
+		PR becomes head, head behind base branch is updated through API and waits for its CI,
+		queue waits for head, whose mergeability GitHub still computes. Closed, unlabelled,
+		pushed and conflicting PRs are dropped, so is updated head, whose CI failed or didn't pass
+		in time. Merge pending for retry in outbox is deferred.
+
+		Args:
+			scheduler: `hublabbot.scheduler.Scheduler`, its store keeps queue.
+
+		Returns:
+			`{'merged': ..., 'deferred': ..., 'updated': ..., 'dropped': ..., 'failed': ...,
+			'queued': ...}` - counts of PRs by result and count of PRs left in queue.
+
+		"""
+		queue = MergeQueue(scheduler.store, self.repo_path)
+		counts = {'merged': 0, 'deferred': 0, 'updated': 0, 'dropped': 0, 'failed': 0}
+		entries = queue.entries()
+		for entry in entries:
+			result = self._process_queue_head(queue, entry, scheduler)
+			if result is None:
+				break
+			counts[result] += 1
+			MERGE_QUEUE_RESULTS.inc(result)
+			if result == 'updated':
+				break
+			queue.remove(entry.pr)
+		queued = len(entries) - sum(counts.values()) + counts['updated']
+		return {**counts, 'queued': queued}
 
 	def show_gitlabci_fail(self, failed_job_sha: str, failed_stage: str, failed_job_url: str,
-	                       failed_job_log: str) -> IResponse:
+	                       failed_job_log: str, slowest_sections: Sequence[Tuple[str, float]] = ()
+	) -> IResponse:
 		"""Action - post comment with GitLab CI fail-report to PR.
 
 		Args:
@@ -152,6 +460,7 @@ class GithubWebhook:
 			failed_stage: Stage at which the error occurred.
 			failed_job_url: Fail job URL.
 			failed_job_log: Fail job log.
+			slowest_sections: Name and duration in seconds of slowest sections of fail job.
 
 		Returns:
 			`{'status': 'OK', ...}` if action was successful,</br>
@@ -164,16 +473,14 @@ class GithubWebhook:
 			return {
 				'status': 'IGNORE',
 				'note': f'Commit "{failed_job_sha}" not found in Pull Requests.'}
-		gitlabci_fail_tmd = (self.settings.assets_path / 'gitlabci_fail.templ.md').read_text()
-		gitlabci_fail_templ = Template(gitlabci_fail_tmd)
-		gitlabci_fail_md = gitlabci_fail_templ.substitute(
-			failed_stage=failed_stage,
-			failed_job_log=failed_job_log,
-			failed_job_url=failed_job_url)
-		pr.create_issue_comment(gitlabci_fail_md)
-		print(f'GH:{self.repo_path}: Comment with GitLab CI fail-report posted to PR#{pr.number}.')
-		return {'status': 'OK'}
-
+		gitlabci_fail_md = render_gitlabci_fail(self.settings.assets_path, failed_stage,
+		                                        failed_job_url, failed_job_log, slowest_sections)
+		# same report isn't posted twice, if status is delivered again
+		return perform(self.outbox, COMMENT_ACTION, f'{self.repo_path}#{pr.number}:{failed_job_url}',
+		               {'repo': self.repo_path, 'pr': pr.number, 'body': gitlabci_fail_md},
+		               lambda: self._comment_pr(pr, gitlabci_fail_md), once=True)
+
+	@profiled
 	def sync_pr_to_gitlab(self, pr: JsonDict) -> IResponse:
 		"""Action - push external PR's branch to GitLab.
 
@@ -188,16 +495,80 @@ class GithubWebhook:
 		"""
 		if not self.is_external_pr(pr):
 			return {'status': 'IGNORE'}
+		pr_num = pr['number']
+		return perform(self.outbox, SYNC_ACTION, f'{self.repo_path}#{pr_num}',
+		               {'repo': self.repo_path, 'pr': pr_num}, lambda: self.push_pr_to_gitlab(pr_num))
+
+	def _init_sync_repo(self, gitdir: str) -> Any:
+		import pygit2
+		repo = pygit2.init_repository(gitdir, bare=True)
+		creds = f'gitlab-ci-token:{self.settings.gl_token}'
+		gl_url = urlsplit(self.settings.gl_base_url)
+		gl_base = f'{gl_url.scheme}://{creds}@{gl_url.netloc}{gl_url.path.rstrip("/")}'
+		repo.remotes.create('github', f'{self.settings.gh_base_url}/{self.repo_path}.git')
+		repo.remotes.create('gitlab', f'{gl_base}/{self.repo_options.gl_repo_path}.git')
+		return repo
+
+	def _sync_refs(self, repo: Any, pr_nums: List[int], callback: Any) -> None:
+		# one fetch and one push for all PRs
+		pr_refs = [f'refs/heads/pr-{pr_num}' for pr_num in pr_nums]
+		start = time.perf_counter()
+		with span('git', 'fetch', f'/{self.repo_path}.git'):
+			stats = repo.remotes['github'].fetch([f'+refs/pull/{pr_num}/head:{pr_ref}'
+			                                      for pr_num, pr_ref in zip(pr_nums, pr_refs)])
+		GIT_SYNC_DURATION.observe(time.perf_counter() - start, 'fetch')
+		GIT_SYNC_BYTES.inc('fetch', amount=stats.received_bytes)
+		start = time.perf_counter()
+		with span('git', 'push', f'/{self.repo_options.gl_repo_path}.git'):
+			repo.remotes['gitlab'].push(['+' + pr_ref for pr_ref in pr_refs], callback)
+		GIT_SYNC_DURATION.observe(time.perf_counter() - start, 'push')
+		GIT_SYNC_BYTES.inc('push', amount=callback.bytes_pushed)
+
+	def push_pr_to_gitlab(self, pr_num: int) -> None:
+		"""Outbox action - force-push head of PR to branch `pr-{number}` in GitLab.
+
+		Args:
+			pr_num: Number of PR.
+
+		"""
+		from hublabbot.github.remote_push import RemotePushCallback
 		with tempfile.TemporaryDirectory() as gitdir:
-			repo = pygit2.init_repository(gitdir, bare=True)
-			pr_num = pr['number']
-			pr_ref = f'refs/heads/pr-{pr_num}'
-			creds = f'gitlab-ci-token:{self.settings.gl_token}'
-			gl_host = urlsplit(self.settings.gl_base_url).netloc
-			repo.remotes.create('github', f'https://github.com/{self.repo_path}.git')
-			repo.remotes.create('gitlab', f'https://{creds}@{gl_host}/{self.repo_options.gl_repo_path}.git')
-			repo.remotes['github'].fetch([f'+refs/pull/{pr_num}/head:{pr_ref}'])
-			repo.remotes['gitlab'].push(
-				['+' + pr_ref],
-				RemotePushCallback(self.repo_path, self.repo_options.gl_repo_path, pr_num))
-			return {'status': 'OK'}
+			repo = self._init_sync_repo(gitdir)
+			self._sync_refs(repo, [pr_num],
+			                RemotePushCallback(self.repo_path, self.repo_options.gl_repo_path, pr_num))
+
+	@profiled
+	def backfill_prs_to_gitlab(self) -> IResponse:
+		"""Action - push heads of all open external PRs to branches `pr-{number}` in GitLab.
+
+		Branches already at head of PR are skipped, others are fetched from GitHub in one fetch
+		and pushed to GitLab in one push.
+
+		Returns:
+			`{'status': 'OK', 'pushed': [...], 'up_to_date': ..., 'rejected': {...}}`,
+			`pushed` are numbers of PRs.
+
+		"""
+		from hublabbot.github.remote_push import RemotePushCallback
+		heads = {pr.number: pr.head.sha for pr in self.github.get_repo(self.repo_path).get_pulls()
+		         if pr.head.repo is None or pr.head.repo.full_name != self.repo_path}
+		with tempfile.TemporaryDirectory() as gitdir:
+			repo = self._init_sync_repo(gitdir)
+			remote = repo.remotes['gitlab']
+			# `ls_remotes` is removed in pygit2 1.15
+			if hasattr(remote, 'list_heads'):
+				gl_heads = {head.name: str(head.oid) for head in remote.list_heads()}
+			else:
+				gl_heads = {head['name']: str(head['oid']) for head in remote.ls_remotes()}
+			pr_nums = sorted(pr_num for pr_num, sha in heads.items()
+			                 if gl_heads.get(f'refs/heads/pr-{pr_num}') != sha)
+			callback = RemotePushCallback(self.repo_path, self.repo_options.gl_repo_path)
+			if len(pr_nums) > 0:
+				self._sync_refs(repo, pr_nums, callback)
+		print(f'GH:{self.repo_path}: Backfill pushed {len(callback.pushed)} PRs to'
+		      + f' GL:{self.repo_options.gl_repo_path}, {len(heads) - len(pr_nums)} up to date.')
+		return {
+			'status': 'OK',
+			'pushed': [int(ref.rpartition('/pr-')[2]) for ref in callback.pushed],
+			'up_to_date': len(heads) - len(pr_nums),
+			'rejected': callback.rejected}
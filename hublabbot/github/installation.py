@@ -0,0 +1,189 @@
+"""Module for GitHub App authentication: JWT and cached installation tokens.
+
+Each App installation has its own rate limit budget, so calls of bot are spread over
+installations of all configured Apps, see `InstallationTokens.token`.
+"""
+from typing import Dict, List, Optional, Tuple
+import time
+from datetime import datetime, timezone
+from dataclasses import dataclass
+from threading import Lock
+
+from hublabbot.util import JsonDict
+from hublabbot.client import InstrumentedSession
+from hublabbot.metrics import INSTALLATION_TOKENS
+
+
+JWT_TTL = 540
+"""Lifetime of App JWT, in seconds (GitHub allows at most 10 minutes)."""
+JWT_CLOCK_DRIFT = 60
+"""JWT is issued in the past by this time, to allow clock drift, in seconds."""
+INSTALLATION_MISS_TTL = 300
+"""Lookup of installations missing some configured App is repeated after this time, in seconds."""
+
+
+@dataclass(frozen=True)
+class GithubApp:
+	"""Immutable record of GitHub App credentials.
+
+	Attributes:
+		app_id: ID of GitHub App.
+		private_key: Private key of GitHub App in PEM format.
+
+	"""
+
+	app_id: int
+	private_key: str
+
+
+Installation = Tuple[GithubApp, int]
+"""Type - App and ID of its installation."""
+
+
+def make_jwt(app: GithubApp, now: Optional[float] = None) -> str:
+	"""Make JWT signed by App's private key (RS256), it authorizes calls to `/app` endpoints.
+
+	Args:
+		app: `GithubApp`.
+		now: Time of issue, default is current time.
+
+	"""
+	import jwt  # type: ignore
+	if now is None:
+		now = time.time()
+	token: str = jwt.encode({
+		'iat': int(now) - JWT_CLOCK_DRIFT,
+		'exp': int(now) + JWT_TTL,
+		'iss': str(app.app_id)}, app.private_key, algorithm='RS256')
+	return token
+
+
+def parse_timestamp(value: str) -> float:
+	"""Parse GitHub timestamp like `'2016-07-11T22:14:10Z'` to POSIX time."""
+	return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+
+
+class InstallationTokens:
+	"""Installation tokens of GitHub Apps, minted on demand and cached until they almost expire.
+
+	Installations of Apps on repo are looked up once (again after `INSTALLATION_MISS_TTL`, if some
+	App isn't installed), then tokens of installations are used in turn, so calls are spread over
+	rate limits of all installations on repo.
+
+	Args:
+		apps: Configured GitHub Apps.
+		api_url: URL of GitHub API.
+		refresh_margin: Token is minted again this time before expiry, in seconds.
+
+	"""
+
+	def __init__(self, apps: List[GithubApp], api_url: str, refresh_margin: float = 300):
+		self.apps = apps
+		"""Configured GitHub Apps."""
+		self.api_url = api_url.rstrip('/')
+		"""URL of GitHub API."""
+		self.refresh_margin = refresh_margin
+		"""Token is minted again this time before expiry, in seconds."""
+		self._session = InstrumentedSession('github')
+		self._lock = Lock()
+		# installations by repo and time, when lookup expires (`inf` if all Apps are installed)
+		self._installations: Dict[str, Tuple[List[Installation], float]] = {}
+		self._turns: Dict[str, int] = {}
+		self._tokens: Dict[int, Tuple[str, float]] = {}
+		self._mint_locks: Dict[int, Lock] = {}
+
+	def _call(self, method: str, path: str, app: GithubApp) -> Optional[JsonDict]:
+		response = self._session.request(method, self.api_url + path, headers={
+			'Authorization': f'Bearer {make_jwt(app)}',
+			'Accept': 'application/vnd.github.v3+json'})
+		if response.status_code == 404:
+			return None
+		response.raise_for_status()
+		data: JsonDict = response.json()
+		return data
+
+	def _cached_installations(self, repo_path: str) -> Optional[List[Installation]]:
+		cached = self._installations.get(repo_path)
+		if cached is None or cached[1] <= time.time():
+			return None
+		return cached[0]
+
+	def installations(self, repo_path: str) -> List[Installation]:
+		"""Returns installations of configured Apps on repo, looked up on first call.
+
+		Lookup, which misses some App, expires after `INSTALLATION_MISS_TTL`.
+		"""
+		with self._lock:
+			installations = self._cached_installations(repo_path)
+		if installations is not None:
+			return installations
+		installations = []
+		for app in self.apps:
+			installation = self._call('GET', f'/repos/{repo_path}/installation', app)
+			if installation is not None:
+				installations.append((app, installation['id']))
+		expires = (float('inf') if len(installations) == len(self.apps)
+		           else time.time() + INSTALLATION_MISS_TTL)
+		with self._lock:
+			self._installations[repo_path] = (installations, expires)
+		return installations
+
+	def _fresh(self, installation_id: int) -> Optional[str]:
+		cached = self._tokens.get(installation_id)
+		if cached is not None and cached[1] - self.refresh_margin > time.time():
+			return cached[0]
+		return None
+
+	def cached_token(self, repo_path: str) -> Optional[str]:
+		"""Returns token for repo if next installation has fresh one, without calls to GitHub.
+
+		Returns:
+			Token or `None`, then call `token`.
+
+		"""
+		with self._lock:
+			installations = self._cached_installations(repo_path)
+			if not installations:
+				return None
+			turn = self._turns.get(repo_path, 0)
+			token = self._fresh(installations[turn % len(installations)][1])
+			if token is None:
+				return None
+			self._turns[repo_path] = turn + 1
+		INSTALLATION_TOKENS.inc('hit')
+		return token
+
+	def token(self, repo_path: str) -> Optional[str]:
+		"""Returns installation token for repo, minted if next installation has no fresh token.
+
+		Returns:
+			Token or `None`, if no configured App is installed on repo.
+
+		"""
+		installations = self.installations(repo_path)
+		if len(installations) == 0:
+			return None
+		with self._lock:
+			turn = self._turns.get(repo_path, 0)
+			self._turns[repo_path] = turn + 1
+			app, installation_id = installations[turn % len(installations)]
+			mint_lock = self._mint_locks.setdefault(installation_id, Lock())
+		# token of installation is minted once, concurrent callers wait for it
+		with mint_lock:
+			with self._lock:
+				fresh = self._fresh(installation_id)
+			if fresh is not None:
+				INSTALLATION_TOKENS.inc('hit')
+				return fresh
+			minted = self._call('POST', f'/app/installations/{installation_id}/access_tokens', app)
+			if minted is None:
+				# App is uninstalled, installations are looked up again by next call
+				with self._lock:
+					self._installations.pop(repo_path, None)
+				raise RuntimeError(f'GH:{repo_path}: Installation {installation_id} of App'
+				                   + f' {app.app_id} not found!')
+			INSTALLATION_TOKENS.inc('minted')
+			with self._lock:
+				self._tokens[installation_id] = (minted['token'], parse_timestamp(minted['expires_at']))
+			token: str = minted['token']
+			return token
@@ -1,12 +1,16 @@
 """Module for labels setup in GitHub repo."""
-import github  # type: ignore
-import github.Repository as ghr  # type: ignore
-from github import Github
+from __future__ import annotations
+from typing import TYPE_CHECKING
 
 from hublabbot.settings import RepoOptions
+from hublabbot.client import github_client
+
+if TYPE_CHECKING:
+	import github.Repository as ghr  # type: ignore
 
 
 def _has_in_labels(repo: ghr.Repository, lname: str) -> bool:
+	import github  # type: ignore
 	try:
 		repo.get_label(lname)
 		return True
@@ -19,11 +23,11 @@ def _create(repo: ghr.Repository, lname: str, lcolor: str, ldescription: str) ->
 	print(f'GH:{repo.full_name}: Label "{lname}" created.')
 
 
-def configure(token: str, repo_options: RepoOptions) -> None:
+def configure(token: str, api_url: str, repo_options: RepoOptions) -> None:
 	"""Configure labels in GitHub repo."""
 	if repo_options.gh_auto_merge_pr is None:
 		return
-	github = Github(token)
+	github = github_client(token, api_url)
 	repo = github.get_repo(repo_options.gh_repo_path, lazy=True)
 	if not _has_in_labels(repo, repo_options.gh_auto_merge_pr.required_label_name):
 		_create(repo, repo_options.gh_auto_merge_pr.required_label_name,
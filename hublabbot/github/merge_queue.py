@@ -0,0 +1,153 @@
+"""Module for merge queue of auto-merge.
+
+With `merge_queue` enabled in `hublabbot.settings.GithubAutoMergeOption`, ready PRs aren't
+merged on their own timers, but queued in order in the store and merged one by one by leader,
+see `hublabbot.github.github_webhook.GithubWebhook.process_merge_queue`.
+"""
+from typing import Callable, List, Optional
+import time
+from dataclasses import dataclass, asdict
+
+from hublabbot.util import JsonDict
+from hublabbot.store import StateStore
+from hublabbot.metrics import MERGE_QUEUE_RESULTS
+from hublabbot.scheduler import Scheduler, MERGE_QUEUE_JOB, JOB_GRACE_TTL
+
+
+MERGE_QUEUE_PREFIX = 'merge_queue:'
+"""Prefix of keys of queued PRs in the store."""
+RECHECK_DELAY = 5
+"""Delay of next check of queue head, whose mergeability GitHub still computes, in seconds."""
+UPDATE_TIMEOUT = 60 * 60
+"""Head updated with base branch is dropped, if its CI doesn't pass in this time, in seconds."""
+
+
+@dataclass(frozen=True)
+class QueuedPr:
+	"""Immutable record of PR in merge queue.
+
+	Attributes:
+		pr: Number of PR.
+		sha: Head sha of PR, whose status was success.
+		queued: Time PR was queued first, order of queue.
+		ready: Time, since PR can be merged (`delay` of auto-merge).
+		updated: Time PR was updated with base branch by bot, `None` if it wasn't.
+
+	"""
+
+	pr: int
+	sha: str
+	queued: float
+	ready: float
+	updated: Optional[float] = None
+
+
+class MergeQueue:
+	"""Merge queue of repo in `store`.
+
+	Args:
+		store: `hublabbot.store.StateStore`.
+		repo_path: Path like {namespace}/{repo name} in GitHub.
+
+	"""
+
+	def __init__(self, store: StateStore, repo_path: str):
+		self.store = store
+		"""`hublabbot.store.StateStore`."""
+		self.repo_path = repo_path
+		"""Path like {namespace}/{repo name} in GitHub."""
+
+	def _key(self, pr_number: int) -> str:
+		return f'{MERGE_QUEUE_PREFIX}{self.repo_path}#{pr_number}'
+
+	def entries(self) -> List[QueuedPr]:
+		"""Returns queued PRs in order."""
+		return sorted((QueuedPr(**entry) for entry in self.store.scan(
+			f'{MERGE_QUEUE_PREFIX}{self.repo_path}#').values()), key=lambda e: (e.queued, e.pr))
+
+	def push(self, pr_number: int, sha: str, delay: float) -> int:
+		"""Queue PR, queued PR keeps its place, and its ready time, if `sha` is same.
+
+		Args:
+			pr_number: Number of PR.
+			sha: Head sha of PR, whose status is success.
+			delay: PR can be merged after this time, in seconds.
+
+		Returns:
+			Place of PR in queue, from `1`.
+
+		"""
+		now = time.time()
+		queued: Optional[JsonDict] = self.store.get(self._key(pr_number))
+		if queued is not None and queued['sha'] == sha:
+			entry = QueuedPr(**queued)
+		else:
+			entry = QueuedPr(pr_number, sha, queued['queued'] if queued is not None else now, now + delay)
+		self.store.set(self._key(pr_number), asdict(entry), delay + UPDATE_TIMEOUT + JOB_GRACE_TTL)
+		return [e.pr for e in self.entries()].index(pr_number) + 1
+
+	def mark_updated(self, entry: QueuedPr) -> None:
+		"""Record that queued PR is updated with base branch, it waits for CI of new head."""
+		updated = QueuedPr(entry.pr, entry.sha, entry.queued, entry.ready, time.time())
+		self.store.set(self._key(entry.pr), asdict(updated), UPDATE_TIMEOUT + JOB_GRACE_TTL)
+
+	def remove(self, pr_number: int) -> None:
+		"""Remove PR from queue."""
+		self.store.delete(self._key(pr_number))
+
+
+def enqueue(scheduler: Scheduler, repo_path: str, pr_number: int, sha: str,
+            delay: float) -> JsonDict:
+	"""Queue PR to merge queue of repo and schedule processing of queue.
+
+	Args:
+		scheduler: `hublabbot.scheduler.Scheduler`, its store keeps queue.
+		repo_path: Path like {namespace}/{repo name} in GitHub.
+		pr_number: Number of PR.
+		sha: Head sha of PR, whose status is success.
+		delay: PR can be merged after this time, in seconds.
+
+	Returns:
+		`{'status': 'OK', 'note': ...}` with place of PR in queue.
+
+	"""
+	place = MergeQueue(scheduler.store, repo_path).push(pr_number, sha, delay)
+	# processing already scheduled isn't postponed
+	scheduler.schedule(MERGE_QUEUE_JOB, repo_path, {'repo': repo_path}, delay, replace=False)
+	return {'status': 'OK', 'note': f'PR#{pr_number} queued to merge, place in queue: {place}.'}
+
+
+def dequeue_failed(scheduler: Scheduler, repo_path: str, sha: str,
+                   find_pr: Callable[[], Optional[int]]) -> Optional[int]:
+	"""Remove PR, whose commit status failed, from merge queue of repo.
+
+	Head updated with base branch waits for CI of new head, so failed CI lets next PR become head.
+
+	Args:
+		scheduler: `hublabbot.scheduler.Scheduler`, its store keeps queue.
+		repo_path: Path like {namespace}/{repo name} in GitHub.
+		sha: Sha of commit with failed status.
+		find_pr: Returns number of PR with head `sha`, called only if queue isn't empty and
+			`sha` isn't queued sha.
+
+	Returns:
+		Number of removed PR, `None` if PR of `sha` isn't queued.
+
+	"""
+	queue = MergeQueue(scheduler.store, repo_path)
+	entries = queue.entries()
+	if len(entries) == 0:
+		return None
+	pr_number = next((entry.pr for entry in entries if entry.sha == sha), None)
+	if pr_number is None:
+		# updated head has new sha, queued sha is of head before update
+		pr_number = find_pr()
+		if pr_number not in [entry.pr for entry in entries]:
+			return None
+	assert pr_number is not None
+	queue.remove(pr_number)
+	MERGE_QUEUE_RESULTS.inc('dropped')
+	print(f'GH:{repo_path}: PR#{pr_number} dropped from merge queue - CI failed.')
+	if pr_number == entries[0].pr:
+		scheduler.schedule(MERGE_QUEUE_JOB, repo_path, {'repo': repo_path}, 0)
+	return pr_number
@@ -0,0 +1,51 @@
+"""Module for callbacks of git push, pygit2 is imported only with it."""
+from typing import Dict, List, Optional, Union
+import sys
+
+import pygit2
+
+
+def _decode(value: Union[bytes, str]) -> str:
+	# newer pygit2 passes `str`
+	return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class RemotePushCallback(pygit2.RemoteCallbacks):
+	"""Callback for remote push of one PR or of many PRs (`pr_num` is `None`)."""
+
+	def __init__(self, gh_repo_path: str, gl_repo_path: str, pr_num: Optional[int] = None):
+		self.gh_repo_path = gh_repo_path
+		"""Path like {namespace}/{repo name} in GitHub."""
+		self.gl_repo_path = gl_repo_path
+		"""Path like {namespace}/{repo name} in GitLab."""
+		self.pr_num = pr_num
+		"""Number of PR, `None` - it's taken from branch `pr-{number}`."""
+		self.bytes_pushed = 0
+		"""Bytes sent by push."""
+		self.pushed: List[str] = []
+		"""Accepted refs."""
+		self.rejected: Dict[str, str] = {}
+		"""Rejection messages by refs."""
+
+	def push_transfer_progress(self, objects_pushed: int, total_objects: int,
+	                           bytes_pushed: int) -> None:
+		"""Overrided callback for push progress, remembers sent bytes."""
+		self.bytes_pushed = bytes_pushed
+
+	def push_update_reference(self, refname: bytes, message: Optional[bytes]) -> None:
+		"""Overrided callback for remote push.
+
+		Args:
+			refname: The name of the reference (on the remote).
+			message: Rejection message from the remote. If None, the update was accepted.
+
+		"""
+		ref = _decode(refname)
+		pr_num = self.pr_num if self.pr_num is not None else ref.rpartition('/pr-')[2]
+		if message is None:
+			self.pushed.append(ref)
+			print(f'GH:{self.gh_repo_path}: PR#{pr_num} ({ref}) synced to GL:{self.gl_repo_path}.')
+		else:
+			self.rejected[ref] = _decode(message)
+			print(f'GH:{self.gh_repo_path}: Fail sync PR#{pr_num} ({ref})'
+			      + f' to GL:{self.gl_repo_path} - "{self.rejected[ref]}"!', file=sys.stderr)
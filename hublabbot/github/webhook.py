@@ -1,14 +1,16 @@
 """Module for webhooks setup in GitHub repo."""
-from typing import List, Optional
+from __future__ import annotations
+from typing import TYPE_CHECKING, List, Optional
 from urllib.parse import urljoin
 
-import github.Repository as ghr  # type: ignore
-import github.PaginatedList as ghp  # type: ignore
-import github.Hook as ghh  # type: ignore
-from github import Github
-
 from hublabbot.const import GITHUB_ENDPOINT
 from hublabbot.settings import RepoOptions
+from hublabbot.client import github_client
+
+if TYPE_CHECKING:
+	import github.Repository as ghr  # type: ignore
+	import github.PaginatedList as ghp  # type: ignore
+	import github.Hook as ghh  # type: ignore
 
 
 def _find(hooks: ghp.PaginatedList, hook_url: str) -> Optional[ghh.Hook]:
@@ -43,17 +45,20 @@ def _delete(hook: ghh.Hook, repo_path: str) -> None:
 	print(f'GH:{repo_path}: Hook deleted.')
 
 
-def configure(token: str, secret: str, base_url: str, repo_options: RepoOptions) -> None:
+def configure(token: str, api_url: str, secret: str, base_url: str,
+              repo_options: RepoOptions) -> None:
 	"""Configure webhooks in GitHub repo."""
 	events: List[str] = []
 	if repo_options.gh_auto_merge_pr is not None or repo_options.gh_show_gitlab_ci_fail is not None:
 		events.append('status')
 	if repo_options.gl_auto_delete_branches:
 		events.append('delete')
-	if repo_options.gh_gitlab_ci_for_external_pr:
+	# PRs of status events are resolved from recorded pull_request events
+	if (repo_options.gh_gitlab_ci_for_external_pr or repo_options.gh_auto_merge_pr is not None
+	    or repo_options.gh_show_gitlab_ci_fail is not None or repo_options.gl_auto_cancel_pipelines):
 		events.append('pull_request')
 	hook_url = urljoin(base_url, GITHUB_ENDPOINT)
-	github = Github(token)
+	github = github_client(token, api_url)
 	repo = github.get_repo(repo_options.gh_repo_path, lazy=True)
 	hook = _find(repo.get_hooks(), hook_url)
 	if len(events) > 0:
@@ -1,20 +1,109 @@
 """Module for GitLab webhook functionality."""
-from typing import Optional
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
 import re
+import time
+import traceback
+from fnmatch import fnmatch
 from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 
-from gitlab import Gitlab, GitlabDeleteError  # type: ignore
-import gitlab.v4.objects as gl_types  # type: ignore
 from pyramid.interfaces import IResponse  # type: ignore
 
 from hublabbot.util import filter_out_ansi_escape
 from hublabbot.settings import HubLabBotSettings
+from hublabbot.client import gitlab_client
+from hublabbot.github.github_webhook import GithubWebhook
+from hublabbot.correlation import CorrelationCache
+from hublabbot.outbox import Outbox, CANCEL_ACTION, DELETE_BRANCH_ACTION, perform
+from hublabbot.store import StateStore
+from hublabbot.scheduler import Scheduler, BRANCH_DELETE_JOB, JOB_GRACE_TTL
+from hublabbot.metrics import (JANITOR_CANCELS, JANITOR_MINUTES_SAVED, BRANCH_DELETES, CI_LOG_BYTES,
+                               EARLY_CANCELS)
+from hublabbot.ci_timings import CiTimings, slowest_sections
+from hublabbot.profiling import profiled
+
+if TYPE_CHECKING:
+	import gitlab.v4.objects as gl_types  # type: ignore
+
+
+PR_BRANCH = re.compile(r'pr-\d+')
+"""Branches of external PRs, pushed by `hublabbot.github.github_webhook.GithubWebhook`."""
+QUEUED_BRANCH_PREFIX = 'branch_delete:'
+"""Prefix of keys of queued branches in the store, see `GitlabWebhook.queue_branch_delete`."""
+BRANCH_LIST_MIN = 20
+"""Batch of deleted branches is checked against branch list from this size."""
+CANCEL_CONCURRENCY = 8
+"""Maximum count of concurrent cancels of pipelines superseded by new head of PR."""
+SECTION_MARKER = re.compile(rb'section_(start|end):(\d+):([\w.-]+)')
+"""Marker of start or end of section in GitLab CI log, section name is without options."""
+
+
+def parse_time(value: str) -> float:
+	"""Parse GitLab timestamp like `'2016-08-11T11:28:34.085Z'` to POSIX time."""
+	return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def parse_gitlabci_log(raw_log: bytes, max_lines: int) -> str:
+	"""Parse GitLab CI log.
+
+	Args:
+		raw_log: Log from GitLab CI job.
+		max_lines: Maximum count of lines in tail.
+
+	Returns:
+		Parsed and truncated log's tail.
+
+	"""
+	log = raw_log.decode('utf-8')
+	log = filter_out_ansi_escape(log)
+	log_lines = re.split('\n|\r', log)
+	if log_lines[-1] == '':
+		del log_lines[-1]
+	for linum in range(len(log_lines)):
+		if log_lines[linum].startswith('section_start:'):
+			parts = log_lines[linum].split(':')
+			start_time = datetime.fromtimestamp(int(parts[1]), timezone.utc)
+			log_lines[linum] = f'Start {parts[2]}'
+		elif log_lines[linum].startswith('section_end:'):
+			parts = log_lines[linum].split(':')
+			end_time = datetime.fromtimestamp(int(parts[1]), timezone.utc)
+			time_delta = end_time - start_time
+			time = datetime.fromtimestamp(time_delta.total_seconds(), timezone.utc)
+			log_lines[linum] = f'End of {parts[2]}, time - {time:%M:%S}'
+	log_lines = log_lines[-max_lines:]
+	log = '\n'.join(log_lines)
+	return log
+
+
+def parse_gitlabci_sections(raw_log: bytes) -> List[Tuple[str, float]]:
+	"""Parse durations of sections of GitLab CI log from `section_start`/`section_end` markers.
+
+	Args:
+		raw_log: Log from GitLab CI job.
+
+	Returns:
+		Name and duration in seconds of every closed section, in order of their ends.
+
+	"""
+	starts: Dict[bytes, int] = {}
+	sections = []
+	for match in SECTION_MARKER.finditer(raw_log):
+		kind, timestamp, name = match.groups()
+		if kind == b'start':
+			starts[name] = int(timestamp)
+			continue
+		start = starts.pop(name, None)
+		if start is not None:
+			sections.append((name.decode(), float(int(timestamp) - start)))
+	return sections
 
 
 class GitlabWebhook:
 	"""Main class with GitLab functionality."""
 
-	def __init__(self, settings: HubLabBotSettings, repo_path: str):
+	def __init__(self, settings: HubLabBotSettings, repo_path: str,
+	             correlation: Optional[CorrelationCache] = None, outbox: Optional[Outbox] = None):
 		self.settings = settings
 		"""`hublabbot.settings.HubLabBotSettings`."""
 		self.repo_path = repo_path
@@ -26,8 +115,12 @@ class GitlabWebhook:
 			pass
 		self.repo_options = repo_options
 		"""`hublabbot.settings.RepoOptions`."""
-		self.gitlab = Gitlab(self.settings.gl_base_url, private_token=self.settings.gl_token)
+		self.gitlab = gitlab_client(self.settings.gl_base_url, self.settings.gl_token)
 		"""Gitlab object with your credentials."""
+		self.correlation = correlation
+		"""`hublabbot.correlation.CorrelationCache`, `None` - lookups by API only."""
+		self.outbox = outbox
+		"""`hublabbot.outbox.Outbox` of cancels and deletes, `None` - perform directly."""
 
 	def parse_gitlabci_log(self, raw_log: bytes) -> str:
 		"""Parse GitLab CI log.
@@ -41,25 +134,34 @@ class GitlabWebhook:
 		"""
 		assert self.repo_options is not None
 		assert self.repo_options.gh_show_gitlab_ci_fail is not None
-		log = raw_log.decode('utf-8')
-		log = filter_out_ansi_escape(log)
-		log_lines = re.split('\n|\r', log)
-		if log_lines[-1] == '':
-			del log_lines[-1]
-		for linum in range(len(log_lines)):
-			if log_lines[linum].startswith('section_start:'):
-				parts = log_lines[linum].split(':')
-				start_time = datetime.fromtimestamp(int(parts[1]), timezone.utc)
-				log_lines[linum] = f'Start {parts[2]}'
-			elif log_lines[linum].startswith('section_end:'):
-				parts = log_lines[linum].split(':')
-				end_time = datetime.fromtimestamp(int(parts[1]), timezone.utc)
-				time_delta = end_time - start_time
-				time = datetime.fromtimestamp(time_delta.total_seconds(), timezone.utc)
-				log_lines[linum] = f'End of {parts[2]}, time - {time:%M:%S}'
-		log_lines = log_lines[-self.repo_options.gh_show_gitlab_ci_fail.max_lines:]
-		log = '\n'.join(log_lines)
-		return log
+		return parse_gitlabci_log(raw_log, self.repo_options.gh_show_gitlab_ci_fail.max_lines)
+
+	def read_failed_job_log(self, job: gl_types.ProjectJob, job_name: str, ci_timings: CiTimings
+	) -> Tuple[str, List[Tuple[str, float]]]:
+		"""Fetch log of failed job for fail-report, record timings of its sections.
+
+		Args:
+			job: `ProjectJob` object, can be lazy.
+			job_name: Name of job.
+			ci_timings: `hublabbot.ci_timings.CiTimings`.
+
+		Returns:
+			Parsed and truncated log's tail and slowest sections of job.
+
+		"""
+		assert self.repo_options is not None
+		assert self.repo_options.gh_show_gitlab_ci_fail is not None
+		raw_log = job.trace()
+		CI_LOG_BYTES.inc(amount=len(raw_log))
+		sections = parse_gitlabci_sections(raw_log)
+		ci_timings.record(self.repo_path, job_name, sections)
+		return (self.parse_gitlabci_log(raw_log),
+		        slowest_sections(sections, self.repo_options.gh_show_gitlab_ci_fail.slowest_sections))
+
+	def get_job(self, job_id: int) -> gl_types.ProjectJob:
+		"""Get lazy job object by `job_id`, it's enough to fetch its log."""
+		project = self.gitlab.projects.get(self.repo_path, lazy=True)
+		return project.jobs.get(job_id, lazy=True)
 
 	def get_pipeline_by_url(self, target_url: str) -> gl_types.ProjectPipeline:
 		"""Get pipeline object from URL to pipeline.
@@ -94,17 +196,39 @@ class GitlabWebhook:
 		failed_job = project.jobs.get(pipeline_jobs[0].id)
 		return failed_job
 
+	def get_recorded_failed_job(self, target_url: str) -> Optional[gl_types.ProjectJob]:
+		"""Get failed job of pipeline by URL, if failed jobs were recorded from Pipeline Hook.
+
+		Args:
+			target_url: URL to pipeline.
+
+		Returns:
+			`ProjectJob` object or `None` if pipeline or its failed jobs weren't recorded.
+
+		"""
+		if self.correlation is None:
+			return None
+		pipeline = self.correlation.pipeline(self.repo_path, int(target_url.split('/')[-1]))
+		if pipeline is None or len(pipeline.failed_job_ids) == 0:
+			return None
+		project = self.gitlab.projects.get(self.repo_path, lazy=True)
+		return project.jobs.get(pipeline.failed_job_ids[0])
+
 	def cancel_pipeline(self, pipeline_id: int) -> None:
-		"""Cancel one pipeline.
+		"""Outbox action - cancel one pipeline, cancel of finished pipeline does nothing.
 
 		Args:
 			pipeline_id: ID of pipeline.
 
 		"""
 		project = self.gitlab.projects.get(self.repo_path, lazy=True)
-		pipeline = project.pipelines.get(pipeline_id)
-		pipeline.cancel()
-		print(f'GL:{self.repo_path}: Pipeline #{pipeline.id} canceled.')
+		project.pipelines.get(pipeline_id, lazy=True).cancel()
+		print(f'GL:{self.repo_path}: Pipeline #{pipeline_id} canceled.')
+
+	def _submit_cancel(self, pipeline_id: int) -> IResponse:
+		return perform(self.outbox, CANCEL_ACTION, f'{self.repo_path}:{pipeline_id}',
+		               {'repo': self.repo_path, 'pipeline': pipeline_id},
+		               lambda: self.cancel_pipeline(pipeline_id))
 
 	def cancel_old_pipelines(self, pipeline_id: int, pipeline_ref: str) -> IResponse:
 		"""Action - auto-cancel old pipelines.
@@ -132,15 +256,20 @@ class GitlabWebhook:
 		for pipeline in pipelines:
 			if pipeline.id == pipeline_id:
 				continue
-			pipeline.cancel()
-			print(f'GL:{self.repo_path}: Pipeline #{pipeline.id} canceled.')
+			self._submit_cancel(pipeline.id)
 		return {'status': 'OK'}
 
-	def delete_branch(self, branch: str) -> IResponse:
-		"""Delete branch on GitLab.
+	def auto_cancel_pipelines(self, pipeline_id: int, pipeline_ref: str,
+	                          pipeline_source: str) -> IResponse:
+		"""Action - cancel pipelines superseded by `pipeline_id`.
+
+		If branch has PR in GitHub, pipeline of PR is kept (`pipeline_id` itself if triggered by PR),
+		else latest pipeline is kept.
 
 		Args:
-			branch: Branch name.
+			pipeline_id: ID of running or pending pipeline.
+			pipeline_ref: Branch name.
+			pipeline_source: Source of pipeline, like `'push'` or `'external_pull_request_event'`.
 
 		Returns:
 			`{'status': 'OK', ...}` if action was successful,</br>
@@ -148,18 +277,254 @@ class GitlabWebhook:
 			`{'status': 'ERROR', ...}` if action failed.
 
 		"""
+		assert self.repo_options is not None
+		gh_repo_path = self.repo_options.gh_repo_path
+		github_wh = GithubWebhook(self.settings, gh_repo_path, is_admin=True,
+		                          correlation=self.correlation)
+		if not github_wh.has_open_pr(pipeline_ref):
+			return self.cancel_old_pipelines(0, pipeline_ref)
+		if pipeline_source == 'external_pull_request_event':
+			return self.cancel_old_pipelines(pipeline_id, pipeline_ref)
+		self._submit_cancel(pipeline_id)
+		return {'status': 'IGNORE'}
+
+	@profiled
+	def cancel_superseded_pipelines(self, ref: str, head_sha: str) -> int:
+		"""Action - cancel running and pending pipelines of `ref` for shas other than `head_sha`.
+
+		Called on new head of PR, before GitLab starts pipeline of it. Pipelines of protected
+		branches and manually launched ones aren't touched, like by Pipeline Hook.
+
+		Args:
+			ref: Branch name in GitLab.
+			head_sha: New head sha of branch, its pipelines are kept.
+
+		Returns:
+			Count of canceled pipelines.
+
+		"""
+		from gitlab import GitlabGetError  # type: ignore
+		project = self.gitlab.projects.get(self.repo_path, lazy=True)
+		try:
+			if project.branches.get(ref).protected:
+				return 0
+		except GitlabGetError as err:
+			if err.response_code == 404:
+				return 0
+			raise
+		superseded = [pipeline for status in ('running', 'pending')
+		              for pipeline in project.pipelines.list(ref=ref, status=status, iterator=True)
+		              if pipeline.sha != head_sha and pipeline.source != 'web']
+		if len(superseded) == 0:
+			return 0
+		with ThreadPoolExecutor(max_workers=min(len(superseded), CANCEL_CONCURRENCY)) as executor:
+			canceled = sum(executor.map(lambda p: self._cancel_superseded(p.id), superseded))
+		EARLY_CANCELS.inc(amount=canceled)
+		print(f'GL:{self.repo_path}: {canceled} pipelines of ref {ref} superseded by {head_sha[:8]}'
+		      + ' canceled.')
+		return canceled
+
+	def _branch_exists(self, project: gl_types.Project, branch: str) -> bool:
+		from gitlab import GitlabGetError  # type: ignore
+		try:
+			project.branches.get(branch)
+		except GitlabGetError as err:
+			if err.response_code == 404:
+				return False
+			raise
+		return True
+
+	def _typical_duration(self, project: gl_types.Project) -> float:
+		# median duration of recent successful pipelines, in seconds
+		durations = sorted(parse_time(pipeline.updated_at) - parse_time(pipeline.created_at)
+		                   for pipeline in project.pipelines.list(status='success', scope='branches',
+		                                                          per_page=20, get_all=False))
+		return durations[len(durations) // 2] if durations else 0.0
+
+	def _cancel_superseded(self, pipeline_id: int) -> bool:
+		try:
+			self._submit_cancel(pipeline_id)
+		except Exception:
+			traceback.print_exc()
+			return False
+		return True
+
+	@profiled
+	def sweep_pipelines(self) -> IResponse:
+		"""Action - cancel superseded pipelines on all refs of project (pipeline janitor).
+
+		Running and pending pipelines are listed in one paginated pass per status and grouped
+		by ref. Newest pipeline of ref is kept (newest PR pipeline, if ref has any), others are
+		canceled concurrently, pipelines of deleted `pr-N` branches are all canceled.
+		Pipelines of protected branches and tags and manually launched ones aren't touched,
+		like by Pipeline Hook.
+
+		Returns:
+			`{'status': 'OK', 'canceled': ..., 'refs': ..., 'minutes_saved': ...}`, where
+			`minutes_saved` is estimate by median duration of recent successful pipelines.
+
+		"""
+		assert self.repo_options is not None and self.repo_options.gl_pipeline_janitor is not None
+		options = self.repo_options.gl_pipeline_janitor
+		project = self.gitlab.projects.get(self.repo_path, lazy=True)
+		protected = [branch.name for branch in project.protectedbranches.list(iterator=True)]
+		by_ref: Dict[str, List[Any]] = {}
+		for status in ('running', 'pending'):
+			for pipeline in project.pipelines.list(status=status, scope='branches', iterator=True,
+			                                       per_page=100):
+				if pipeline.source == 'web' or any(fnmatch(pipeline.ref, name) for name in protected):
+					continue
+				by_ref.setdefault(pipeline.ref, []).append(pipeline)
+		superseded = []
+		for ref, pipelines in by_ref.items():
+			if PR_BRANCH.fullmatch(ref) is not None and not self._branch_exists(project, ref):
+				superseded += pipelines
+				continue
+			pr_pipelines = [p for p in pipelines if p.source == 'external_pull_request_event']
+			kept = max(pr_pipelines or pipelines, key=lambda p: p.id)
+			superseded += [p for p in pipelines if p.id != kept.id]
+		if len(superseded) == 0:
+			return {'status': 'OK', 'canceled': 0, 'refs': len(by_ref), 'minutes_saved': 0}
+		typical_duration = self._typical_duration(project)
+		with ThreadPoolExecutor(max_workers=options.max_concurrency) as executor:
+			results = list(executor.map(lambda p: self._cancel_superseded(p.id), superseded))
+		now = time.time()
+		canceled = [p for p, ok in zip(superseded, results) if ok]
+		minutes_saved = sum(max(typical_duration - (now - parse_time(p.created_at)), 0)
+		                    for p in canceled) / 60
+		JANITOR_CANCELS.inc(amount=len(canceled))
+		JANITOR_MINUTES_SAVED.inc(amount=minutes_saved)
+		print(f'GL:{self.repo_path}: Janitor canceled {len(canceled)} superseded pipelines'
+		      + f' on {len(by_ref)} refs, ~{minutes_saved:.0f} pipeline minutes saved.')
+		return {'status': 'OK', 'canceled': len(canceled), 'refs': len(by_ref),
+		        'minutes_saved': round(minutes_saved, 1)}
+
+	def remove_branch(self, branch: str) -> bool:
+		"""Outbox action - delete branch on GitLab, missing branch is skipped.
+
+		Args:
+			branch: Branch name.
+
+		Returns:
+			`True` if branch was deleted, `False` if it was not found.
+
+		"""
+		from gitlab import GitlabDeleteError  # type: ignore
 		project = self.gitlab.projects.get(self.repo_path, lazy=True)
 		try:
 			project.branches.delete(branch)
 		except GitlabDeleteError as err:
 			if err.args[0] == '404 Branch Not Found':
-				return {
-					'status': 'IGNORE',
-					'note': err.args[0]}
-			else:
-				raise
-		print(f'GH:{self.repo_path}: Branch {branch} deleted.')
-		return {'status': 'OK'}
+				print(f'GL:{self.repo_path}: Branch {branch} not found.')
+				return False
+			raise
+		print(f'GL:{self.repo_path}: Branch {branch} deleted.')
+		return True
+
+	def delete_branch(self, branch: str) -> IResponse:
+		"""Action - delete branch on GitLab.
+
+		Args:
+			branch: Branch name.
+
+		Returns:
+			`{'status': 'OK', ...}` if action was successful or is pending for retry,</br>
+			`{'status': 'IGNORE', ...}` if branch was not found,</br>
+			`{'status': 'ERROR', ...}` if action failed.
+
+		"""
+		removed: List[bool] = []
+		result = perform(self.outbox, DELETE_BRANCH_ACTION, f'{self.repo_path}:{branch}',
+		                 {'repo': self.repo_path, 'branch': branch},
+		                 lambda: removed.append(self.remove_branch(branch)))
+		if removed == [False]:
+			return {'status': 'IGNORE', 'note': '404 Branch Not Found'}
+		return result
+
+	def queue_branch_delete(self, branch: str, scheduler: Scheduler, window: float) -> IResponse:
+		"""Action - queue deletion of branch on GitLab, branches queued in `window` are deleted by batch.
+
+		Args:
+			branch: Branch name.
+			scheduler: `hublabbot.scheduler.Scheduler`, its store keeps queued branches.
+			window: Batch is deleted this time after first queued branch, in seconds.
+
+		Returns:
+			`{'status': 'OK', ...}`.
+
+		"""
+		# branch is stored before job, so job claimed meanwhile is scheduled again for it
+		scheduler.store.set(f'{QUEUED_BRANCH_PREFIX}{self.repo_path}:{branch}', True,
+		                    window + JOB_GRACE_TTL)
+		scheduler.schedule(BRANCH_DELETE_JOB, self.repo_path, {'repo': self.repo_path}, window,
+		                   replace=False)
+		return {'status': 'OK', 'note': f'Deletion of branch {branch} queued.'}
+
+	def delete_queued_branches(self, store: StateStore) -> IResponse:
+		"""Action - delete branches queued by `queue_branch_delete`, see `delete_branches`.
+
+		Args:
+			store: `hublabbot.store.StateStore` of queued branches.
+
+		Returns:
+			`{'status': 'OK', ...}` if action was successful,</br>
+			`{'status': 'IGNORE', ...}` if no branch queued.
+
+		"""
+		prefix = f'{QUEUED_BRANCH_PREFIX}{self.repo_path}:'
+		branches = [key[len(prefix):] for key in store.scan(prefix) if store.delete(key)]
+		if len(branches) == 0:
+			return {'status': 'IGNORE'}
+		return self.delete_branches(branches)
+
+	def _missing_branches(self, project: gl_types.Project, branches: Set[str]) -> Set[str]:
+		existing = {branch.name for branch in project.branches.list(iterator=True, per_page=100)}
+		return branches - existing
+
+	def _delete_branch_of_batch(self, branch: str) -> str:
+		try:
+			response = self.delete_branch(branch)
+		except Exception:
+			traceback.print_exc()
+			return 'failed'
+		if response['status'] == 'IGNORE':
+			return 'missing'
+		return 'pending' if 'note' in response else 'deleted'
+
+	@profiled
+	def delete_branches(self, branches: List[str]) -> IResponse:
+		"""Action - delete batch of branches on GitLab.
+
+		Batch of `BRANCH_LIST_MIN` branches or more is checked against branch list and missing
+		branches are skipped. Other branches are deleted one by one, concurrently through outbox,
+		at most `settings.branch_delete_concurrency` at once.
+
+		Args:
+			branches: Branch names.
+
+		Returns:
+			`{'status': 'OK', 'deleted': ..., 'missing': ..., 'pending': ..., 'failed': ...}` -
+			counts of branches by result.
+
+		"""
+		project = self.gitlab.projects.get(self.repo_path, lazy=True)
+		queued = set(branches)
+		total = len(queued)
+		counts = {'deleted': 0, 'missing': 0, 'pending': 0, 'failed': 0}
+		if len(queued) >= BRANCH_LIST_MIN:
+			missing = self._missing_branches(project, queued)
+			counts['missing'] = len(missing)
+			queued -= missing
+		with ThreadPoolExecutor(max_workers=self.settings.branch_delete_concurrency) as executor:
+			for result in executor.map(self._delete_branch_of_batch, sorted(queued)):
+				counts[result] += 1
+		for result, count in counts.items():
+			if count > 0:
+				BRANCH_DELETES.inc(result, amount=count)
+		print(f'GL:{self.repo_path}: Batch of {total} branches: {counts["deleted"]} deleted,'
+		      + f' {counts["missing"]} not found,'
+		      + f' {counts["pending"]} pending for retry, {counts["failed"]} failed.')
+		return {'status': 'OK', **counts}
 
 	def button_api_delete_pipeline(self, pipeline_id: int) -> IResponse:
 		"""API - delete pipeline.
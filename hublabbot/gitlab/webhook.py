@@ -1,13 +1,15 @@
 """Module for webhooks setup in GitLab repo."""
-from typing import List, Dict, Optional
+from __future__ import annotations
+from typing import TYPE_CHECKING, List, Dict, Optional
 from urllib.parse import urljoin
 
-from gitlab import Gitlab  # type: ignore
-import gitlab.v4.objects as gl_types  # type: ignore
-
 from hublabbot.const import GITLAB_ENDPOINT
 from hublabbot.util import JsonDict
 from hublabbot.settings import RepoOptions
+from hublabbot.client import gitlab_client
+
+if TYPE_CHECKING:
+	import gitlab.v4.objects as gl_types  # type: ignore
 
 
 def _find(hooks: List[gl_types.ProjectHook], url: str) -> Optional[gl_types.ProjectHook]:
@@ -43,6 +45,7 @@ def _delete(hook: gl_types.ProjectHook, repo_path: str) -> None:
 def configure(gl_base_url: str, token: str, secret: str, bot_base_url: str,
               repo_options: RepoOptions) -> None:
 	"""Configure webhooks in GitLab repo."""
+	show_gitlab_ci_fail = repo_options.gh_show_gitlab_ci_fail
 	events = {
 		'push_events': False,
 		'issues_events': False,
@@ -50,12 +53,15 @@ def configure(gl_base_url: str, token: str, secret: str, bot_base_url: str,
 		'merge_requests_events': False,
 		'tag_push_events': False,
 		'note_events': False,
-		'job_events': False,
-		'pipeline_events': repo_options.gl_auto_cancel_pipelines,
+		# fail-report is posted as soon as job fails
+		'job_events': show_gitlab_ci_fail is not None and show_gitlab_ci_fail.job_events,
+		# failed jobs of status events are resolved from recorded Pipeline Hooks
+		'pipeline_events': (repo_options.gl_auto_cancel_pipelines
+		                    or show_gitlab_ci_fail is not None),
 		'wiki_page_events': False
 	}
 	hook_url = urljoin(bot_base_url, GITLAB_ENDPOINT)
-	gitlab = Gitlab(gl_base_url, private_token=token)
+	gitlab = gitlab_client(gl_base_url, token)
 	project = gitlab.projects.get(repo_options.gl_repo_path)
 	hooks = project.hooks.list()
 	hook = _find(hooks, hook_url)
@@ -0,0 +1,102 @@
+"""Module for journal of webhook traffic, see `hublabbot.replay`."""
+from typing import Iterator, Mapping
+import re
+import gzip
+import json
+import time
+import base64
+from threading import Lock
+
+from hublabbot.util import JsonDict
+from hublabbot.client import OutboundCall
+
+
+_SKIPPED_RESPONSE_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding',
+                             'connection', 'set-cookie')
+SECRET_HEADERS = ('authorization', 'x-gitlab-token', 'x-hub-signature', 'x-hub-signature-256')
+"""Headers of deliveries with secrets, they are not recorded."""
+SECRET_RESPONSE_URL = re.compile(r'/app/installations/\d+/access_tokens$')
+"""URL of responses with tokens, their bodies are not recorded."""
+
+
+class Journal:
+	"""Append-only gzip-compressed journal of JSON records, one per line.
+
+	Records:
+		`{'kind': 'delivery', 'time': ..., 'source': ..., 'headers': {...}, 'body': ...}` -
+		verified incoming delivery, without `SECRET_HEADERS`.</br>
+		`{'kind': 'response', 'time': ..., 'backend': ..., 'method': ..., 'url': ..., 'status': ...,
+		'duration': ..., 'headers': {...}, 'body': ..., 'redacted': ...}` - outbound GitHub/GitLab
+		response, body of `SECRET_RESPONSE_URL` is empty and `redacted` is `true`.</br>
+		Bodies encoded in Base64.
+
+	"""
+
+	def __init__(self, path: str):
+		self.path = path
+		"""Path to journal file."""
+		self._lock = Lock()
+		self._file = gzip.open(path, 'ab')
+
+	def _write(self, record: JsonDict) -> None:
+		line = json.dumps(record, separators=(',', ':')).encode() + b'\n'
+		with self._lock:
+			if self._file.closed:
+				return
+			self._file.write(line)
+			# flush compressor, so journal can be read while it is written
+			self._file.flush()
+
+	def record_delivery(self, source: str, headers: Mapping[str, str], body: bytes) -> None:
+		"""Record incoming delivery.
+
+		Args:
+			source: `'github'` or `'gitlab'`.
+			headers: Request headers.
+			body: Raw request body.
+
+		"""
+		self._write({
+			'kind': 'delivery',
+			'time': time.time(),
+			'source': source,
+			'headers': {name: value for name, value in headers.items()
+			            if name.lower() not in SECRET_HEADERS},
+			'body': base64.b64encode(body).decode()})
+
+	def record_response(self, call: OutboundCall) -> None:
+		"""Record outbound response, it is `hublabbot.client.Observer`."""
+		response = call.response
+		redacted = SECRET_RESPONSE_URL.search(call.url.split('?', 1)[0]) is not None
+		self._write({
+			'kind': 'response',
+			'time': time.time(),
+			'backend': call.backend,
+			'method': call.method,
+			'url': call.url,
+			'status': call.status,
+			'duration': call.duration,
+			'headers': {} if response is None else {
+				name: value for name, value in response.headers.items()
+				if name.lower() not in _SKIPPED_RESPONSE_HEADERS},
+			'body': '' if response is None or redacted else base64.b64encode(response.content).decode(),
+			'redacted': redacted})
+
+	def close(self) -> None:
+		"""Close journal file."""
+		with self._lock:
+			self._file.close()
+
+
+def read_journal(path: str) -> Iterator[JsonDict]:
+	"""Read records from journal, see `Journal`.
+
+	Truncated tail of journal (e.g. after crash) is ignored.
+	"""
+	with gzip.open(path, 'rb') as f:
+		try:
+			for line in f:
+				if line.endswith(b'\n'):
+					yield json.loads(line)
+		except (EOFError, OSError):
+			return
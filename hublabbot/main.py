@@ -1,46 +1,120 @@
 """Module for entry point of HubLabBot."""
-from typing import List
+from typing import List, Optional
 import sys
-import atexit
+import signal
+import argparse
 from pathlib import PurePath
-from threading import Timer
-from wsgiref.simple_server import make_server
-
-import pkg_resources
-from pyramid.config import Configurator  # type: ignore
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, make_server
 
 from hublabbot.settings import HubLabBotSettings
+from hublabbot.app import get_assets_path, make_app, make_scheduler
+from hublabbot.scheduler import RECONCILE_JOB
+from hublabbot.profiling import ProfilingMiddleware
+from hublabbot.github.github_webhook import GithubWebhook
+import hublabbot.profiling as profiling
 import hublabbot.github.webhook as gh_webhook
 import hublabbot.github.label as gh_label
 import hublabbot.github.collaborator as gh_collaborator
 import hublabbot.gitlab.webhook as gl_webhook
 
 
+SIGNAL_PROFILE_REQUESTS = 100
+"""Count of requests profiled after `SIGUSR2`."""
+SIGNAL_PROFILE_SECONDS = 60
+"""Duration of profiling session started by `SIGUSR2`, in seconds."""
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+	"""WSGI server with thread per request.
+
+	Delivery waiting for slot of `hublabbot.fairness.FairQueue` blocks only its own thread.
+	"""
+
+	daemon_threads = True
+
+
+@profiling.profiled
 def _configure_repos(settings: HubLabBotSettings) -> None:
 	for repo_options in settings.repos:
-		gh_webhook.configure(settings.gh_token, settings.gh_secret, settings.base_url, repo_options)
-		gh_label.configure(settings.gh_token, repo_options)
-		gh_collaborator.configure(settings.gh_token, settings.gh_bot_token, repo_options)
+		gh_webhook.configure(settings.gh_token, settings.gh_api_url, settings.gh_secret,
+		                     settings.base_url, repo_options)
+		gh_label.configure(settings.gh_token, settings.gh_api_url, repo_options)
+		gh_collaborator.configure(settings.gh_token, settings.gh_bot_token, settings.gh_api_url,
+		                          repo_options)
 		gl_webhook.configure(settings.gl_base_url, settings.gl_token, settings.gl_secret,
 		                     settings.base_url, repo_options)
 
 
-def main(args: List[str] = []) -> None:
-	"""Entry point of HubLabBot."""
+def _toggle_profiling(settings: HubLabBotSettings) -> None:
+	if profiling.current_session() is not None:
+		profiling.stop()
+	else:
+		profiling.start('cprofile', SIGNAL_PROFILE_REQUESTS, SIGNAL_PROFILE_SECONDS, settings.profile_dir)
+
+
+def start(settings: HubLabBotSettings) -> ProfilingMiddleware:
+	"""Make app with scheduler and schedule configuration of repos.
+
+	Args:
+		settings: `hublabbot.settings.HubLabBotSettings`.
+
+	Returns:
+		WSGI app, see `hublabbot.app.make_app`.
+
+	"""
+	scheduler = make_scheduler(settings)
+	scheduler.register(RECONCILE_JOB, lambda job: _configure_repos(settings))
+	app = make_app(settings, scheduler)
+	# Configure webhooks after server started, only by leader replica
+	scheduler.schedule(RECONCILE_JOB, 'startup', {}, 1, replace=False)
+	return app
+
+
+def _backfill(args: List[str]) -> None:
+	parser = argparse.ArgumentParser(prog='hublabbot backfill',
+	                                 description='Push open external PRs to GitLab.')
+	parser.add_argument('settings_path', nargs='?', default='hublabbot.json')
+	parser.add_argument('--repo', action='append', help='path of repo in GitHub, default is all repos'
+	                    + ' with gh_gitlab_ci_for_external_pr')
+	options = parser.parse_args(args)
+	settings = HubLabBotSettings(PurePath(options.settings_path), PurePath(get_assets_path()))
+	repo_paths = options.repo or [repo_options.gh_repo_path for repo_options in settings.repos
+	                              if repo_options.gh_gitlab_ci_for_external_pr]
+	for repo_path in repo_paths:
+		GithubWebhook(settings, repo_path).backfill_prs_to_gitlab()
+
+
+def main(args: Optional[List[str]] = None) -> None:
+	"""Entry point of HubLabBot.
+
+	Usage:
+		`hublabbot [settings_path]` - start server.</br>
+		`hublabbot replay ...` - replay journal, see `hublabbot.replay`.</br>
+		`hublabbot backfill [settings_path] [--repo GH_REPO_PATH]...` - push open external PRs
+		to GitLab, see `hublabbot.github.github_webhook.GithubWebhook.backfill_prs_to_gitlab`.
+
+	Signals:
+		`SIGUSR2` - start profiling of next `SIGNAL_PROFILE_REQUESTS` requests
+		or `SIGNAL_PROFILE_SECONDS` seconds, second signal stops profiling.
+
+	"""
+	if args is None:
+		args = sys.argv[1:]
+	if len(args) >= 1 and args[0] == 'replay':
+		# stand-ins and HTTP server of replay aren't needed to start server
+		import hublabbot.replay as replay
+		replay.main(args[1:])
+		return
+	if len(args) >= 1 and args[0] == 'backfill':
+		_backfill(args[1:])
+		return
 	settings_path = args[0] if len(args) >= 1 else 'hublabbot.json'
-	assets_path = pkg_resources.resource_filename('hublabbot', 'assets')
-	atexit.register(pkg_resources.cleanup_resources)
-	settings = HubLabBotSettings(PurePath(settings_path), PurePath(assets_path))
-	with Configurator(settings={'hublabbot': settings}) as config:
-		config.include('hublabbot.view.github')
-		config.include('hublabbot.view.gitlab')
-		config.include('hublabbot.view.home')
-		config.include('hublabbot.view.favicon')
-		app = config.make_wsgi_app()
-	# Configure webhooks after server started
-	timer = Timer(1, lambda: _configure_repos(settings))
-	timer.start()
-	server = make_server('0.0.0.0', settings.port, app)
+	settings = HubLabBotSettings(PurePath(settings_path), PurePath(get_assets_path()))
+	app = start(settings)
+	# `kill -USR2` starts profiling session or stops active one, see `hublabbot.profiling`
+	signal.signal(signal.SIGUSR2, lambda signum, frame: _toggle_profiling(settings))
+	server = make_server('0.0.0.0', settings.port, app, server_class=ThreadingWSGIServer)
 	print(f'Start server on {settings.base_url}')
 	server.serve_forever()
 
@@ -0,0 +1,355 @@
+"""Module for metrics in Prometheus text format.
+
+See [exposition formats](https://prometheus.io/docs/instrumenting/exposition_formats/).
+
+All metrics are registered in module-level registry and exposed on `/metrics`,
+see `hublabbot.view.metrics`. Updates are cheap (dict lookup and addition under lock),
+so they are safe on hot path.
+"""
+from typing import Any, Callable, Dict, List, Tuple
+import re
+import time
+import bisect
+import functools
+from abc import ABC, abstractmethod
+from threading import Lock
+from urllib.parse import urlsplit
+
+from pyramid.interfaces import IResponse  # type: ignore
+
+from hublabbot.client import OutboundCall
+
+
+Labels = Tuple[str, ...]
+"""Type - values of metric labels, in order of label names."""
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+"""Default buckets of histograms, in seconds."""
+_registry: List['Metric'] = []
+
+
+def _format_labels(names: Labels, values: Labels, extra: str = '') -> str:
+	pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+	if extra:
+		pairs.append(extra)
+	return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+	return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+	if value == float('inf'):
+		return '+Inf'
+	return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(ABC):
+	"""Base class of metrics.
+
+	Args:
+		name: Metric name.
+		documentation: Help text.
+		label_names: Names of labels.
+
+	"""
+
+	type_name = 'untyped'
+	"""Type of metric in exposition format."""
+
+	def __init__(self, name: str, documentation: str, label_names: Labels = ()):
+		self.name = name
+		"""Metric name."""
+		self.documentation = documentation
+		"""Help text."""
+		self.label_names = label_names
+		"""Names of labels."""
+		self._lock = Lock()
+		_registry.append(self)
+
+	@abstractmethod
+	def samples(self) -> List[str]:
+		"""Lines with samples in exposition format."""
+
+	def render(self) -> str:
+		"""Metric in exposition format."""
+		lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+		lines += self.samples()
+		return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+	"""Monotonically increasing counter."""
+
+	type_name = 'counter'
+
+	def __init__(self, name: str, documentation: str, label_names: Labels = ()):
+		super().__init__(name, documentation, label_names)
+		self._values: Dict[Labels, float] = {}
+
+	def inc(self, *labels: str, amount: float = 1) -> None:
+		"""Increase counter with `labels` by `amount`."""
+		with self._lock:
+			self._values[labels] = self._values.get(labels, 0) + amount
+
+	def value(self, *labels: str) -> float:
+		"""Current value of counter with `labels`."""
+		return self._values.get(labels, 0)
+
+	def samples(self) -> List[str]:
+		"""Lines with samples in exposition format."""
+		with self._lock:
+			values = list(self._values.items())
+		return [f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}'
+		        for labels, value in values]
+
+
+class Gauge(Metric):
+	"""Value, which can go up and down."""
+
+	type_name = 'gauge'
+
+	def __init__(self, name: str, documentation: str, label_names: Labels = ()):
+		super().__init__(name, documentation, label_names)
+		self._values: Dict[Labels, float] = {}
+
+	def set(self, value: float, *labels: str) -> None:
+		"""Set gauge with `labels` to `value`."""
+		with self._lock:
+			self._values[labels] = value
+
+	def inc(self, *labels: str, amount: float = 1) -> None:
+		"""Increase gauge with `labels` by `amount`."""
+		with self._lock:
+			self._values[labels] = self._values.get(labels, 0) + amount
+
+	def dec(self, *labels: str, amount: float = 1) -> None:
+		"""Decrease gauge with `labels` by `amount`."""
+		self.inc(*labels, amount=-amount)
+
+	def value(self, *labels: str) -> float:
+		"""Current value of gauge with `labels`."""
+		return self._values.get(labels, 0)
+
+	def samples(self) -> List[str]:
+		"""Lines with samples in exposition format."""
+		with self._lock:
+			values = list(self._values.items())
+		return [f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}'
+		        for labels, value in values]
+
+
+class Histogram(Metric):
+	"""Distribution of values in cumulative buckets.
+
+	Args:
+		name: Metric name.
+		documentation: Help text.
+		label_names: Names of labels.
+		buckets: Upper bounds of buckets, `+Inf` bucket added automatically.
+
+	"""
+
+	type_name = 'histogram'
+
+	def __init__(self, name: str, documentation: str, label_names: Labels = (),
+	             buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+		super().__init__(name, documentation, label_names)
+		self.buckets = tuple(sorted(buckets))
+		"""Upper bounds of buckets."""
+		# per labels: [counts of buckets..., count of +Inf bucket], sum
+		self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+	def observe(self, value: float, *labels: str) -> None:
+		"""Observe `value` for `labels`."""
+		index = bisect.bisect_left(self.buckets, value)
+		with self._lock:
+			counts, total = self._values.setdefault(labels, ([0] * (len(self.buckets) + 1), [0.0]))
+			counts[index] += 1
+			total[0] += value
+
+	def count(self, *labels: str) -> int:
+		"""Count of observed values for `labels`."""
+		with self._lock:
+			counts, _ = self._values.get(labels, ([0], [0.0]))
+			return sum(counts)
+
+	def samples(self) -> List[str]:
+		"""Lines with samples in exposition format."""
+		with self._lock:
+			values = [(labels, list(counts), total[0]) for labels, (counts, total) in self._values.items()]
+		lines = []
+		for labels, counts, total in values:
+			cumulative = 0
+			for bound, count in zip(self.buckets + (float('inf'),), counts):
+				cumulative += count
+				le = 'le="' + _format_value(bound) + '"'
+				lines.append(f'{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}')
+			lines.append(f'{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(total)}')
+			lines.append(f'{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}')
+		return lines
+
+
+def render() -> str:
+	"""All registered metrics in exposition format."""
+	return ''.join(metric.render() for metric in _registry)
+
+
+REQUESTS = Counter(
+	'hublabbot_requests_total', 'Webhook deliveries processed.',
+	('source', 'event', 'handler', 'status'))
+REQUEST_DURATION = Histogram(
+	'hublabbot_request_duration_seconds', 'Duration of webhook delivery processing.',
+	('source', 'event', 'handler'))
+REQUESTS_IN_PROGRESS = Gauge(
+	'hublabbot_requests_in_progress', 'Webhook deliveries being processed now.', ('source',))
+OUTBOUND_CALLS = Counter(
+	'hublabbot_outbound_calls_total', 'Outbound API calls.',
+	('backend', 'method', 'endpoint', 'status'))
+OUTBOUND_DURATION = Histogram(
+	'hublabbot_outbound_call_duration_seconds', 'Duration of outbound API calls.',
+	('backend', 'method', 'endpoint'))
+RATE_LIMIT_REMAINING = Gauge(
+	'hublabbot_rate_limit_remaining', 'Remaining API requests in current rate limit window.',
+	('backend',))
+PENDING_AUTO_MERGES = Gauge(
+	'hublabbot_pending_auto_merges', 'Auto-merges waiting for delay to expire.')
+GIT_SYNC_BYTES = Counter(
+	'hublabbot_git_sync_bytes_total', 'Bytes transferred by syncing PRs to GitLab.', ('direction',))
+GIT_SYNC_DURATION = Histogram(
+	'hublabbot_git_sync_duration_seconds', 'Duration of syncing PRs to GitLab.', ('direction',))
+PIPELINE_EVENTS_COALESCED = Counter(
+	'hublabbot_pipeline_events_coalesced_total',
+	'GitLab Pipeline Hooks coalesced with pending evaluation of same ref.')
+CORRELATION_LOOKUPS = Counter(
+	'hublabbot_correlation_lookups_total', 'Lookups in correlation cache.', ('index', 'result'))
+CI_LOG_BYTES = Counter(
+	'hublabbot_ci_log_fetch_bytes_total', 'Bytes of GitLab CI job logs fetched.')
+SWEEP_MERGES = Counter(
+	'hublabbot_sweep_merges_total', 'Ready PRs found by auto-merge sweep (missed by webhooks).')
+OUTBOX_ACTIONS = Counter(
+	'hublabbot_outbox_actions_total', 'Attempts of outbound actions from outbox.', ('kind', 'result'))
+OUTBOX_PENDING = Gauge(
+	'hublabbot_outbox_pending_actions', 'Outbound actions waiting for retry.')
+CIRCUIT_OPEN = Gauge(
+	'hublabbot_circuit_open', 'Circuit breaker of backend is open (1) or closed (0).', ('backend',))
+JANITOR_CANCELS = Counter(
+	'hublabbot_janitor_canceled_pipelines_total', 'Superseded pipelines canceled by janitor.')
+JANITOR_MINUTES_SAVED = Counter(
+	'hublabbot_janitor_saved_minutes_total',
+	'Estimated pipeline minutes saved by janitor (typical duration minus elapsed time).')
+EARLY_CANCELS = Counter(
+	'hublabbot_early_canceled_pipelines_total',
+	'Pipelines of old PR heads canceled on synchronize, before pipeline of new head started.')
+BRANCH_DELETES = Counter(
+	'hublabbot_branch_deletes_total',
+	'Branches of deletion batches on GitLab, by result (deleted, missing, pending, failed).',
+	('result',))
+MERGE_QUEUE_RESULTS = Counter(
+	'hublabbot_merge_queue_prs_total',
+	'PRs processed at head of merge queue, by result (merged, deferred, updated, dropped, failed).',
+	('result',))
+REPO_QUEUE_WAIT = Histogram(
+	'hublabbot_repo_queue_wait_seconds', 'Wait of deliveries for processing slot, by repo.', ('repo',))
+REPO_QUEUE_DEPTH = Gauge(
+	'hublabbot_repo_queue_depth', 'Deliveries waiting for processing slot, by repo.', ('repo',))
+REPO_API_CALLS = Counter(
+	'hublabbot_repo_api_calls_total', 'GitHub and GitLab API calls of deliveries, by repo.', ('repo',))
+INSTALLATION_TOKENS = Counter(
+	'hublabbot_github_installation_tokens_total',
+	'GitHub App installation tokens taken from cache (hit) or minted.', ('result',))
+CI_SECTION_DURATION = Histogram(
+	'hublabbot_ci_section_duration_seconds', 'Duration of sections of GitLab CI job logs.',
+	('repo', 'job', 'section'), buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600))
+COALESCED_READS = Counter(
+	'hublabbot_coalesced_reads_total',
+	'Identical concurrent API reads, which shared response of read in flight (saved calls).',
+	('backend',))
+SNAPSHOT_ENTRIES = Counter(
+	'hublabbot_snapshot_entries_total',
+	'Cache entries of snapshot of previous run, by section and result (restored, expired).',
+	('section', 'result'))
+
+
+_ID_SEGMENT = re.compile(r'^(\d+|[0-9a-f]{40})$')
+_NAME_SEGMENTS = {'repos': ('{owner}', '{repo}'), 'projects': ('{project}',), 'users': ('{user}',),
+                  'labels': ('{label}',), 'collaborators': ('{user}',)}
+_TAIL_SEGMENTS = {'branches': '{branch}', 'git': '{ref}', 'contents': '{path}'}
+
+
+def normalize_endpoint(url: str) -> str:
+	"""Endpoint of API call with IDs and names replaced by placeholders.
+
+	Keeps cardinality of `endpoint` label bounded, e.g.
+	`https://api.github.com/repos/foo/bar/pulls/42` -> `/repos/{owner}/{repo}/pulls/{id}`.
+
+	Args:
+		url: Full URL of request.
+
+	"""
+	segments = urlsplit(url).path.strip('/').split('/')
+	result: List[str] = []
+	skip = 0
+	i = 0
+	while i < len(segments):
+		segment = segments[i]
+		i += 1
+		if skip > 0:
+			skip -= 1
+			continue
+		if _ID_SEGMENT.match(segment):
+			result.append('{sha}' if len(segment) == 40 else '{id}')
+			continue
+		result.append(segment)
+		if segment in _NAME_SEGMENTS and i < len(segments):
+			placeholders = _NAME_SEGMENTS[segment][:len(segments) - i]
+			result += placeholders
+			skip = len(placeholders)
+		elif segment in _TAIL_SEGMENTS and i < len(segments):
+			result.append(_TAIL_SEGMENTS[segment])
+			break
+	return '/' + '/'.join(result)
+
+
+def observe_outbound_call(call: OutboundCall) -> None:
+	"""Observer of outbound calls, see `hublabbot.client.add_observer`."""
+	endpoint = normalize_endpoint(call.url)
+	status = str(call.status) if call.status is not None else 'error'
+	OUTBOUND_CALLS.inc(call.backend, call.method, endpoint, status)
+	OUTBOUND_DURATION.observe(call.duration, call.backend, call.method, endpoint)
+	if call.response is not None:
+		remaining = (call.response.headers.get('X-RateLimit-Remaining')
+		             or call.response.headers.get('RateLimit-Remaining'))
+		if remaining is not None and remaining.isdigit():
+			RATE_LIMIT_REMAINING.set(int(remaining), call.backend)
+
+
+def observed(source: str, dispatch: Dict[str, Tuple[str, Any]]
+) -> Callable[[Callable[[Any], IResponse]], Callable[[Any], IResponse]]:
+	"""Decorator for view's handlers, counts deliveries and measures their duration.
+
+	View must have `event` attribute.
+
+	Args:
+		source: `'github'` or `'gitlab'`.
+		dispatch: Dispatch table of view, to get handler name by event.
+
+	"""
+	def decorator(handler: Callable[[Any], IResponse]) -> Callable[[Any], IResponse]:
+		@functools.wraps(handler)
+		def wrapper(view: Any) -> IResponse:
+			event = view.event or 'none'
+			handler_name = dispatch[event][0] if event in dispatch else 'none'
+			status = 'EXCEPTION'
+			REQUESTS_IN_PROGRESS.inc(source)
+			start = time.perf_counter()
+			try:
+				result = handler(view)
+				status = result.get('status', 'none') if isinstance(result, dict) else 'none'
+				return result
+			finally:
+				REQUEST_DURATION.observe(time.perf_counter() - start, source, event, handler_name)
+				REQUESTS.inc(source, event, handler_name, status)
+				REQUESTS_IN_PROGRESS.dec(source)
+		return wrapper
+	return decorator
@@ -0,0 +1,403 @@
+"""Module for durable outbox of outbound actions (merges, comments, pipeline cancels, pushes).
+
+Action is recorded in SQLite database before first attempt. Failed by unavailable backend
+(5xx, 429, network error) it's retried with exponential backoff and full jitter, so actions
+aren't lost when GitHub or GitLab is down, and pending actions are drained after restart.
+Actions are idempotent: retry of merged PR, canceled pipeline, deleted branch or posted comment
+does nothing. `CircuitBreaker` of backend stops attempts, while backend fails.
+"""
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+import sys
+import json
+import time
+import random
+import sqlite3
+import threading
+import traceback
+
+from hublabbot.util import JsonDict
+from hublabbot.metrics import OUTBOX_ACTIONS, OUTBOX_PENDING, CIRCUIT_OPEN
+
+
+ActionCallback = Callable[[JsonDict], object]
+"""Type - callback of action, receives payload of action, its result is ignored."""
+MERGE_ACTION = 'merge'
+"""Kind of action - merge PR."""
+COMMENT_ACTION = 'comment'
+"""Kind of action - post comment to PR."""
+SYNC_ACTION = 'sync'
+"""Kind of action - push branch of external PR to GitLab."""
+CANCEL_ACTION = 'cancel'
+"""Kind of action - cancel GitLab pipeline."""
+DELETE_BRANCH_ACTION = 'delete_branch'
+"""Kind of action - delete GitLab branch."""
+MAX_ATTEMPTS = 10
+"""Action failed so many times is dropped."""
+BACKOFF_BASE = 2
+"""Backoff before second attempt is up to this, in seconds, it doubles every attempt."""
+BACKOFF_MAX = 300
+"""Maximum backoff, in seconds."""
+CLAIM_TIMEOUT = 300
+"""Action claimed by attempt, which crashed, is retried after this, in seconds."""
+RETENTION = 24 * 60 * 60
+"""Done and dropped actions are kept this long to suppress duplicates, in seconds."""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+	key TEXT PRIMARY KEY,
+	kind TEXT NOT NULL,
+	payload TEXT NOT NULL,
+	state TEXT NOT NULL,
+	attempts INTEGER NOT NULL,
+	due REAL NOT NULL,
+	updated_at REAL NOT NULL,
+	error TEXT);
+CREATE INDEX IF NOT EXISTS outbox_state_due ON outbox (state, due);
+"""
+_PENDING = 'pending'
+_DONE = 'done'
+_DROPPED = 'dropped'
+
+
+def is_retryable(err: Exception) -> bool:
+	"""Check `err` is caused by unavailable backend, so action can succeed later.
+
+	Retryable are: HTTP statuses 408, 429 and 5xx, rate limit of GitHub, network errors
+	(`OSError`, including `requests` exceptions) and errors of git transport.
+	"""
+	# `github.GithubException.status`, `gitlab.GitlabError.response_code`
+	status = getattr(err, 'status', None)
+	if status is None:
+		status = getattr(err, 'response_code', None)
+	if type(err).__name__ == 'RateLimitExceededException':
+		return True
+	if isinstance(status, int):
+		return status >= 500 or status in (408, 429)
+	return isinstance(err, OSError) or type(err).__module__.startswith('pygit2')
+
+
+def backoff(attempts: int) -> float:
+	"""Delay before next attempt after `attempts` failed ones: full jitter, in seconds."""
+	return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1)))
+
+
+class CircuitBreaker:
+	"""Circuit breaker of backend.
+
+	Closed breaker allows attempts. After `failure_threshold` failures in row it opens
+	and rejects attempts for `reset_timeout` seconds, then it allows one trial attempt
+	(half-open): success closes it, failure opens it again.
+
+	Args:
+		backend: Name of backend, like `'github'`.
+		failure_threshold: Count of failures in row, which opens breaker.
+		reset_timeout: Time before trial attempt, in seconds.
+
+	"""
+
+	def __init__(self, backend: str, failure_threshold: int = 5, reset_timeout: float = 30):
+		self.backend = backend
+		"""Name of backend."""
+		self.failure_threshold = failure_threshold
+		"""Count of failures in row, which opens breaker."""
+		self.reset_timeout = reset_timeout
+		"""Time before trial attempt, in seconds."""
+		self._lock = threading.Lock()
+		self._failures = 0
+		self._opened_at: Optional[float] = None
+		self._trial_at: Optional[float] = None
+		CIRCUIT_OPEN.set(0, backend)
+
+	@property
+	def is_open(self) -> bool:
+		"""Breaker is open or half-open."""
+		return self._opened_at is not None
+
+	def allow(self) -> bool:
+		"""Check attempt is allowed, half-open breaker allows one trial per `reset_timeout`."""
+		with self._lock:
+			if self._opened_at is None:
+				return True
+			now = time.monotonic()
+			last = self._trial_at if self._trial_at is not None else self._opened_at
+			if now - last < self.reset_timeout:
+				return False
+			self._trial_at = now
+			return True
+
+	def record(self, success: bool) -> None:
+		"""Record result of attempt."""
+		with self._lock:
+			if success:
+				if self._opened_at is not None:
+					print(f'Circuit breaker of {self.backend} closed.')
+					CIRCUIT_OPEN.set(0, self.backend)
+				self._failures = 0
+				self._opened_at = None
+				self._trial_at = None
+				return
+			self._failures += 1
+			if self._opened_at is not None:
+				self._trial_at = time.monotonic()
+			elif self._failures >= self.failure_threshold:
+				self._opened_at = time.monotonic()
+				print(f'Circuit breaker of {self.backend} opened after {self._failures} failures!',
+				      file=sys.stderr)
+				CIRCUIT_OPEN.set(1, self.backend)
+
+
+class _Action(NamedTuple):
+	backend: str
+	callback: ActionCallback
+
+
+class Outbox:
+	"""Durable outbox of outbound actions.
+
+	Several processes on one host can share database file, every action is attempted
+	by one of them at a time.
+
+	Args:
+		path: Path to SQLite database, `None` - in memory (retries aren't durable).
+		poll_interval: Interval of checks for due retries, in seconds.
+
+	"""
+
+	def __init__(self, path: Optional[str] = None, poll_interval: float = 1.0):
+		self.path = path
+		"""Path to SQLite database, `None` - in memory."""
+		self.poll_interval = poll_interval
+		"""Interval of checks for due retries, in seconds."""
+		self._actions: Dict[str, _Action] = {}
+		self._breakers: Dict[str, CircuitBreaker] = {}
+		self._lock = threading.Lock()
+		self._db = sqlite3.connect(path if path is not None else ':memory:', timeout=30,
+		                           isolation_level=None, check_same_thread=False)
+		if path is not None:
+			self._db.execute('PRAGMA journal_mode=WAL')
+		self._db.executescript(_SCHEMA)
+		self._stopped = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+
+	def register(self, kind: str, backend: str, callback: ActionCallback) -> None:
+		"""Register `callback` for actions of `kind`, calling `backend` (`'github'`, `'gitlab'`, `'git'`).
+
+		Callback must be idempotent, raised exception is retried if `is_retryable`.
+		"""
+		self._actions[kind] = _Action(backend, callback)
+		if backend not in self._breakers:
+			self._breakers[backend] = CircuitBreaker(backend)
+
+	def breaker(self, backend: str) -> CircuitBreaker:
+		"""Returns `CircuitBreaker` of `backend`."""
+		return self._breakers[backend]
+
+	def _execute(self, sql: str, args: Tuple[Any, ...] = ()) -> sqlite3.Cursor:
+		with self._lock:
+			return self._db.execute(sql, args)
+
+	def _claim(self, kind: str, key: str, payload: JsonDict, once: bool) -> Tuple[str, Optional[bool]]:
+		"""Record action, claimed for first attempt.
+
+		Returns:
+			Key of row and `None` if action is claimed, or result of `submit` if it isn't recorded.
+
+		"""
+		row_key = f'{kind}:{key}'
+		now = time.time()
+		with self._lock:
+			self._db.execute('BEGIN IMMEDIATE')
+			try:
+				row = self._db.execute('SELECT state FROM outbox WHERE key = ?', (row_key,)).fetchone()
+				if row is not None and (row[0] == _PENDING or (once and row[0] == _DONE)):
+					self._db.execute('COMMIT')
+					return row_key, bool(row[0] == _DONE)
+				self._db.execute(
+					'INSERT OR REPLACE INTO outbox (key, kind, payload, state, attempts, due, updated_at)'
+					' VALUES (?, ?, ?, ?, 0, ?, ?)',
+					(row_key, kind, json.dumps(payload), _PENDING, now + CLAIM_TIMEOUT, now))
+				self._db.execute('COMMIT')
+			except BaseException:
+				self._db.execute('ROLLBACK')
+				raise
+		backend = self._actions[kind].backend
+		if not self._breakers[backend].allow():
+			self._execute('UPDATE outbox SET due = ? WHERE key = ?', (now, row_key))
+			print(f'Outbox: {row_key} postponed, {backend} is unavailable.', file=sys.stderr)
+			return row_key, False
+		return row_key, None
+
+	def submit(self, kind: str, key: str, payload: JsonDict,
+	           action: Optional[Callable[[], None]] = None, once: bool = False) -> bool:
+		"""Record action and attempt it now, unless breaker of its backend is open.
+
+		Args:
+			kind: Kind of action, see `register`.
+			key: Key of action, unique in `kind`. Action with same key, which is pending, isn't
+				recorded again.
+			payload: JSON dict passed to callback.
+			action: Callable for first attempt, default is registered callback. Handler can pass
+				closure over objects it has already fetched.
+			once: Done action with same key (in `RETENTION`) isn't recorded again.
+
+		Returns:
+			`True` if action is done, `False` if it's pending for retry.
+
+		Raises:
+			Exception: Exception of first attempt, which isn't `is_retryable`.
+
+		"""
+		row_key, result = self._claim(kind, key, payload, once)
+		if result is not None:
+			return result
+		error = None
+		try:
+			if action is not None:
+				action()
+			else:
+				self._actions[kind].callback(payload)
+		except Exception as err:
+			error = err
+		if self._finish(row_key, kind, 1, error) == _DROPPED:
+			assert error is not None
+			raise error
+		return error is None
+
+	async def submit_async(self, kind: str, key: str, payload: JsonDict,
+	                       action: Callable[[], Awaitable[None]], once: bool = False) -> bool:
+		"""Like `submit`, but first attempt is coroutine, for `hublabbot.aio` engine.
+
+		Retries are attempted by registered callback in thread of outbox.
+		"""
+		row_key, result = self._claim(kind, key, payload, once)
+		if result is not None:
+			return result
+		error = None
+		try:
+			await action()
+		except Exception as err:
+			error = err
+		if self._finish(row_key, kind, 1, error) == _DROPPED:
+			assert error is not None
+			raise error
+		return error is None
+
+	def _finish(self, row_key: str, kind: str, attempts: int, error: Optional[Exception]) -> str:
+		"""Record result of attempt.
+
+		Returns:
+			New state of action: done, pending or dropped.
+
+		"""
+		backend = self._actions[kind].backend
+		now = time.time()
+		if error is None:
+			self._breakers[backend].record(True)
+			self._execute('UPDATE outbox SET state = ?, attempts = ?, updated_at = ?, error = NULL'
+			              ' WHERE key = ?', (_DONE, attempts, now, row_key))
+			OUTBOX_ACTIONS.inc(kind, 'done')
+			return _DONE
+		retryable = is_retryable(error)
+		# non-retryable error is answer of available backend
+		self._breakers[backend].record(not retryable)
+		if retryable and attempts < MAX_ATTEMPTS:
+			delay = backoff(attempts)
+			self._execute(
+				'UPDATE outbox SET attempts = ?, due = ?, updated_at = ?, error = ? WHERE key = ?',
+				(attempts, now + delay, now, repr(error), row_key))
+			OUTBOX_ACTIONS.inc(kind, 'retry')
+			print(f'Outbox: {row_key} failed - "{error}", attempt {attempts + 1} in {delay:.1f} s.',
+			      file=sys.stderr)
+			return _PENDING
+		self._execute(
+			'UPDATE outbox SET state = ?, attempts = ?, updated_at = ?, error = ? WHERE key = ?',
+			(_DROPPED, attempts, now, repr(error), row_key))
+		OUTBOX_ACTIONS.inc(kind, 'dropped')
+		print(f'Outbox: {row_key} dropped after {attempts} attempts!', file=sys.stderr)
+		return _DROPPED
+
+	def run_due(self) -> None:
+		"""Attempt due pending actions, whose backends are available."""
+		now = time.time()
+		self._execute('DELETE FROM outbox WHERE state != ? AND updated_at < ?',
+		              (_PENDING, now - RETENTION))
+		rows = self._execute(
+			'SELECT key, kind, payload, attempts, due FROM outbox WHERE state = ? AND due <= ?'
+			' ORDER BY due', (_PENDING, now)).fetchall()
+		for row_key, kind, payload, attempts, due in rows:
+			if kind not in self._actions or not self._breakers[self._actions[kind].backend].allow():
+				continue
+			# action is claimed by one process
+			claimed = self._execute('UPDATE outbox SET due = ? WHERE key = ? AND state = ? AND due = ?',
+			                        (time.time() + CLAIM_TIMEOUT, row_key, _PENDING, due)).rowcount
+			if claimed != 1:
+				continue
+			error = None
+			try:
+				self._actions[kind].callback(json.loads(payload))
+			except Exception as err:
+				error = err
+			if self._finish(row_key, kind, attempts + 1, error) == _DROPPED:
+				assert error is not None
+				traceback.print_exception(type(error), error, error.__traceback__)
+		OUTBOX_PENDING.set(self.pending())
+
+	def pending(self) -> int:
+		"""Count of pending actions."""
+		count: int = self._execute('SELECT COUNT(*) FROM outbox WHERE state = ?',
+		                           (_PENDING,)).fetchone()[0]
+		return count
+
+	def clear(self) -> None:
+		"""Forget all actions, including pending ones."""
+		self._execute('DELETE FROM outbox')
+
+	def _poll_loop(self) -> None:
+		# first run drains actions left by previous run
+		while True:
+			try:
+				self.run_due()
+			except Exception:
+				traceback.print_exc()
+			if self._stopped.wait(self.poll_interval):
+				return
+
+	def start(self) -> 'Outbox':
+		"""Start retries in background thread."""
+		self._thread = threading.Thread(target=self._poll_loop, name='hublabbot-outbox', daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self) -> None:
+		"""Stop retries."""
+		self._stopped.set()
+
+	def close(self) -> None:
+		"""Stop retries and close database."""
+		self.stop()
+		with self._lock:
+			self._db.close()
+
+
+def perform(outbox: Optional[Outbox], kind: str, key: str, payload: JsonDict,
+            action: Callable[[], None], once: bool = False) -> JsonDict:
+	"""Perform action through `outbox`, see `Outbox.submit`.
+
+	Args:
+		outbox: `Outbox`, `None` - call `action` directly (e.g. action is attempted by outbox).
+		kind: Kind of action.
+		key: Key of action, unique in `kind`.
+		payload: JSON dict passed to callback on retry.
+		action: Callable for first attempt.
+		once: See `Outbox.submit`.
+
+	Returns:
+		`{'status': 'OK', ...}`, with note if action is pending for retry.
+
+	"""
+	if outbox is None:
+		action()
+		return {'status': 'OK'}
+	if outbox.submit(kind, key, payload, action, once):
+		return {'status': 'OK'}
+	return {'status': 'OK', 'note': f'Action {kind} {key} is pending for retry.'}
@@ -0,0 +1,256 @@
+"""Module for on-demand profiling of live instance.
+
+Profiling session is started by admin route (see `hublabbot.view.admin`) or by `SIGUSR2`
+and covers next N requests or T seconds, whichever ends first. Requests are profiled
+by `ProfilingMiddleware`, background paths (repos configuration, delayed auto-merges,
+git sync) by `profiled` decorator. Modes:
+
+- `'cprofile'` - deterministic `cProfile`, result saved as pstats file;
+- `'sample'` - sampling profiler, result saved as collapsed stacks file
+  (input of [FlameGraph](https://github.com/brendangregg/FlameGraph)).
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, TypeVar
+import os
+import sys
+import time
+import pstats
+import cProfile
+import functools
+import threading
+from types import FrameType
+
+
+F = TypeVar('F', bound=Callable[..., Any])
+MODES = ('cprofile', 'sample')
+"""Supported profiling modes."""
+SAMPLE_INTERVAL = 0.005
+"""Interval of sampling profiler, in seconds."""
+
+
+class ProfilingSession:
+	"""One profiling session.
+
+	Args:
+		mode: `'cprofile'` or `'sample'`.
+		requests: Count of requests to profile, `None` - unlimited.
+		seconds: Duration of session, `None` - unlimited.
+		output_dir: Dir for result file.
+
+	"""
+
+	def __init__(self, mode: str, requests: Optional[int], seconds: Optional[float], output_dir: str):
+		if mode not in MODES:
+			raise ValueError(f'Unknown profiling mode: "{mode}"!')
+		if requests is None and seconds is None:
+			raise ValueError('Profiling session must be limited by requests or seconds!')
+		self.mode = mode
+		"""`'cprofile'` or `'sample'`."""
+		self.requests_left = requests
+		"""Count of requests left to profile, `None` - unlimited."""
+		self.deadline = time.monotonic() + seconds if seconds is not None else None
+		"""End of session by `time.monotonic`, `None` - unlimited."""
+		self.output_path = os.path.join(
+			output_dir,
+			f'hublabbot-{time.strftime("%Y%m%d-%H%M%S")}.{"pstats" if mode == "cprofile" else "collapsed"}')
+		"""Path to result file."""
+		self.profiled_calls = 0
+		"""Count of profiled requests and background calls."""
+		self._lock = threading.Lock()
+		self._stats: Optional[pstats.Stats] = None
+		self._stacks: Dict[str, int] = {}
+		self._threads: Set[int] = set()
+		self._finished = threading.Event()
+		if mode == 'sample':
+			threading.Thread(target=self._sample, name='hublabbot-sampler', daemon=True).start()
+
+	@property
+	def finished(self) -> bool:
+		"""Session is finished and result is saved."""
+		return self._finished.is_set()
+
+	def expired(self) -> bool:
+		"""Session reached its limit."""
+		return ((self.requests_left is not None and self.requests_left <= 0)
+		        or (self.deadline is not None and time.monotonic() >= self.deadline))
+
+	def acquire(self, is_request: bool) -> bool:
+		"""Reserve one call for profiling.
+
+		Args:
+			is_request: Call is request, counted by session's limit.
+
+		Returns:
+			`False` if session expired.
+
+		"""
+		with self._lock:
+			if self.finished or self.expired():
+				return False
+			if is_request and self.requests_left is not None:
+				self.requests_left -= 1
+			self.profiled_calls += 1
+			return True
+
+	def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+		"""Run `func` under profiler."""
+		if self.mode == 'sample':
+			thread_id = threading.get_ident()
+			with self._lock:
+				self._threads.add(thread_id)
+			try:
+				return func(*args, **kwargs)
+			finally:
+				with self._lock:
+					self._threads.discard(thread_id)
+		profile = cProfile.Profile()
+		try:
+			return profile.runcall(func, *args, **kwargs)
+		finally:
+			with self._lock:
+				if self._stats is None:
+					self._stats = pstats.Stats(profile)
+				else:
+					self._stats.add(profile)
+
+	def _sample(self) -> None:
+		while not self._finished.wait(SAMPLE_INTERVAL):
+			frames = sys._current_frames()
+			with self._lock:
+				for thread_id in self._threads:
+					frame = frames.get(thread_id)
+					if frame is not None:
+						stack = _collapse(frame)
+						self._stacks[stack] = self._stacks.get(stack, 0) + 1
+
+	def finish(self) -> Optional[str]:
+		"""Finish session and save result.
+
+		Returns:
+			Path to result file or `None` if nothing was profiled.
+
+		"""
+		with self._lock:
+			if self.finished:
+				return None
+			self._finished.set()
+			if self.mode == 'cprofile':
+				if self._stats is None:
+					return None
+				self._stats.dump_stats(self.output_path)
+			else:
+				if len(self._stacks) == 0:
+					return None
+				with open(self.output_path, 'w') as f:
+					f.writelines(f'{stack} {count}\n' for stack, count in sorted(self._stacks.items()))
+		print(f'Profile of {self.profiled_calls} calls saved to {self.output_path}.')
+		return self.output_path
+
+	def to_json(self) -> Dict[str, Any]:
+		"""State of session as JSON dict."""
+		seconds_left = max(0.0, self.deadline - time.monotonic()) if self.deadline is not None else None
+		return {
+			'mode': self.mode,
+			'requests_left': self.requests_left,
+			'seconds_left': seconds_left,
+			'profiled_calls': self.profiled_calls,
+			'finished': self.finished,
+			'output_path': self.output_path}
+
+
+def _collapse(frame: Optional[FrameType]) -> str:
+	names: List[str] = []
+	while frame is not None:
+		code = frame.f_code
+		names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+		frame = frame.f_back
+	return ';'.join(reversed(names))
+
+
+_session: Optional[ProfilingSession] = None
+_session_lock = threading.Lock()
+_local = threading.local()
+
+
+def start(mode: str, requests: Optional[int], seconds: Optional[float],
+          output_dir: str) -> ProfilingSession:
+	"""Start profiling session, see `ProfilingSession`.
+
+	Raises:
+		RuntimeError: An error occurred when other session is active.
+
+	"""
+	global _session
+	with _session_lock:
+		if _session is not None and not _session.finished:
+			raise RuntimeError('Profiling session already active!')
+		_session = ProfilingSession(mode, requests, seconds, output_dir)
+		session = _session
+	if seconds is not None:
+		timer = threading.Timer(seconds, session.finish)
+		timer.daemon = True
+		timer.start()
+	print(f'Profiling ({mode}) started, result will be saved to {session.output_path}.')
+	return session
+
+
+def stop() -> Optional[str]:
+	"""Stop active profiling session.
+
+	Returns:
+		Path to result file or `None` if no active session or nothing was profiled.
+
+	"""
+	session = current_session()
+	if session is None:
+		return None
+	return session.finish()
+
+
+def current_session() -> Optional[ProfilingSession]:
+	"""Active profiling session or `None`."""
+	session = _session
+	if session is None or session.finished:
+		return None
+	return session
+
+
+def _run_profiled(is_request: bool, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+	session = current_session()
+	# nested call is already profiled by outer one
+	if session is None or getattr(_local, 'active', False) or not session.acquire(is_request):
+		return func(*args, **kwargs)
+	_local.active = True
+	try:
+		return session.run(func, *args, **kwargs)
+	finally:
+		_local.active = False
+		if session.expired():
+			session.finish()
+
+
+def profiled(func: F) -> F:
+	"""Decorator for background paths, profiles call if profiling session is active."""
+	@functools.wraps(func)
+	def wrapper(*args: Any, **kwargs: Any) -> Any:
+		return _run_profiled(False, func, *args, **kwargs)
+	return wrapper  # type: ignore
+
+
+class ProfilingMiddleware:
+	"""WSGI middleware, profiles requests if profiling session is active.
+
+	Args:
+		app: WSGI app.
+
+	"""
+
+	def __init__(self, app: Callable[..., Iterable[bytes]]):
+		self.app = app
+		"""Wrapped WSGI app."""
+
+	def __call__(self, environ: Dict[str, Any], start_response: Callable[..., Any]) -> Iterable[bytes]:
+		"""Handle request."""
+		if current_session() is None:
+			return self.app(environ, start_response)
+		chunks: List[bytes] = _run_profiled(True, lambda: list(self.app(environ, start_response)))
+		return chunks
@@ -0,0 +1,209 @@
+"""Module for replay of journal, see `hublabbot.journal.Journal`.
+
+Usage: `hublabbot replay [--settings PATH] [--speed N] [--workers N] JOURNAL`.
+
+Deliveries from journal are fed through HubLabBot's views and handlers. GitHub and GitLab APIs
+are replaced by local stand-ins, which answer with recorded responses. Git remotes point to
+GitHub stand-in too, so syncs of external PRs fail on replay.
+"""
+from typing import Dict, List, Optional
+import os
+import sys
+import json
+import time
+import hmac
+import base64
+import hashlib
+import argparse
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePath
+
+from webob import Request  # type: ignore
+
+from hublabbot.util import JsonDict
+from hublabbot.settings import HubLabBotSettings, default_gh_api_url
+from hublabbot.app import get_assets_path, make_app
+from hublabbot.journal import SECRET_HEADERS, read_journal
+from hublabbot.standin.server import StandinServer
+from hublabbot.standin.journal import JournalResponder
+import hublabbot.client as client
+
+
+REPLAY_SECRET = 'hublabbot-replay'
+"""GitHub and GitLab secret used on replay, deliveries are re-signed with it."""
+_ENDPOINTS = {'github': '/webhook/github', 'gitlab': '/webhook/gitlab'}
+_SKIPPED_HEADERS = ('host', 'content-length') + SECRET_HEADERS
+_current = threading.local()
+
+
+def percentile(values: List[float], percent: float) -> float:
+	"""Returns percentile of `values` by nearest-rank method."""
+	ordered = sorted(values)
+	rank = max(int(round(percent / 100 * len(ordered) + 0.5)) - 1, 0)
+	return ordered[min(rank, len(ordered) - 1)]
+
+
+def event_type(delivery: JsonDict) -> str:
+	"""Returns event type of delivery record, like `'github:status'`."""
+	headers = {name.lower(): value for name, value in delivery['headers'].items()}
+	event = headers.get('x-github-event') or headers.get('x-gitlab-event') or 'unknown'
+	return f'{delivery["source"]}:{event}'
+
+
+def _make_request(delivery: JsonDict) -> Request:
+	body = base64.b64decode(delivery['body'])
+	headers = {name: value for name, value in delivery['headers'].items()
+	           if name.lower() not in _SKIPPED_HEADERS}
+	if delivery['source'] == 'github':
+		signature = hmac.new(REPLAY_SECRET.encode(), body, hashlib.sha1).hexdigest()
+		headers['X-Hub-Signature'] = f'sha1={signature}'
+	else:
+		headers['X-Gitlab-Token'] = REPLAY_SECRET
+	return Request.blank(_ENDPOINTS[delivery['source']], method='POST', headers=headers, body=body)
+
+
+class Report:
+	"""Statistics of replay, by event type."""
+
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self.latencies: Dict[str, List[float]] = defaultdict(list)
+		"""Latencies of deliveries in seconds."""
+		self.errors: 'Counter[str]' = Counter()
+		"""Count of deliveries answered with 5xx."""
+		self.calls: Dict[str, 'Counter[str]'] = defaultdict(Counter)
+		"""Count of outbound calls by backend."""
+
+	def add_delivery(self, event: str, latency: float, status: int) -> None:
+		"""Add result of delivery."""
+		with self._lock:
+			self.latencies[event].append(latency)
+			if status >= 500:
+				self.errors[event] += 1
+
+	def add_call(self, call: client.OutboundCall) -> None:
+		"""Add outbound call, it is `hublabbot.client.Observer`."""
+		event = getattr(_current, 'event', 'background')
+		with self._lock:
+			self.calls[event][call.backend] += 1
+
+	def print(self, wall_time: float) -> None:
+		"""Print report."""
+		total = sum(len(latencies) for latencies in self.latencies.values())
+		print(f'Replayed {total} deliveries in {wall_time:.2f} s,'
+		      + f' {total / wall_time if wall_time > 0 else 0:.1f} deliveries/s.')
+		print(f'{"event":<28} {"count":>6} {"errors":>6} {"p50, ms":>9} {"p90, ms":>9}'
+		      + f' {"p99, ms":>9} {"max, ms":>9} {"GH calls":>9} {"GL calls":>9}')
+		events = sorted(set(self.latencies) | set(self.calls))
+		for event in events:
+			latencies = self.latencies.get(event, [])
+			calls = self.calls.get(event, Counter())
+			if len(latencies) > 0:
+				stats = ' '.join(f'{percentile(latencies, p) * 1000:>9.1f}' for p in (50, 90, 99))
+				stats += f' {max(latencies) * 1000:>9.1f}'
+			else:
+				stats = ' '.join(f'{"-":>9}' for _ in range(4))
+			print(f'{event:<28} {len(latencies):>6} {self.errors[event]:>6} {stats}'
+			      + f' {calls["github"]:>9} {calls["gitlab"]:>9}')
+
+
+def _make_settings(settings_path: str, github_url: str, gitlab_url: str,
+                   tmpdir: str) -> HubLabBotSettings:
+	with open(settings_path) as f:
+		settings_json = json.load(f)
+	settings_json.pop('journal_path', None)
+	settings_json.update({'gh_base_url': github_url, 'gh_api_url': github_url,
+	                      'gl_base_url': gitlab_url})
+	replay_settings_path = os.path.join(tmpdir, 'hublabbot.json')
+	with open(replay_settings_path, 'w') as f:
+		json.dump(settings_json, f)
+	for name in ('GITHUB_TOKEN', 'GITHUB_BOT_TOKEN', 'GITLAB_TOKEN'):
+		os.environ.setdefault(name, 'hublabbot-replay')
+	os.environ['GITHUB_SECRET'] = REPLAY_SECRET
+	os.environ['GITLAB_SECRET'] = REPLAY_SECRET
+	return HubLabBotSettings(PurePath(replay_settings_path), PurePath(get_assets_path()))
+
+
+def replay(journal_path: str, settings_path: str, speed: float, workers: int) -> Report:
+	"""Replay journal.
+
+	Args:
+		journal_path: Path to journal.
+		settings_path: Path to HubLabBot settings file, which journal recorded with.
+		speed: Speed factor, `1` - original speed, `0` - as fast as possible.
+		workers: Count of deliveries processed concurrently.
+
+	Returns:
+		`Report` of replay.
+
+	"""
+	with open(settings_path) as f:
+		settings_json = json.load(f)
+	gh_api_url = settings_json.get(
+		'gh_api_url', default_gh_api_url(settings_json.get('gh_base_url', 'https://github.com')))
+	gl_base_url = settings_json.get('gl_base_url', 'https://gitlab.com')
+	records = list(read_journal(journal_path))
+	deliveries = [r for r in records if r['kind'] == 'delivery']
+	responses = [r for r in records if r['kind'] == 'response']
+	github_responder = JournalResponder([r for r in responses if r['backend'] == 'github'],
+	                                    gh_api_url)
+	gitlab_responder = JournalResponder([r for r in responses if r['backend'] == 'gitlab'],
+	                                    gl_base_url)
+	report = Report()
+	with StandinServer(github_responder) as github_standin, \
+	     StandinServer(gitlab_responder) as gitlab_standin, \
+	     tempfile.TemporaryDirectory() as tmpdir:
+		github_responder.target_url = github_standin.url
+		gitlab_responder.target_url = gitlab_standin.url
+		settings = _make_settings(settings_path, github_standin.url, gitlab_standin.url, tmpdir)
+		app = make_app(settings)
+		client.add_observer(report.add_call)
+
+		def feed(delivery: JsonDict) -> None:
+			event = event_type(delivery)
+			_current.event = event
+			start = time.perf_counter()
+			try:
+				status = _make_request(delivery).get_response(app).status_int
+			except Exception:
+				status = 500
+			report.add_delivery(event, time.perf_counter() - start, status)
+			_current.event = 'background'
+
+		try:
+			start = time.perf_counter()
+			with ThreadPoolExecutor(max_workers=workers) as executor:
+				first_time: Optional[float] = None
+				for delivery in deliveries:
+					if first_time is None:
+						first_time = delivery['time']
+					if speed > 0:
+						delay = (delivery['time'] - first_time) / speed - (time.perf_counter() - start)
+						if delay > 0:
+							time.sleep(delay)
+					executor.submit(feed, delivery)
+			report.print(time.perf_counter() - start)
+		finally:
+			client.remove_observer(report.add_call)
+	return report
+
+
+def main(args: List[str]) -> None:
+	"""Entry point of `hublabbot replay`."""
+	parser = argparse.ArgumentParser(prog='hublabbot replay', description=__doc__.splitlines()[0])
+	parser.add_argument('journal', help='path to journal')
+	parser.add_argument('--settings', default='hublabbot.json',
+	                    help='path to settings file, which journal recorded with')
+	parser.add_argument('--speed', type=float, default=1.0,
+	                    help='speed factor, 1 - original speed, 0 - as fast as possible')
+	parser.add_argument('--workers', type=int, default=8,
+	                    help='count of deliveries processed concurrently')
+	options = parser.parse_args(args)
+	replay(options.journal, options.settings, options.speed, options.workers)
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,268 @@
+"""Module for leader election and jobs scheduled in shared state store.
+
+Several replicas of HubLabBot share `hublabbot.store.StateStore`. Jobs (delayed auto-merges,
+startup reconciliation, debounced pipeline evaluations) are kept in the store, so they survive
+restart of replica, and they are run only by leader - replica holding lease in the store.
+"""
+from typing import Callable, Dict, List, Optional, Set
+import os
+import time
+import uuid
+import socket
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from hublabbot.util import JsonDict
+from hublabbot.store import StateStore
+from hublabbot.metrics import PENDING_AUTO_MERGES
+
+
+JobCallback = Callable[[JsonDict], None]
+"""Type - callback of job, receives payload of job."""
+LEADER_LEASE = 'leader'
+"""Name of leader's lease in the store."""
+JOB_PREFIX = 'job:'
+"""Prefix of jobs' keys in the store."""
+JOB_GRACE_TTL = 24 * 60 * 60
+"""Job not claimed in this time after due (no leader) expires, in seconds."""
+JOB_CONCURRENCY = 8
+"""Default maximum count of jobs run at once by leader."""
+MERGE_JOB = 'merge'
+"""Kind of delayed auto-merge job, counted by `hublabbot.metrics.PENDING_AUTO_MERGES`."""
+RECONCILE_JOB = 'reconcile'
+"""Kind of startup reconciliation job (configure webhooks, labels, collaborators)."""
+PIPELINE_JOB = 'pipeline'
+"""Kind of debounced evaluation of GitLab Pipeline Hooks for one ref."""
+SWEEP_JOB = 'sweep'
+"""Kind of periodic auto-merge sweep of one repo."""
+JANITOR_JOB = 'janitor'
+"""Kind of periodic sweep of superseded pipelines of one GitLab project."""
+MERGE_QUEUE_JOB = 'merge_queue'
+"""Kind of processing of merge queue of one repo, see `hublabbot.github.merge_queue`."""
+BRANCH_DELETE_JOB = 'branch_delete'
+"""Kind of batched deletion of branches queued for one GitLab project."""
+
+
+def default_owner() -> str:
+	"""Unique name of replica: `{hostname}:{pid}:{random}`."""
+	return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+class LeaderElector:
+	"""Leader election by lease in the store, lease is renewed every third of `ttl`.
+
+	Leader, which stopped renewing (crashed or lost the store), is replaced in `ttl` seconds.
+
+	Args:
+		store: `hublabbot.store.StateStore`.
+		ttl: Lease time in seconds.
+		owner: Unique name of replica, default is `default_owner()`.
+
+	"""
+
+	def __init__(self, store: StateStore, ttl: float, owner: Optional[str] = None):
+		self.store = store
+		"""`hublabbot.store.StateStore`."""
+		self.ttl = ttl
+		"""Lease time in seconds."""
+		self.owner = owner if owner is not None else default_owner()
+		"""Unique name of replica."""
+		self._lease_until = 0.0
+		self._stopped = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+
+	@property
+	def is_leader(self) -> bool:
+		"""Replica holds lease now."""
+		return time.monotonic() < self._lease_until
+
+	def renew(self) -> bool:
+		"""Acquire or renew lease.
+
+		Returns:
+			`True` if replica is leader.
+
+		"""
+		was_leader = self.is_leader
+		start = time.monotonic()
+		try:
+			acquired = self.store.acquire_lease(LEADER_LEASE, self.owner, self.ttl)
+		except Exception:
+			traceback.print_exc()
+			acquired = False
+		# lease expires in the store not before `ttl` since request
+		self._lease_until = start + self.ttl if acquired else 0.0
+		if acquired and not was_leader:
+			print(f'Replica {self.owner} became leader.')
+		elif was_leader and not acquired:
+			print(f'Replica {self.owner} lost leadership.')
+		return acquired
+
+	def _renew_loop(self) -> None:
+		while True:
+			self.renew()
+			if self._stopped.wait(self.ttl / 3):
+				return
+
+	def start(self) -> 'LeaderElector':
+		"""Start renewing lease in background thread."""
+		self._thread = threading.Thread(target=self._renew_loop, name='hublabbot-leader', daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self) -> None:
+		"""Stop renewing lease, lease expires in `ttl` seconds."""
+		self._stopped.set()
+		self._lease_until = 0.0
+
+
+class Scheduler:
+	"""Jobs delayed in the store, due jobs are run by leader.
+
+	Job is claimed by atomic `hublabbot.store.StateStore.delete`, so it runs at most once
+	even if two replicas consider themselves leaders. Claimed jobs are run in thread pool,
+	so slow job (e.g. janitor sweep) doesn't delay other due jobs. Job rescheduled while
+	previous job with same kind and key runs waits until it finishes.
+
+	Args:
+		store: `hublabbot.store.StateStore`.
+		elector: `LeaderElector`.
+		poll_interval: Interval of checks for due jobs, in seconds.
+		max_workers: Maximum count of jobs run at once.
+
+	"""
+
+	def __init__(self, store: StateStore, elector: LeaderElector, poll_interval: float = 1.0,
+	             max_workers: int = JOB_CONCURRENCY):
+		self.store = store
+		"""`hublabbot.store.StateStore`."""
+		self.elector = elector
+		"""`LeaderElector`."""
+		self.poll_interval = poll_interval
+		"""Interval of checks for due jobs, in seconds."""
+		self._callbacks: Dict[str, JobCallback] = {}
+		self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='hublabbot-job')
+		self._lock = threading.Lock()
+		self._running: Set[str] = set()
+		self._stopped = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+
+	def register(self, kind: str, callback: JobCallback) -> None:
+		"""Register `callback` for jobs of `kind`."""
+		self._callbacks[kind] = callback
+
+	def schedule(self, kind: str, key: str, payload: JsonDict, delay: float,
+	             replace: bool = True) -> bool:
+		"""Schedule job.
+
+		Args:
+			kind: Kind of job, see `register`.
+			key: Key of job, unique in `kind`.
+			payload: JSON dict passed to callback.
+			delay: Delay before run in seconds.
+			replace: Replace pending job with same `kind` and `key`.
+
+		Returns:
+			`False` if `replace` is `False` and job is already pending.
+
+		"""
+		job = {'due': time.time() + delay, 'payload': payload}
+		job_key = f'{JOB_PREFIX}{kind}:{key}'
+		if replace:
+			self.store.set(job_key, job, delay + JOB_GRACE_TTL)
+			return True
+		return self.store.add(job_key, job, delay + JOB_GRACE_TTL)
+
+	def coalesce(self, kind: str, key: str, payload: JsonDict, delay: float,
+	             order_by: Optional[str] = None) -> int:
+		"""Schedule job or replace payload of pending job, keeping its due time.
+
+		So burst of events runs job once, `delay` after first event, with payload of latest one.
+
+		Args:
+			kind: Kind of job, see `register`.
+			key: Key of job, unique in `kind`.
+			payload: JSON dict passed to callback.
+			delay: Delay before run in seconds.
+			order_by: Key in `payload`, payload with lower value doesn't replace pending one
+				(events delivered out of order).
+
+		Returns:
+			Count of events coalesced in pending job.
+
+		"""
+		job_key = f'{JOB_PREFIX}{kind}:{key}'
+		while True:
+			job: JsonDict = {'due': time.time() + delay, 'payload': payload, 'events': 1}
+			if self.store.add(job_key, job, delay + JOB_GRACE_TTL):
+				return 1
+			pending: Optional[JsonDict] = self.store.get(job_key)
+			if pending is None:
+				# job claimed since `add`, then it's new job
+				continue
+			merged_payload = payload
+			if order_by is not None and pending['payload'][order_by] > payload[order_by]:
+				merged_payload = pending['payload']
+			due: float = pending['due']
+			events: int = pending['events'] + 1
+			job = {'due': due, 'payload': merged_payload, 'events': events}
+			# concurrent event merged or job claimed since `get`, then merge again
+			if self.store.replace(job_key, pending, job, max(0.0, due - time.time()) + JOB_GRACE_TTL):
+				return events
+
+	def run_due(self, wait_jobs: bool = False) -> None:
+		"""Claim due jobs and run them in thread pool, if replica is leader.
+
+		Args:
+			wait_jobs: Wait until claimed jobs finish.
+
+		"""
+		jobs = self.store.scan(JOB_PREFIX)
+		submitted: List['Future[None]'] = []
+		if self.elector.is_leader:
+			now = time.time()
+			for job_key, job in sorted(jobs.items(), key=lambda item: item[1]['due']):
+				kind = job_key[len(JOB_PREFIX):].split(':', 1)[0]
+				callback = self._callbacks.get(kind)
+				if job['due'] > now or callback is None:
+					continue
+				with self._lock:
+					running = job_key in self._running
+				# jobs are added to running ones only by this thread
+				if running or not self.store.delete(job_key):
+					continue
+				with self._lock:
+					self._running.add(job_key)
+				del jobs[job_key]
+				submitted.append(self._executor.submit(self._run, job_key, callback, job['payload']))
+		PENDING_AUTO_MERGES.set(sum(1 for key in jobs if key.startswith(f'{JOB_PREFIX}{MERGE_JOB}:')))
+		if wait_jobs:
+			wait(submitted)
+
+	def _run(self, job_key: str, callback: JobCallback, payload: JsonDict) -> None:
+		try:
+			callback(payload)
+		except Exception:
+			traceback.print_exc()
+		finally:
+			with self._lock:
+				self._running.discard(job_key)
+
+	def _poll_loop(self) -> None:
+		while not self._stopped.wait(self.poll_interval):
+			try:
+				self.run_due()
+			except Exception:
+				traceback.print_exc()
+
+	def start(self) -> 'Scheduler':
+		"""Start checks for due jobs in background thread."""
+		self._thread = threading.Thread(target=self._poll_loop, name='hublabbot-scheduler', daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self) -> None:
+		"""Stop checks for due jobs, running jobs aren't waited."""
+		self._stopped.set()
+		self._executor.shutdown(wait=False)
@@ -1,15 +1,16 @@
 """Module for settings-related code."""
 # WORKAROUND: https://mypy.readthedocs.io/en/stable/common_issues.html#using-classes-that-are-generic-in-stubs-but-not-at-runtime  # noqa: E501
 from __future__ import annotations
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional
 from dataclasses import dataclass
 import os
 import json
+import tempfile
 from pathlib import Path
 
-from github import Github  # type: ignore
-
 from hublabbot.util import set_frozen_attr, JsonDict
+from hublabbot.client import github_client
+from hublabbot.github.installation import GithubApp, InstallationTokens
 
 
 @dataclass(frozen=True)
@@ -20,18 +21,25 @@ class GithubAutoMergeOption:
 		authors_white_list: List of authors whose PR can be auto-merged. Your login and your bot's
 			login always in this list.
 		delay: Delay before do auto-merge. Default is `60` seconds.
+		sweep_interval: Interval of sweeps, which merge ready PRs missed by webhooks (lost delivery,
+			restart), see `hublabbot.github.github_webhook.GithubWebhook.sweep_auto_merge_prs`.
+			If `0`, sweep is disabled. Default is `300` seconds.
 		required_label_name: Name of label required for PR to be auto-merged. Default is `'auto-merge'`.
 		required_label_color: Label color in hex format. Default is `'#852576'`.
 		required_label_description: Label description.
 			Default is `'HubLabBot\'s "gh_auto_merge_pr" required label'`.
+		merge_queue: Merge ready PRs one by one in order, PRs behind base branch are updated,
+			see `hublabbot.github.merge_queue`. Default is `False`.
 
 	"""
 
 	authors_white_list: List[str]
 	delay: int
+	sweep_interval: int
 	required_label_name: str
 	required_label_color: str
 	required_label_description: str
+	merge_queue: bool
 	_gh_login: str
 	_gh_bot_login: str
 
@@ -42,6 +50,8 @@ class GithubAutoMergeOption:
 		self.authors_white_list.extend([self._gh_login, self._gh_bot_login])
 		if self.delay is None:
 			set_frozen_attr(self, 'delay', 60)
+		if self.sweep_interval is None:
+			set_frozen_attr(self, 'sweep_interval', 300)
 		if self.required_label_name in (None, ''):
 			set_frozen_attr(self, 'required_label_name', 'auto-merge')
 		if self.required_label_color in (None, ''):
@@ -49,6 +59,8 @@ class GithubAutoMergeOption:
 		if self.required_label_description in (None, ''):
 			set_frozen_attr(self, 'required_label_description',
 			                'HubLabBot\'s "gh_auto_merge_pr" required label')
+		if self.merge_queue is None:
+			set_frozen_attr(self, 'merge_queue', False)
 
 
 @dataclass(frozen=True)
@@ -57,15 +69,73 @@ class GithubShowGitlabCIFailOption:
 
 	Attributes:
 		max_lines: Maximum length of short log. Default is `25`.
+		slowest_sections: Count of slowest sections of failed job listed in fail-report,
+			see `hublabbot.ci_timings`. If `0`, they aren't listed. Default is `3`.
+		job_events: Subscribe to GitLab Job Hooks and post fail-report as soon as job fails,
+			not when whole pipeline fails. Default is `False`.
 
 	"""
 
 	max_lines: int
+	slowest_sections: int
+	job_events: bool
 
 	def __post_init__(self) -> None:
 		"""Validate fields and set defaults."""
 		if self.max_lines is None:
 			set_frozen_attr(self, 'max_lines', 25)
+		if self.slowest_sections is None:
+			set_frozen_attr(self, 'slowest_sections', 3)
+		if self.job_events is None:
+			set_frozen_attr(self, 'job_events', False)
+
+
+@dataclass(frozen=True)
+class GitlabPipelineJanitorOption:
+	"""Immutable record to `gl_pipeline_janitor` option.
+
+	Attributes:
+		interval: Interval of sweeps, which cancel superseded pipelines on all refs,
+			see `hublabbot.gitlab.gitlab_webhook.GitlabWebhook.sweep_pipelines`. Default is `600` seconds.
+		max_concurrency: Maximum count of concurrent cancels. Default is `8`.
+
+	"""
+
+	interval: int
+	max_concurrency: int
+
+	def __post_init__(self) -> None:
+		"""Validate fields and set defaults."""
+		if self.interval is None:
+			set_frozen_attr(self, 'interval', 600)
+		if self.max_concurrency is None:
+			set_frozen_attr(self, 'max_concurrency', 8)
+
+
+@dataclass(frozen=True)
+class RepoFairShareOption:
+	"""Immutable record to `fair_share` option.
+
+	Attributes:
+		weight: Share of repo in processing slots, when bot is busy, relative to other repos,
+			see `hublabbot.fairness`. Default is `1`.
+		max_concurrency: Maximum count of repo's deliveries processed at once. If `None`,
+			repo can take all slots. Default is `None`.
+		api_budget: Maximum count of GitHub and GitLab API calls of repo's deliveries per minute,
+			over budget deliveries wait. If `None`, it is unlimited. Default is `None`.
+
+	"""
+
+	weight: float
+	max_concurrency: Optional[int]
+	api_budget: Optional[int]
+
+	def __post_init__(self) -> None:
+		"""Validate fields and set defaults."""
+		if self.weight is None:
+			set_frozen_attr(self, 'weight', 1)
+		if self.weight <= 0:
+			raise ValueError('Repo option fair_share.weight must be positive!')
 
 
 @dataclass(frozen=True, init=False)
@@ -82,10 +152,14 @@ class RepoOptions:
 			in PR's thread. If `None`, it is disabled.
 		gh_gitlab_ci_for_external_pr: Enable GitLab CI for external Pull Requests.
 		gl_auto_cancel_pipelines: Cancel all prevarious Pipelines with the same branch,
-			if started new one.
+			if started new one. Pipelines of old head of PR are canceled already on its push.
 		gl_auto_delete_branches: Delete branch in GitLab when she deleted in GitHub.
+		gl_pipeline_janitor: `GitlabPipelineJanitorOption`: Periodically cancel superseded pipelines
+			on all refs of project, also ones missed by `gl_auto_cancel_pipelines`.
+			If `None`, it is disabled.
 		gl_delete_pipeline_btn: With [userscript](https://github.com/Potpourri/HubLabBot/blob/master/userscript/gitlab_delete_pipeline_button.user.js)
 			add delete buttons on Pipelines list page in [gitlab.com](https://gitlab.com).
+		fair_share: `RepoFairShareOption`: Share of repo in processing of deliveries.
 
 	"""  # noqa: E501
 
@@ -96,15 +170,17 @@ class RepoOptions:
 	gh_gitlab_ci_for_external_pr: bool
 	gl_auto_cancel_pipelines: bool
 	gl_auto_delete_branches: bool
+	gl_pipeline_janitor: Optional[GitlabPipelineJanitorOption]
 	gl_delete_pipeline_btn: bool
+	fair_share: RepoFairShareOption
 
 	def __init__(self, options: JsonDict, gh_login: str, gh_bot_login: str):
 		"""Creates from `options` dict.
 
 		Values can be: 'false' or doesn't exist - option disabled, 'true' - option enabled.
 
-		`gh_auto_merge_pr` and `gh_show_gitlab_ci_fail` can be: 'false' or JSON dict
-		or '{}' (enabled with defaults).
+		`gh_auto_merge_pr`, `gh_show_gitlab_ci_fail` and `gl_pipeline_janitor` can be: 'false'
+		or JSON dict or '{}' (enabled with defaults). `fair_share` is JSON dict.
 
 		Args:
 			options: JSON dict.
@@ -122,7 +198,9 @@ class RepoOptions:
 		set_frozen_attr(self, 'gh_gitlab_ci_for_external_pr', False)
 		set_frozen_attr(self, 'gl_auto_cancel_pipelines', False)
 		set_frozen_attr(self, 'gl_auto_delete_branches', False)
+		set_frozen_attr(self, 'gl_pipeline_janitor', None)
 		set_frozen_attr(self, 'gl_delete_pipeline_btn', False)
+		set_frozen_attr(self, 'fair_share', RepoFairShareOption(1, None, None))
 		for option, value in options.items():
 			if option == 'gh_repo_path':
 				set_frozen_attr(self, 'gh_repo_path', value)
@@ -134,24 +212,39 @@ class RepoOptions:
 				set_frozen_attr(self, 'gh_auto_merge_pr', GithubAutoMergeOption(
 					authors_white_list=value.get('authors_white_list'),
 					delay=value.get('delay'),
+					sweep_interval=value.get('sweep_interval'),
 					required_label_name=value.get('required_label_name'),
 					required_label_color=value.get('required_label_color'),
 					required_label_description=value.get('required_label_description'),
+					merge_queue=value.get('merge_queue'),
 					_gh_login=gh_login,
 					_gh_bot_login=gh_bot_login))
 			elif option == 'gh_show_gitlab_ci_fail':
 				if value is False:
 					continue
 				set_frozen_attr(self, 'gh_show_gitlab_ci_fail', GithubShowGitlabCIFailOption(
-					max_lines=value.get('max_lines')))
+					max_lines=value.get('max_lines'),
+					slowest_sections=value.get('slowest_sections'),
+					job_events=value.get('job_events')))
 			elif option == 'gh_gitlab_ci_for_external_pr':
 				set_frozen_attr(self, 'gh_gitlab_ci_for_external_pr', value)
 			elif option == 'gl_auto_cancel_pipelines':
 				set_frozen_attr(self, 'gl_auto_cancel_pipelines', value)
 			elif option == 'gl_auto_delete_branches':
 				set_frozen_attr(self, 'gl_auto_delete_branches', value)
+			elif option == 'gl_pipeline_janitor':
+				if value is False:
+					continue
+				set_frozen_attr(self, 'gl_pipeline_janitor', GitlabPipelineJanitorOption(
+					interval=value.get('interval'),
+					max_concurrency=value.get('max_concurrency')))
 			elif option == 'gl_delete_pipeline_btn':
 				set_frozen_attr(self, 'gl_delete_pipeline_btn', value)
+			elif option == 'fair_share':
+				set_frozen_attr(self, 'fair_share', RepoFairShareOption(
+					weight=value.get('weight'),
+					max_concurrency=value.get('max_concurrency'),
+					api_budget=value.get('api_budget')))
 			else:
 				raise ValueError(f'Unknown repo option: "{option}"!')
 
@@ -162,11 +255,13 @@ class RepoOptions:
 		    and not self.gh_gitlab_ci_for_external_pr
 		    and not self.gl_auto_cancel_pipelines
 		    and not self.gl_auto_delete_branches
+		    and self.gl_pipeline_janitor is None
 		    and not self.gl_delete_pipeline_btn):
 			raise ValueError(
 				'At least one repo option must be enabled: gh_auto_merge_pr, '
 				+ 'gh_show_gitlab_ci_fail, gh_gitlab_ci_for_external_pr, '
-				+ 'gl_auto_cancel_pipelines, gl_auto_delete_branches, gl_delete_pipeline_btn!')
+				+ 'gl_auto_cancel_pipelines, gl_auto_delete_branches, gl_pipeline_janitor, '
+				+ 'gl_delete_pipeline_btn!')
 		if self.gh_repo_path is None:
 			raise ValueError('Required repo option gh_repo_path not found!')
 		if self.gl_repo_path is None:
@@ -177,6 +272,13 @@ RepoList = List[RepoOptions]
 """Type - list of `RepoOptions`."""
 
 
+def default_gh_api_url(gh_base_url: str) -> str:
+	"""Returns URL of GitHub API for GitHub instance with URL `gh_base_url`."""
+	if gh_base_url == 'https://github.com':
+		return 'https://api.github.com'
+	return f'{gh_base_url}/api/v3'
+
+
 @dataclass(frozen=True, init=False)
 class HubLabBotSettings:
 	"""Immutable record to store all HubLabBot settings.
@@ -184,6 +286,10 @@ class HubLabBotSettings:
 	Attributes:
 		assets_path: Path to assets dir. Automatically set.
 		base_url: Reads from settings file. URL of your HubLabBot instance.
+		gh_base_url: Reads from settings file. URL of GitHub instance, used for git remotes.
+			Default is `'https://github.com'`.
+		gh_api_url: Reads from settings file. URL of GitHub API. Default is
+			`'https://api.github.com'` for github.com and `{gh_base_url}/api/v3` for GitHub Enterprise.
 		port: Reads from environ `HUBLABBOT_PORT`. Default is `8080`.
 		gh_bot_token: Reads from environ `GITHUB_BOT_TOKEN`. Bot GitHub Personal access token.
 		gh_bot_login: Bot's GitHub login. Automatically set.
@@ -196,11 +302,67 @@ class HubLabBotSettings:
 		gl_token: Reads from environ `GITLAB_TOKEN`. Your GitLab Personal access token.
 		gl_secret: Reads from environ `GITLAB_SECRET`. Secret phrase to authorize requests to bot.
 		repos: List of `RepoOptions`, for which bot is enabled.
+		delivery_cache_size: Reads from settings file. Maximum count of remembered webhook
+			deliveries, used to suppress duplicates. Default is `1024`.
+		delivery_cache_ttl: Reads from settings file. How long delivery is remembered, in seconds.
+			Default is `3600`.
+		max_payload_size: Reads from settings file. Maximum size of webhook payload in bytes,
+			bigger payloads are rejected before verification. Default is `26214400` (25 MiB).
+		journal_path: Reads from settings file. Path to journal of verified deliveries and GitHub/GitLab
+			responses, see `hublabbot.journal.Journal`. If `None`, it is disabled. Default is `None`.
+		slow_request_log_path: Reads from settings file. Path to log of slow deliveries' traces,
+			see `hublabbot.tracing`. If `None`, tracing is disabled. Default is `None`.
+		slow_request_threshold: Reads from settings file. Deliveries processed longer are logged,
+			in seconds. Default is `5`.
+		admin_token: Reads from environ `HUBLABBOT_ADMIN_TOKEN`. Token to authorize requests to admin
+			routes, see `hublabbot.view.admin`. If `None`, admin routes are disabled.
+		profile_dir: Reads from settings file. Dir for profiling results, see `hublabbot.profiling`.
+			Default is system temp dir.
+		state_store: Reads from settings file. URL of state store shared by replicas,
+			see `hublabbot.store.make_store`. Default is `'memory://'` (single instance).
+		leader_lease_ttl: Reads from settings file. Lease time of leader replica, which runs
+			startup reconciliation and delayed auto-merges, in seconds. Default is `15`.
+		pipeline_debounce_window: Reads from settings file. GitLab Pipeline Hooks of same ref
+			and source in this window are coalesced, only latest one is evaluated, in seconds. If `0`,
+			every hook is evaluated on delivery. Default is `3`.
+		branch_delete_window: Reads from settings file. Branches deleted in GitHub in this window
+			are deleted in GitLab by one batch, see
+			`hublabbot.gitlab.gitlab_webhook.GitlabWebhook.delete_branches`, in seconds. If `0`,
+			every branch is deleted on delivery. Default is `5`.
+		branch_delete_concurrency: Reads from settings file. Maximum count of concurrent deletes
+			of batch. Default is `8`.
+		delivery_capacity: Reads from settings file. Maximum count of deliveries processed at once,
+			slots are shared by repos, see `hublabbot.fairness.FairQueue`. Applies to both WSGI and ASGI
+			engines. If `0`, it is unlimited. Default is `16`.
+		coalesce_api_reads: Reads from settings file. Identical concurrent GitHub and GitLab API reads
+			share one call in flight, see `hublabbot.client.InstrumentedSession`. Default is `True`.
+		correlation_cache_size: Reads from settings file. Maximum count of remembered pipelines
+			and PRs, see `hublabbot.correlation.CorrelationCache`. Default is `4096`.
+		correlation_cache_ttl: Reads from settings file. How long pipeline or PR is remembered,
+			in seconds. Default is `86400`.
+		outbox_path: Reads from settings file. Path to SQLite database of outbound actions pending
+			for retry, see `hublabbot.outbox.Outbox`. If `None`, it's in memory and pending actions
+			are lost on restart. Default is `None`.
+		snapshot_path: Reads from settings file. Path to snapshot of correlation and delivery caches,
+			which restarted instance warms caches from, see `hublabbot.snapshot`. Must not be shared
+			by replicas. If `None`, caches are cold after restart. Default is `None`.
+		snapshot_interval: Reads from settings file. Interval of snapshots, last one is written
+			on shutdown, in seconds. If `0`, snapshot is written only on shutdown. Default is `300`.
+		snapshot_max_age: Reads from settings file. Older snapshot is ignored on start, in seconds.
+			Default is `3600`.
+		gh_apps: Reads from settings file. GitHub Apps, which bot acts as in repos, where they are
+			installed, like `[{"app_id": 1, "private_key_path": "app.pem"}]`. Calls are spread
+			over installations, see `hublabbot.github.installation.InstallationTokens`.
+			If empty, bot acts with `gh_bot_token`. Default is `[]`.
+		gh_app_tokens: Installation tokens of `gh_apps`, `None` if no App configured.
+			Automatically set.
 
 	"""
 
 	assets_path: Path
 	base_url: str
+	gh_base_url: str
+	gh_api_url: str
 	port: int
 	gh_bot_token: str
 	gh_bot_login: str
@@ -213,6 +375,31 @@ class HubLabBotSettings:
 	gl_token: str
 	gl_secret: str
 	repos: RepoList
+	delivery_cache_size: int
+	delivery_cache_ttl: int
+	max_payload_size: int
+	journal_path: Optional[str]
+	slow_request_log_path: Optional[str]
+	slow_request_threshold: float
+	admin_token: Optional[str]
+	profile_dir: str
+	state_store: str
+	leader_lease_ttl: float
+	pipeline_debounce_window: float
+	branch_delete_window: float
+	branch_delete_concurrency: int
+	delivery_capacity: int
+	coalesce_api_reads: bool
+	correlation_cache_size: int
+	correlation_cache_ttl: int
+	outbox_path: Optional[str]
+	snapshot_path: Optional[str]
+	snapshot_interval: float
+	snapshot_max_age: float
+	gh_apps: List[GithubApp]
+	gh_app_tokens: Optional[InstallationTokens]
+	_gh_repos: Dict[str, RepoOptions]
+	_gl_repos: Dict[str, RepoOptions]
 
 	def __init__(self, settings_path: os.PathLike[Any], assets_path: os.PathLike[Any]):
 		"""Creates from `settings_path`.
@@ -226,15 +413,19 @@ class HubLabBotSettings:
 			settings_json = json.load(f)
 		set_frozen_attr(self, 'assets_path', Path(assets_path))
 		set_frozen_attr(self, 'base_url', settings_json['base_url'])
+		set_frozen_attr(self, 'gh_base_url',
+		                settings_json.get('gh_base_url', 'https://github.com').rstrip('/'))
+		set_frozen_attr(self, 'gh_api_url',
+		                settings_json.get('gh_api_url', default_gh_api_url(self.gh_base_url)))
 		set_frozen_attr(self, 'port', int(os.environ.get('HUBLABBOT_PORT', 8080)))
 		set_frozen_attr(self, 'gh_bot_token', os.environ['GITHUB_BOT_TOKEN'])
-		github_bot = Github(self.gh_bot_token)
+		github_bot = github_client(self.gh_bot_token, self.gh_api_url)
 		bot = github_bot.get_user()
 		set_frozen_attr(self, 'gh_bot_login', bot.login)
 		set_frozen_attr(self, 'gh_bot_profile_url', bot.html_url)
 		set_frozen_attr(self, 'gh_bot_avatar_url', bot.avatar_url)
 		set_frozen_attr(self, 'gh_token', os.environ['GITHUB_TOKEN'])
-		github = Github(self.gh_token)
+		github = github_client(self.gh_token, self.gh_api_url)
 		login = github.get_user().login
 		set_frozen_attr(self, 'gh_login', login)
 		set_frozen_attr(self, 'gh_secret', os.environ['GITHUB_SECRET'])
@@ -246,6 +437,55 @@ class HubLabBotSettings:
 		for options in settings_json['repos']:
 			repos.append(RepoOptions(options, self.gh_login, self.gh_bot_login))
 		set_frozen_attr(self, 'repos', repos)
+		set_frozen_attr(self, 'delivery_cache_size', settings_json.get('delivery_cache_size', 1024))
+		set_frozen_attr(self, 'delivery_cache_ttl', settings_json.get('delivery_cache_ttl', 3600))
+		set_frozen_attr(self, 'max_payload_size',
+		                settings_json.get('max_payload_size', 25 * 1024 * 1024))
+		set_frozen_attr(self, 'journal_path', settings_json.get('journal_path'))
+		set_frozen_attr(self, 'slow_request_log_path', settings_json.get('slow_request_log_path'))
+		set_frozen_attr(self, 'slow_request_threshold', settings_json.get('slow_request_threshold', 5))
+		set_frozen_attr(self, 'admin_token', os.environ.get('HUBLABBOT_ADMIN_TOKEN'))
+		set_frozen_attr(self, 'profile_dir', settings_json.get('profile_dir', tempfile.gettempdir()))
+		set_frozen_attr(self, 'state_store', settings_json.get('state_store', 'memory://'))
+		set_frozen_attr(self, 'leader_lease_ttl', settings_json.get('leader_lease_ttl', 15))
+		set_frozen_attr(self, 'pipeline_debounce_window',
+		                settings_json.get('pipeline_debounce_window', 3))
+		set_frozen_attr(self, 'branch_delete_window', settings_json.get('branch_delete_window', 5))
+		set_frozen_attr(self, 'branch_delete_concurrency',
+		                settings_json.get('branch_delete_concurrency', 8))
+		set_frozen_attr(self, 'delivery_capacity', settings_json.get('delivery_capacity', 16))
+		set_frozen_attr(self, 'coalesce_api_reads', settings_json.get('coalesce_api_reads', True))
+		set_frozen_attr(self, 'correlation_cache_size',
+		                settings_json.get('correlation_cache_size', 4096))
+		set_frozen_attr(self, 'correlation_cache_ttl',
+		                settings_json.get('correlation_cache_ttl', 24 * 60 * 60))
+		set_frozen_attr(self, 'outbox_path', settings_json.get('outbox_path'))
+		set_frozen_attr(self, 'snapshot_path', settings_json.get('snapshot_path'))
+		set_frozen_attr(self, 'snapshot_interval', settings_json.get('snapshot_interval', 300))
+		set_frozen_attr(self, 'snapshot_max_age', settings_json.get('snapshot_max_age', 60 * 60))
+		gh_apps = []
+		for app in settings_json.get('gh_apps', []):
+			with open(app['private_key_path']) as f:
+				gh_apps.append(GithubApp(int(app['app_id']), f.read()))
+		set_frozen_attr(self, 'gh_apps', gh_apps)
+		set_frozen_attr(self, 'gh_app_tokens',
+		                InstallationTokens(gh_apps, self.gh_api_url) if gh_apps else None)
+		set_frozen_attr(self, '_gh_repos', {r.gh_repo_path: r for r in self.repos})
+		set_frozen_attr(self, '_gl_repos', {r.gl_repo_path: r for r in self.repos})
+
+	def get_gh_bot_token(self, repo_path: str) -> str:
+		"""Returns token, which bot acts with in GitHub repo `repo_path`.
+
+		Returns:
+			Installation token of App from `gh_apps`, if any is installed on repo,
+			otherwise `gh_bot_token`.
+
+		"""
+		if self.gh_app_tokens is not None:
+			token = self.gh_app_tokens.token(repo_path)
+			if token is not None:
+				return token
+		return self.gh_bot_token
 
 	def get_repo_by_github(self, repo_path: str) -> RepoOptions:
 		"""Returns `RepoOptions` by `repo_path` in GitHub.
@@ -254,9 +494,9 @@ class HubLabBotSettings:
 			RuntimeError: An error occurred when `RepoOptions` with this `repo path` not found.
 
 		"""
-		for repo_options in self.repos:
-			if repo_options.gh_repo_path == repo_path:
-				return repo_options
+		repo_options = self._gh_repos.get(repo_path)
+		if repo_options is not None:
+			return repo_options
 		raise RuntimeError(f'Repo options with path GH:{repo_path} not found!')
 
 	def get_repo_by_gitlab(self, repo_path: str) -> RepoOptions:
@@ -266,7 +506,7 @@ class HubLabBotSettings:
 			RuntimeError: An error occurred when `RepoOptions` with this `repo_path` not found.
 
 		"""
-		for repo_options in self.repos:
-			if repo_options.gl_repo_path == repo_path:
-				return repo_options
+		repo_options = self._gl_repos.get(repo_path)
+		if repo_options is not None:
+			return repo_options
 		raise RuntimeError(f'Repo options with path GL:{repo_path} not found!')
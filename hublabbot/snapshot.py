@@ -0,0 +1,227 @@
+"""Module for warm-restart snapshots of in-memory caches.
+
+`Snapshotter` periodically and on shutdown writes entries of registered caches (correlation
+cache, delivery cache) to binary file, so restarted instance (e.g. after deploy) starts with warm
+caches instead of looking everything up by API again. File is replaced atomically, it's per
+instance: replicas must not share it.
+
+Format (little-endian): header `SNAPSHOT_MAGIC`, version, creation time, count of sections
+and CRC32 of section table; section table of name, offset, length and CRC32 of section;
+sections - zlib-compressed JSON lists of entries `[key, seconds to expiration, value]`.
+On start file is memory-mapped and only header and section table are read, every section is
+checked and decompressed, when its cache is accessed first, see `hublabbot.cache.TTLCache.warm`.
+Snapshot of other version, older than `max_age` or corrupted is ignored.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import threading
+import traceback
+
+from hublabbot.metrics import SNAPSHOT_ENTRIES
+
+
+SNAPSHOT_MAGIC = b'HLBSNAP\0'
+"""Magic bytes of snapshot file."""
+SNAPSHOT_VERSION = 1
+"""Version of snapshot format, snapshot of other version is ignored."""
+_HEADER = struct.Struct('<8sHdII')
+_SECTION = struct.Struct('<32sQQI')
+
+
+JsonEntries = List[List[Any]]
+"""Type - JSON entries of section: `[key, seconds to expiration, value]`."""
+DumpCallback = Callable[[], Dict[str, JsonEntries]]
+"""Type - callback, returns entries of component by section name."""
+WarmCallback = Callable[[Callable[[str], JsonEntries]], None]
+"""Type - callback, receives loader of entries of component by section name."""
+
+
+class Snapshot:
+	"""Snapshot file memory-mapped for lazy reading of sections.
+
+	Args:
+		path: Path to snapshot file, missing file is empty snapshot.
+		max_age: Snapshot older than this is ignored, in seconds.
+
+	"""
+
+	def __init__(self, path: str, max_age: float):
+		self.path = path
+		"""Path to snapshot file."""
+		self.created: Optional[float] = None
+		"""Unix time snapshot was written, `None` if it's missing or ignored."""
+		self._lock = threading.Lock()
+		self._map: Optional[mmap.mmap] = None
+		self._sections: Dict[str, Tuple[int, int, int]] = {}
+		try:
+			with open(path, 'rb') as f:
+				self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		except FileNotFoundError:
+			return
+		except (OSError, ValueError) as err:
+			print(f'Snapshot {path} is ignored: {err}')
+			return
+		try:
+			self._read_index(max_age)
+		except (ValueError, struct.error) as err:
+			print(f'Snapshot {path} is ignored: {err}')
+			self.close()
+
+	def _read_index(self, max_age: float) -> None:
+		assert self._map is not None
+		magic, version, created, count, crc = _HEADER.unpack_from(self._map, 0)
+		if magic != SNAPSHOT_MAGIC:
+			raise ValueError('not a snapshot')
+		if version != SNAPSHOT_VERSION:
+			raise ValueError(f'version {version}, expected {SNAPSHOT_VERSION}')
+		age = time.time() - created
+		if age > max_age:
+			raise ValueError(f'stale, written {age:.0f} s ago')
+		table = self._map[_HEADER.size:_HEADER.size + count * _SECTION.size]
+		if len(table) != count * _SECTION.size or zlib.crc32(table) != crc:
+			raise ValueError('bad checksum of section table')
+		for name, offset, length, section_crc in _SECTION.iter_unpack(table):
+			self._sections[name.rstrip(b'\0').decode()] = (offset, length, section_crc)
+		self.created = created
+
+	def entries(self, name: str) -> JsonEntries:
+		"""Read section `name`, seconds to expiration of entries are reduced by age of snapshot.
+
+		Returns:
+			Not expired entries, empty list if section is missing, corrupted or snapshot is closed.
+
+		"""
+		with self._lock:
+			if self._map is None or self.created is None or name not in self._sections:
+				return []
+			offset, length, crc = self._sections[name]
+			data = self._map[offset:offset + length]
+		try:
+			if len(data) != length or zlib.crc32(data) != crc:
+				raise ValueError('bad checksum')
+			entries: JsonEntries = json.loads(zlib.decompress(data))
+			age = time.time() - self.created
+			restored = [[key, ttl - age, value] for key, ttl, value in entries if ttl > age]
+		except (ValueError, TypeError, zlib.error) as err:
+			print(f'Snapshot {self.path}: section {name} is ignored: {err}')
+			return []
+		SNAPSHOT_ENTRIES.inc(name, 'restored', amount=len(restored))
+		SNAPSHOT_ENTRIES.inc(name, 'expired', amount=len(entries) - len(restored))
+		return restored
+
+	def close(self) -> None:
+		"""Unmap file, sections not read yet are empty since."""
+		with self._lock:
+			if self._map is not None:
+				self._map.close()
+				self._map = None
+
+
+def write_snapshot(path: str, sections: Dict[str, JsonEntries]) -> int:
+	"""Write snapshot file atomically.
+
+	Args:
+		path: Path to snapshot file.
+		sections: JSON entries by section name.
+
+	Returns:
+		Size of file in bytes.
+
+	"""
+	blobs = [(name.encode(), zlib.compress(json.dumps(entries, separators=(',', ':')).encode()))
+	         for name, entries in sections.items()]
+	offset = _HEADER.size + len(blobs) * _SECTION.size
+	table = b''
+	for name, blob in blobs:
+		if len(name) > 32:
+			raise ValueError(f'Name of snapshot section is too long: "{name.decode()}"!')
+		table += _SECTION.pack(name, offset, len(blob), zlib.crc32(blob))
+		offset += len(blob)
+	tmp_path = f'{path}.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, time.time(), len(blobs),
+		                     zlib.crc32(table)))
+		f.write(table)
+		for _, blob in blobs:
+			f.write(blob)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp_path, path)
+	return offset
+
+
+class Snapshotter:
+	"""Periodic and on-shutdown snapshots of registered caches.
+
+	Args:
+		path: Path to snapshot file.
+		interval: Interval of snapshots, in seconds. If `0`, snapshot is written only on `close`.
+		max_age: Snapshot of previous run older than this is ignored, in seconds.
+
+	"""
+
+	def __init__(self, path: str, interval: float, max_age: float):
+		self.path = path
+		"""Path to snapshot file."""
+		self.interval = interval
+		"""Interval of snapshots, in seconds."""
+		self._previous = Snapshot(path, max_age)
+		self._components: Dict[str, DumpCallback] = {}
+		self._lock = threading.Lock()
+		self._stopped = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+
+	def register(self, name: str, dump: DumpCallback, warm: WarmCallback) -> None:
+		"""Register component, it's warmed from snapshot of previous run.
+
+		Args:
+			name: Name of component, prefix of its sections.
+			dump: Returns JSON entries of component by section name.
+			warm: Receives loader of JSON entries of previous run by section name.
+
+		"""
+		self._components[name] = dump
+		warm(lambda section: self._previous.entries(f'{name}.{section}'))
+
+	def write(self) -> None:
+		"""Write snapshot of registered components."""
+		with self._lock:
+			start = time.perf_counter()
+			sections: Dict[str, JsonEntries] = {}
+			for name, dump in self._components.items():
+				for section, entries in dump().items():
+					sections[f'{name}.{section}'] = entries
+			# dumps loaded all sections of previous snapshot, it's replaced now
+			self._previous.close()
+			size = write_snapshot(self.path, sections)
+			count = sum(len(entries) for entries in sections.values())
+			print(f'Snapshot {self.path}: {count} entries, {size} bytes,'
+			      + f' {time.perf_counter() - start:.3f} s.')
+
+	def _write_loop(self) -> None:
+		while not self._stopped.wait(self.interval):
+			try:
+				self.write()
+			except Exception:
+				traceback.print_exc()
+
+	def start(self) -> 'Snapshotter':
+		"""Start periodic snapshots in background thread."""
+		if self.interval > 0:
+			self._thread = threading.Thread(target=self._write_loop, name='hublabbot-snapshot',
+			                                daemon=True)
+			self._thread.start()
+		return self
+
+	def close(self) -> None:
+		"""Stop periodic snapshots and write last snapshot."""
+		self._stopped.set()
+		try:
+			self.write()
+		except Exception:
+			traceback.print_exc()
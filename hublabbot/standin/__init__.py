@@ -0,0 +1 @@
+"""Package for local stand-in of GitHub and GitLab API servers, used by replay."""
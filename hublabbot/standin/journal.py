@@ -0,0 +1,80 @@
+"""Module for stand-in, which answers with responses recorded in journal."""
+from typing import Dict, List, Tuple
+import json
+import base64
+from urllib.parse import urlsplit
+from threading import Lock
+
+from hublabbot.util import JsonDict
+from hublabbot.standin.server import json_response
+
+
+_Response = Tuple[int, Dict[str, str], bytes]
+_FALLBACKS: Dict[Tuple[str, str], JsonDict] = {
+	('GET', '/user'): {
+		'login': 'replay', 'id': 1, 'type': 'User',
+		'html_url': 'https://github.com/replay', 'avatar_url': 'https://github.com/replay.png'}}
+_REDACTED_TOKEN = {'token': 'replay', 'expires_at': '2099-01-01T00:00:00Z'}
+"""Body of token response, which was not recorded, see `hublabbot.journal.SECRET_RESPONSE_URL`."""
+
+
+def _relative(url: str, api_path: str) -> str:
+	parts = urlsplit(url)
+	path = parts.path
+	if api_path != '' and path.startswith(api_path):
+		path = path[len(api_path):]
+	return path + ('?' + parts.query if parts.query != '' else '')
+
+
+class JournalResponder:
+	"""`hublabbot.standin.server.Responder`, which answers with responses recorded in journal.
+
+	Responses are matched by method, path and query. Repeated requests get recorded responses
+	in order, last one is repeated. URLs of recorded API are rewritten to `target_url`.
+	Redacted token responses are answered with fake token.
+	"""
+
+	def __init__(self, records: List[JsonDict], recorded_api_url: str):
+		"""Creates from journal records.
+
+		Args:
+			records: `'response'` records of one backend, see `hublabbot.journal.Journal`.
+			recorded_api_url: URL of API in recorded traffic.
+
+		"""
+		self.recorded_api_url = recorded_api_url.rstrip('/')
+		"""URL of API in recorded traffic."""
+		self.target_url = ''
+		"""URL of stand-in, set it after stand-in started."""
+		self._api_path = urlsplit(self.recorded_api_url).path.rstrip('/')
+		self._lock = Lock()
+		self._positions: Dict[Tuple[str, str], int] = {}
+		self._responses: Dict[Tuple[str, str], List[_Response]] = {}
+		for record in records:
+			if record['status'] is None:
+				continue
+			key = (record['method'], _relative(record['url'], self._api_path))
+			body = base64.b64decode(record['body'])
+			if record.get('redacted', False):
+				body = json.dumps(_REDACTED_TOKEN).encode()
+			self._responses.setdefault(key, []).append((record['status'], record['headers'], body))
+
+	def _rewrite(self, data: str) -> str:
+		return data.replace(self.recorded_api_url, self.target_url)
+
+	def __call__(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> _Response:
+		"""Answer with recorded response or `404`."""
+		key = (method, path)
+		responses = self._responses.get(key)
+		if responses is None:
+			fallback = _FALLBACKS.get(key)
+			if fallback is not None:
+				return json_response(200, fallback)
+			return json_response(404, b'{"message": "Not Found"}')
+		with self._lock:
+			position = self._positions.get(key, 0)
+			self._positions[key] = min(position + 1, len(responses) - 1)
+		status, resp_headers, resp_body = responses[position]
+		resp_headers = {name: self._rewrite(value) for name, value in resp_headers.items()}
+		resp_body = resp_body.replace(self.recorded_api_url.encode(), self.target_url.encode())
+		return status, resp_headers, resp_body
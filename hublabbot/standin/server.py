@@ -0,0 +1,144 @@
+"""Module for base stand-in HTTP server."""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import json
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+
+Responder = Callable[[str, str, Dict[str, str], bytes], Tuple[int, Dict[str, str], bytes]]
+"""Type - callback `(method, path, headers, body) -> (status, headers, body)`."""
+
+
+class _Server(ThreadingHTTPServer):
+	# accepts bursts of concurrent connections, like in `bench engines`
+	request_queue_size = 1024
+
+
+class StandinServer:
+	"""Threaded HTTP server on localhost, answers with `responder` and counts calls.
+
+	Attributes:
+		responder: Callback, which makes responses.
+		latency: Delay before every response in seconds.
+		calls: Count of calls by `(method, path without query)`.
+
+	"""
+
+	def __init__(self, responder: Responder, latency: float = 0.0,
+	             host: str = '127.0.0.1', port: int = 0):
+		self.responder = responder
+		self.latency = latency
+		self.calls: 'Counter[Tuple[str, str]]' = Counter()
+		self._lock = Lock()
+		self._server = _Server((host, port), self._make_handler())
+		self._server.daemon_threads = True
+		self._thread: Optional[Thread] = None
+
+	@property
+	def url(self) -> str:
+		"""URL of server, without trailing slash."""
+		host, port = self._server.server_address[:2]
+		if isinstance(host, bytes):
+			host = host.decode()
+		return f'http://{host}:{port}'
+
+	@property
+	def call_count(self) -> int:
+		"""Total count of calls."""
+		with self._lock:
+			return sum(self.calls.values())
+
+	def reset_calls(self) -> Dict[Tuple[str, str], int]:
+		"""Reset call counters.
+
+		Returns:
+			Counters before reset.
+
+		"""
+		with self._lock:
+			calls = dict(self.calls)
+			self.calls.clear()
+			return calls
+
+	def _count(self, method: str, path: str) -> None:
+		with self._lock:
+			self.calls[(method, path.partition('?')[0])] += 1
+
+	def _make_handler(self) -> Any:
+		standin = self
+
+		class Handler(BaseHTTPRequestHandler):
+			"""Request handler, passes requests to `StandinServer.responder`."""
+
+			protocol_version = 'HTTP/1.1'
+			disable_nagle_algorithm = True
+
+			def _read_body(self) -> bytes:
+				if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+					length = int(self.headers.get('Content-Length', 0))
+					return self.rfile.read(length) if length > 0 else b''
+				chunks: List[bytes] = []
+				while True:
+					size = int(self.rfile.readline().split(b';')[0], 16)
+					chunk = self.rfile.read(size)
+					self.rfile.readline()
+					if size == 0:
+						return b''.join(chunks)
+					chunks.append(chunk)
+
+			def _handle(self) -> None:
+				body = self._read_body()
+				standin._count(self.command, self.path)
+				if standin.latency > 0:
+					time.sleep(standin.latency)
+				status, headers, resp_body = standin.responder(
+					self.command, self.path, dict(self.headers.items()), body)
+				self.send_response(status)
+				for name, value in headers.items():
+					self.send_header(name, value)
+				self.send_header('Content-Length', str(len(resp_body)))
+				self.end_headers()
+				if self.command != 'HEAD':
+					self.wfile.write(resp_body)
+
+			do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = _handle
+
+			def log_message(self, format: str, *args: Any) -> None:
+				"""Overrided, don't log requests."""
+
+		return Handler
+
+	def start(self) -> 'StandinServer':
+		"""Start server in background thread."""
+		self._thread = Thread(target=self._server.serve_forever, daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self) -> None:
+		"""Stop server."""
+		self._server.shutdown()
+		self._server.server_close()
+
+	def __enter__(self) -> 'StandinServer':
+		"""Start server."""
+		return self.start()
+
+	def __exit__(self, *args: Any) -> None:
+		"""Stop server."""
+		self.stop()
+
+
+def json_response(status: int, data: Any,
+                  headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+	"""Make response tuple for `Responder` with JSON content.
+
+	Args:
+		status: HTTP status code.
+		data: JSON-serializable data or already encoded `bytes`.
+		headers: Additional headers.
+
+	"""
+	body = data if isinstance(data, bytes) else json.dumps(data).encode()
+	return status, {'Content-Type': 'application/json', **(headers or {})}, body
@@ -0,0 +1,456 @@
+"""Module for shared state of HubLabBot replicas.
+
+State is kept in `StateStore` - key-value store of JSON values with TTL. Implementations:
+
+- `MemoryStore` - in process, for single instance (`memory://`);
+- `SqliteStore` - SQLite database in WAL mode, safe for several processes on one host
+  (`sqlite:///path/to/state.db`);
+- `RedisStore` - Redis server, for replicas on several hosts
+  (`redis://[:password@]host[:port][/db]`). It speaks RESP itself, no client library is required.
+
+See `make_store`.
+"""
+from typing import Any, Dict, List, Optional, Tuple, Union
+import json
+import time
+import socket
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from urllib.parse import urlsplit, unquote
+
+
+class StateStore(ABC):
+	"""Interface of key-value store of JSON values with optional TTL in seconds."""
+
+	shared = False
+	"""Store is shared between processes."""
+
+	@abstractmethod
+	def get(self, key: str) -> Any:
+		"""Returns value of `key` or `None` if not found or expired."""
+
+	@abstractmethod
+	def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+		"""Set `key` to `value`."""
+
+	@abstractmethod
+	def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+		"""Atomically set `key` to `value` if it isn't set.
+
+		Returns:
+			`True` if `key` was set.
+
+		"""
+
+	@abstractmethod
+	def replace(self, key: str, expected: Any, value: Any, ttl: Optional[float] = None) -> bool:
+		"""Atomically set `key` to `value` if its value is `expected` (compare-and-set).
+
+		Returns:
+			`True` if `key` was set, `False` if it's changed, deleted or expired since read.
+
+		"""
+
+	@abstractmethod
+	def delete(self, key: str) -> bool:
+		"""Atomically delete `key`, only one of concurrent callers gets `True`.
+
+		Returns:
+			`True` if `key` was deleted.
+
+		"""
+
+	@abstractmethod
+	def scan(self, prefix: str) -> Dict[str, Any]:
+		"""Returns values of all keys starting with `prefix`."""
+
+	@abstractmethod
+	def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+		"""Atomically acquire or renew lease `name` for `owner`.
+
+		Returns:
+			`True` if `owner` holds lease for next `ttl` seconds.
+
+		"""
+
+	def close(self) -> None:
+		"""Close connections of store."""
+
+
+class MemoryStore(StateStore):
+	"""`StateStore` in memory of process."""
+
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self._data: Dict[str, Tuple[Optional[float], Any]] = {}
+
+	def _get(self, key: str) -> Optional[Tuple[Optional[float], Any]]:
+		item = self._data.get(key)
+		if item is not None and item[0] is not None and item[0] <= time.monotonic():
+			del self._data[key]
+			return None
+		return item
+
+	def _expires_at(self, ttl: Optional[float]) -> Optional[float]:
+		return time.monotonic() + ttl if ttl is not None else None
+
+	def get(self, key: str) -> Any:
+		"""See `StateStore.get`."""
+		with self._lock:
+			item = self._get(key)
+			return item[1] if item is not None else None
+
+	def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+		"""See `StateStore.set`."""
+		with self._lock:
+			self._data[key] = (self._expires_at(ttl), value)
+
+	def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+		"""See `StateStore.add`."""
+		with self._lock:
+			if self._get(key) is not None:
+				return False
+			self._data[key] = (self._expires_at(ttl), value)
+			return True
+
+	def replace(self, key: str, expected: Any, value: Any, ttl: Optional[float] = None) -> bool:
+		"""See `StateStore.replace`."""
+		with self._lock:
+			item = self._get(key)
+			if item is None or item[1] != expected:
+				return False
+			self._data[key] = (self._expires_at(ttl), value)
+			return True
+
+	def delete(self, key: str) -> bool:
+		"""See `StateStore.delete`."""
+		with self._lock:
+			return self._get(key) is not None and self._data.pop(key, None) is not None
+
+	def scan(self, prefix: str) -> Dict[str, Any]:
+		"""See `StateStore.scan`."""
+		with self._lock:
+			keys = [key for key in self._data if key.startswith(prefix)]
+			items = {key: self._get(key) for key in keys}
+			return {key: item[1] for key, item in items.items() if item is not None}
+
+	def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+		"""See `StateStore.acquire_lease`."""
+		with self._lock:
+			item = self._get(name)
+			if item is not None and item[1] != owner:
+				return False
+			self._data[name] = (self._expires_at(ttl), owner)
+			return True
+
+
+_SQLITE_SCHEMA = (
+	'CREATE TABLE IF NOT EXISTS state ('
+	'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)')
+
+
+class SqliteStore(StateStore):
+	"""`StateStore` in SQLite database, safe for several processes on one host.
+
+	Database is in WAL mode, so readers don't block writer. Expiration uses wall clock,
+	which is shared by processes.
+
+	Args:
+		path: Path to database file.
+
+	"""
+
+	shared = True
+
+	def __init__(self, path: str):
+		self.path = path
+		"""Path to database file."""
+		self._local = threading.local()
+		with self._transaction() as db:
+			db.execute(_SQLITE_SCHEMA)
+
+	def _connection(self) -> sqlite3.Connection:
+		# connections can't be shared between threads
+		db: Optional[sqlite3.Connection] = getattr(self._local, 'db', None)
+		if db is None:
+			db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+			db.execute('PRAGMA journal_mode=WAL')
+			db.execute('PRAGMA synchronous=NORMAL')
+			self._local.db = db
+		return db
+
+	def _transaction(self) -> '_SqliteTransaction':
+		return _SqliteTransaction(self._connection())
+
+	@staticmethod
+	def _expires_at(ttl: Optional[float]) -> Optional[float]:
+		return time.time() + ttl if ttl is not None else None
+
+	def get(self, key: str) -> Any:
+		"""See `StateStore.get`."""
+		row = self._connection().execute(
+			'SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+			(key, time.time())).fetchone()
+		return json.loads(row[0]) if row is not None else None
+
+	def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+		"""See `StateStore.set`."""
+		self._connection().execute(
+			'INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)',
+			(key, json.dumps(value), self._expires_at(ttl)))
+
+	def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+		"""See `StateStore.add`."""
+		with self._transaction() as db:
+			db.execute('DELETE FROM state WHERE key = ? AND expires_at <= ?', (key, time.time()))
+			cursor = db.execute(
+				'INSERT OR IGNORE INTO state (key, value, expires_at) VALUES (?, ?, ?)',
+				(key, json.dumps(value), self._expires_at(ttl)))
+			return cursor.rowcount == 1
+
+	def replace(self, key: str, expected: Any, value: Any, ttl: Optional[float] = None) -> bool:
+		"""See `StateStore.replace`."""
+		with self._transaction() as db:
+			row = db.execute(
+				'SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+				(key, time.time())).fetchone()
+			if row is None or json.loads(row[0]) != expected:
+				return False
+			db.execute('UPDATE state SET value = ?, expires_at = ? WHERE key = ?',
+			           (json.dumps(value), self._expires_at(ttl), key))
+			return True
+
+	def delete(self, key: str) -> bool:
+		"""See `StateStore.delete`."""
+		cursor = self._connection().execute(
+			'DELETE FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+			(key, time.time()))
+		return cursor.rowcount == 1
+
+	def scan(self, prefix: str) -> Dict[str, Any]:
+		"""See `StateStore.scan`."""
+		now = time.time()
+		db = self._connection()
+		db.execute('DELETE FROM state WHERE expires_at <= ?', (now,))
+		rows = db.execute(
+			'SELECT key, value FROM state WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+		return {key: json.loads(value) for key, value in rows}
+
+	def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+		"""See `StateStore.acquire_lease`."""
+		with self._transaction() as db:
+			row = db.execute(
+				'SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+				(name, time.time())).fetchone()
+			if row is not None and json.loads(row[0]) != owner:
+				return False
+			db.execute('INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)',
+			           (name, json.dumps(owner), self._expires_at(ttl)))
+			return True
+
+	def close(self) -> None:
+		"""See `StateStore.close`."""
+		db: Optional[sqlite3.Connection] = getattr(self._local, 'db', None)
+		if db is not None:
+			db.close()
+			self._local.db = None
+
+
+class _SqliteTransaction:
+	"""Write transaction, `BEGIN IMMEDIATE` takes write lock at start, so check-and-set is atomic."""
+
+	def __init__(self, db: sqlite3.Connection):
+		self.db = db
+
+	def __enter__(self) -> sqlite3.Connection:
+		self.db.execute('BEGIN IMMEDIATE')
+		return self.db
+
+	def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+		self.db.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+
+
+RespValue = Union[None, int, bytes, List[Any]]
+"""Type - decoded RESP reply."""
+
+
+class RespError(Exception):
+	"""Error reply of Redis server."""
+
+
+class RedisStore(StateStore):
+	"""`StateStore` in Redis server, for replicas on several hosts.
+
+	Args:
+		host: Host of Redis server.
+		port: Port of Redis server.
+		db: Number of database.
+		password: Password, `None` if server doesn't require it.
+		timeout: Socket timeout in seconds.
+
+	"""
+
+	shared = True
+	LEASE_SCRIPT = (
+		"local v = redis.call('GET', KEYS[1]) "
+		"if v == false or v == ARGV[1] then "
+		"redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2]) return 1 end "
+		"return 0")
+	"""Lua script, acquires or renews lease atomically."""
+	REPLACE_SCRIPT = (
+		"if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end "
+		"if ARGV[3] == '' then redis.call('SET', KEYS[1], ARGV[2]) "
+		"else redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3]) end "
+		"return 1")
+	"""Lua script, compare-and-set of JSON value, see `replace`."""
+
+	def __init__(self, host: str, port: int = 6379, db: int = 0, password: Optional[str] = None,
+	             timeout: float = 10):
+		self.host = host
+		"""Host of Redis server."""
+		self.port = port
+		"""Port of Redis server."""
+		self.db = db
+		"""Number of database."""
+		self._password = password
+		self._timeout = timeout
+		self._lock = threading.Lock()
+		self._sock: Optional[socket.socket] = None
+		self._reader: Any = None
+
+	def _connect(self) -> None:
+		self._sock = socket.create_connection((self.host, self.port), self._timeout)
+		self._reader = self._sock.makefile('rb')
+		if self._password is not None:
+			self._call('AUTH', self._password)
+		if self.db != 0:
+			self._call('SELECT', str(self.db))
+
+	def _call(self, *args: str) -> RespValue:
+		assert self._sock is not None
+		request = [f'*{len(args)}\r\n'.encode()]
+		for arg in args:
+			data = arg.encode()
+			request.append(b'$%d\r\n%b\r\n' % (len(data), data))
+		self._sock.sendall(b''.join(request))
+		return self._read_reply()
+
+	def _read_reply(self) -> RespValue:
+		line = self._reader.readline()
+		if not line:
+			raise ConnectionError('Redis server closed connection!')
+		kind: bytes = line[:1]
+		rest: bytes = line[1:-2]
+		if kind == b'+':
+			return rest
+		if kind == b'-':
+			raise RespError(rest.decode())
+		if kind == b':':
+			return int(rest)
+		if kind == b'$':
+			size = int(rest)
+			if size < 0:
+				return None
+			data: bytes = self._reader.read(size + 2)[:-2]
+			return data
+		if kind == b'*':
+			count = int(rest)
+			return None if count < 0 else [self._read_reply() for _ in range(count)]
+		raise ConnectionError(f'Unknown RESP reply: {line!r}!')
+
+	def command(self, *args: str) -> RespValue:
+		"""Send command to Redis server, reconnects once on connection error."""
+		with self._lock:
+			for attempt in range(2):
+				try:
+					if self._sock is None:
+						self._connect()
+					return self._call(*args)
+				except (OSError, ConnectionError):
+					self._close()
+					if attempt == 1:
+						raise
+			raise AssertionError('unreachable')
+
+	@staticmethod
+	def _ttl_args(ttl: Optional[float]) -> List[str]:
+		return ['PX', str(max(1, int(ttl * 1000)))] if ttl is not None else []
+
+	def get(self, key: str) -> Any:
+		"""See `StateStore.get`."""
+		value = self.command('GET', key)
+		return json.loads(value) if isinstance(value, bytes) else None
+
+	def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+		"""See `StateStore.set`."""
+		self.command('SET', key, json.dumps(value), *self._ttl_args(ttl))
+
+	def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+		"""See `StateStore.add`."""
+		return self.command('SET', key, json.dumps(value), 'NX', *self._ttl_args(ttl)) is not None
+
+	def replace(self, key: str, expected: Any, value: Any, ttl: Optional[float] = None) -> bool:
+		"""See `StateStore.replace`, `expected` is compared as JSON encoded by `set`."""
+		reply = self.command('EVAL', self.REPLACE_SCRIPT, '1', key, json.dumps(expected),
+		                     json.dumps(value), self._ttl_args(ttl)[1] if ttl is not None else '')
+		return reply == 1
+
+	def delete(self, key: str) -> bool:
+		"""See `StateStore.delete`."""
+		return self.command('DEL', key) == 1
+
+	def scan(self, prefix: str) -> Dict[str, Any]:
+		"""See `StateStore.scan`."""
+		pattern = ''.join('\\' + char if char in '*?[]\\' else char for char in prefix) + '*'
+		keys: List[bytes] = []
+		cursor = b'0'
+		while True:
+			reply = self.command('SCAN', cursor.decode(), 'MATCH', pattern, 'COUNT', '1000')
+			assert isinstance(reply, list)
+			cursor, batch = reply
+			keys += batch
+			if cursor == b'0':
+				break
+		if len(keys) == 0:
+			return {}
+		values = self.command('MGET', *[key.decode() for key in keys])
+		assert isinstance(values, list)
+		return {key.decode(): json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+	def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+		"""See `StateStore.acquire_lease`."""
+		reply = self.command('EVAL', self.LEASE_SCRIPT, '1', name, json.dumps(owner),
+		                     str(max(1, int(ttl * 1000))))
+		return reply == 1
+
+	def _close(self) -> None:
+		if self._sock is not None:
+			self._reader.close()
+			self._sock.close()
+		self._sock = None
+		self._reader = None
+
+	def close(self) -> None:
+		"""See `StateStore.close`."""
+		with self._lock:
+			self._close()
+
+
+def make_store(url: str) -> StateStore:
+	"""Make `StateStore` by `url`, see `hublabbot.settings.HubLabBotSettings.state_store`.
+
+	Raises:
+		ValueError: An error occurred when scheme of `url` is unknown.
+
+	"""
+	parts = urlsplit(url)
+	if parts.scheme == 'memory':
+		return MemoryStore()
+	if parts.scheme == 'sqlite':
+		return SqliteStore(parts.path)
+	if parts.scheme == 'redis':
+		db = int(parts.path.strip('/') or 0)
+		password = unquote(parts.password) if parts.password is not None else None
+		return RedisStore(parts.hostname or 'localhost', parts.port or 6379, db, password)
+	raise ValueError(f'Unknown state store: "{url}"!')
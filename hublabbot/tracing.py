@@ -0,0 +1,202 @@
+"""Module for per-delivery tracing and log of slow deliveries.
+
+Every delivery gets `Trace` with span for every outbound GitHub/GitLab/git call,
+traces of deliveries slower than threshold are written to `SlowRequestLog`.
+"""
+from typing import Any, Callable, Iterator, List, Optional
+import json
+import time
+import uuid
+import functools
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from urllib.parse import urlsplit
+
+from pyramid.interfaces import IResponse  # type: ignore
+
+from hublabbot.const import TRACES_KEY
+from hublabbot.util import JsonDict
+from hublabbot.client import OutboundCall
+
+
+_SOURCE_PREFIX = {'github': 'GH', 'gitlab': 'GL'}
+_local = threading.local()
+
+
+@dataclass(frozen=True)
+class Span:
+	"""Immutable record of one outbound call in trace.
+
+	Attributes:
+		backend: `'github'`, `'gitlab'` or `'git'`.
+		method: HTTP method or git operation (`'fetch'`, `'push'`).
+		endpoint: Path of request or git remote.
+		status: HTTP status code, `None` if call failed or it is git operation.
+		start: Start of call, in seconds since start of trace.
+		duration: Duration of call in seconds.
+		error: Exception raised by call, `None` if call succeeded.
+
+	"""
+
+	backend: str
+	method: str
+	endpoint: str
+	status: Optional[int]
+	start: float
+	duration: float
+	error: Optional[str]
+
+
+class Trace:
+	"""Trace of one delivery.
+
+	Args:
+		trace_id: ID of trace, delivery ID if sent.
+		source: `'github'` or `'gitlab'`.
+		event: Value of event header.
+
+	"""
+
+	def __init__(self, trace_id: str, source: str, event: Optional[str]):
+		self.trace_id = trace_id
+		"""ID of trace."""
+		self.source = source
+		"""`'github'` or `'gitlab'`."""
+		self.event = event
+		"""Value of event header."""
+		self.repo: Optional[str] = None
+		"""Repo path, `None` if payload wasn't decoded."""
+		self.status: Optional[str] = None
+		"""Status of delivery's result, `'EXCEPTION'` if handler raised."""
+		self.spans: List[Span] = []
+		"""Spans of outbound calls."""
+		self.time = time.time()
+		"""Start of trace, UNIX time."""
+		self.duration = 0.0
+		"""Duration of delivery in seconds, set by `finish`."""
+		self._start = time.perf_counter()
+
+	def elapsed(self) -> float:
+		"""Seconds since start of trace."""
+		return time.perf_counter() - self._start
+
+	def add_span(self, backend: str, method: str, endpoint: str, status: Optional[int],
+	             duration: float, error: Optional[BaseException] = None) -> None:
+		"""Add span of call, which just finished."""
+		self.spans.append(Span(
+			backend=backend,
+			method=method,
+			endpoint=endpoint,
+			status=status,
+			start=self.elapsed() - duration,
+			duration=duration,
+			error=repr(error) if error is not None else None))
+
+	def finish(self, status: str) -> None:
+		"""Finish trace with delivery's `status`."""
+		self.status = status
+		self.duration = self.elapsed()
+
+	def to_json(self) -> JsonDict:
+		"""Trace as JSON dict."""
+		return {
+			'trace_id': self.trace_id,
+			'time': self.time,
+			'source': self.source,
+			'event': self.event,
+			'repo': self.repo,
+			'status': self.status,
+			'duration': self.duration,
+			'spans': [asdict(span) for span in self.spans]}
+
+
+def current_trace() -> Optional[Trace]:
+	"""Trace of delivery processed in current thread, `None` if tracing disabled."""
+	trace: Optional[Trace] = getattr(_local, 'trace', None)
+	return trace
+
+
+def observe_outbound_call(call: OutboundCall) -> None:
+	"""Observer of outbound calls, see `hublabbot.client.add_observer`."""
+	trace = current_trace()
+	if trace is None:
+		return
+	url = urlsplit(call.url)
+	endpoint = f'{url.path}?{url.query}' if url.query else url.path
+	trace.add_span(call.backend, call.method, endpoint, call.status, call.duration, call.error)
+
+
+@contextmanager
+def span(backend: str, method: str, endpoint: str) -> Iterator[None]:
+	"""Context manager, adds span of enclosed call to current trace, if any."""
+	trace = current_trace()
+	if trace is None:
+		yield
+		return
+	start = time.perf_counter()
+	try:
+		yield
+	except BaseException as err:
+		trace.add_span(backend, method, endpoint, None, time.perf_counter() - start, err)
+		raise
+	trace.add_span(backend, method, endpoint, None, time.perf_counter() - start)
+
+
+class SlowRequestLog:
+	"""Log of slow deliveries, traces written as JSON lines.
+
+	Args:
+		path: Path to log file.
+		threshold: Deliveries processed longer are logged, in seconds.
+
+	"""
+
+	def __init__(self, path: str, threshold: float):
+		self.path = path
+		"""Path to log file."""
+		self.threshold = threshold
+		"""Deliveries processed longer are logged, in seconds."""
+		self._lock = threading.Lock()
+
+	def write(self, trace: Trace) -> None:
+		"""Append `trace` to log."""
+		line = json.dumps(trace.to_json(), separators=(',', ':')) + '\n'
+		with self._lock:
+			with open(self.path, 'a') as f:
+				f.write(line)
+
+
+def traced(source: str) -> Callable[[Callable[[Any], IResponse]], Callable[[Any], IResponse]]:
+	"""Decorator for view's handlers, traces delivery if `SlowRequestLog` configured.
+
+	View must have `request`, `delivery_id` and `event` attributes.
+
+	Args:
+		source: `'github'` or `'gitlab'`.
+
+	"""
+	def decorator(handler: Callable[[Any], IResponse]) -> Callable[[Any], IResponse]:
+		@functools.wraps(handler)
+		def wrapper(view: Any) -> IResponse:
+			log: Optional[SlowRequestLog] = view.request.registry.settings.get(TRACES_KEY)
+			if log is None:
+				return handler(view)
+			trace = Trace(view.delivery_id or uuid.uuid4().hex, source, view.event)
+			_local.trace = trace
+			status = 'EXCEPTION'
+			try:
+				result = handler(view)
+				status = result.get('status', 'none') if isinstance(result, dict) else 'none'
+				return result
+			finally:
+				_local.trace = None
+				trace.finish(status)
+				# don't decode payload only for log
+				trace.repo = view.__dict__.get('repo_path')
+				if trace.duration >= log.threshold:
+					log.write(trace)
+					print(f'{_SOURCE_PREFIX[source]}: Slow delivery {trace.trace_id} took'
+					      + f' {trace.duration:.1f}s, {len(trace.spans)} calls traced to {log.path}.')
+		return wrapper
+	return decorator
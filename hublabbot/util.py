@@ -1,6 +1,15 @@
 """Module for utility functions, types, etc."""
-from typing import Any, Dict
+from typing import Any, Dict, Optional
+from types import ModuleType
 import re
+import json
+import importlib
+
+orjson: Optional[ModuleType]
+try:
+	orjson = importlib.import_module('orjson')
+except ImportError:
+	orjson = None
 
 
 JsonDict = Dict[str, Any]
@@ -17,3 +26,10 @@ def filter_out_ansi_escape(string: str) -> str:
 def set_frozen_attr(obj: object, attr: str, val: Any) -> None:
 	"""Assign value to attribute in frozen dataclass."""
 	object.__setattr__(obj, attr, val)
+
+
+def json_loads(data: bytes) -> Any:
+	"""Decode JSON, with [orjson](https://github.com/ijl/orjson) if it is installed."""
+	if orjson is not None:
+		return orjson.loads(data)
+	return json.loads(data)
@@ -0,0 +1,153 @@
+"""Module with view of admin routes."""
+import hmac
+
+from pyramid.interfaces import IRequest, IResponse  # type: ignore
+from pyramid.view import view_defaults  # type: ignore
+from pyramid.httpexceptions import HTTPUnauthorized, HTTPNotFound, HTTPBadRequest  # type: ignore
+from pyramid.config import Configurator  # type: ignore
+
+import hublabbot.profiling as profiling
+from hublabbot.const import (ADMIN_PROFILE_ROUTE, ADMIN_BACKFILL_ROUTE, ADMIN_CI_SECTIONS_ROUTE,
+                             CI_TIMINGS_KEY)
+from hublabbot.ci_timings import CiTimings
+from hublabbot.github.github_webhook import GithubWebhook
+
+
+class AdminView:
+	"""Base of views of admin routes.
+
+	Requests must have header `X-Hublabbot-Admin-Token` with
+	`hublabbot.settings.HubLabBotSettings.admin_token`.
+	"""
+
+	def __init__(self, request: IRequest):
+		self.request = request
+		"""Pyramid's request object."""
+		self.settings = self.request.registry.settings['hublabbot']
+		"""`hublabbot.settings.HubLabBotSettings`."""
+		self._verify_request()
+
+	def _verify_request(self) -> None:
+		if self.settings.admin_token is None:
+			raise HTTPNotFound
+		signature = self.request.headers.get('X-Hublabbot-Admin-Token', '')
+		if not hmac.compare_digest(signature, self.settings.admin_token):
+			raise HTTPUnauthorized
+
+
+@view_defaults(
+	route_name=ADMIN_PROFILE_ROUTE, renderer='json'
+)
+class AdminProfileView(AdminView):
+	"""View of admin route to control profiling, see `hublabbot.profiling`."""
+
+	def status(self) -> IResponse:
+		"""Handler for state of active profiling session.
+
+		Returns:
+			`{'status': 'OK', 'value': ...}`, value is `None` if no active session.
+
+		"""
+		session = profiling.current_session()
+		return {'status': 'OK', 'value': session.to_json() if session is not None else None}
+
+	def start(self) -> IResponse:
+		"""Handler for start of profiling session.
+
+		URL params: `mode` (`'cprofile'` or `'sample'`, default is `'cprofile'`), `requests` -
+		count of requests to profile, `seconds` - duration of session (default is `60`
+		if `requests` not set).
+
+		Returns:
+			`{'status': 'OK', 'value': ...}` if session started,</br>
+			`{'status': 'ERROR', 'error': ...}` if other session is active.
+
+		"""
+		params = self.request.params
+		try:
+			requests = int(params['requests']) if 'requests' in params else None
+			seconds = float(params['seconds']) if 'seconds' in params else None
+		except ValueError:
+			raise HTTPBadRequest
+		if requests is None and seconds is None:
+			seconds = 60
+		try:
+			session = profiling.start(params.get('mode', 'cprofile'), requests, seconds,
+			                          self.settings.profile_dir)
+		except (ValueError, RuntimeError) as err:
+			return {'status': 'ERROR', 'error': str(err)}
+		return {'status': 'OK', 'value': session.to_json()}
+
+	def stop(self) -> IResponse:
+		"""Handler for stop of active profiling session.
+
+		Returns:
+			`{'status': 'OK', 'value': ...}`, value is path to result file or `None`.
+
+		"""
+		return {'status': 'OK', 'value': profiling.stop()}
+
+
+@view_defaults(
+	route_name=ADMIN_BACKFILL_ROUTE, renderer='json'
+)
+class AdminBackfillView(AdminView):
+	"""View of admin route to backfill external PRs to GitLab."""
+
+	def backfill(self) -> IResponse:
+		"""Handler for backfill of one repo.
+
+		URL params: `repo` - path of repo in GitHub.
+
+		Returns:
+			Result of `hublabbot.github.github_webhook.GithubWebhook.backfill_prs_to_gitlab`.
+
+		"""
+		repo_path = self.request.params.get('repo')
+		if repo_path is None:
+			raise HTTPBadRequest
+		try:
+			repo_options = self.settings.get_repo_by_github(repo_path)
+		except RuntimeError:
+			raise HTTPNotFound
+		if not repo_options.gh_gitlab_ci_for_external_pr:
+			return {
+				'status': 'IGNORE',
+				'note': f'Repo option gh_gitlab_ci_for_external_pr disabled for repo {repo_path}.'}
+		return GithubWebhook(self.settings, repo_path).backfill_prs_to_gitlab()
+
+
+@view_defaults(
+	route_name=ADMIN_CI_SECTIONS_ROUTE, renderer='json'
+)
+class AdminCiSectionsView(AdminView):
+	"""View of admin route of aggregated timings of GitLab CI sections, see `hublabbot.ci_timings`."""
+
+	def summary(self) -> IResponse:
+		"""Handler for summary of sections.
+
+		URL params: `repo` - path of repo in GitLab (default is all repos), `limit` - maximum count
+		of sections (default is all).
+
+		Returns:
+			`{'status': 'OK', 'value': ...}`, value is `hublabbot.ci_timings.CiTimings.summary`.
+
+		"""
+		ci_timings: CiTimings = self.request.registry.settings[CI_TIMINGS_KEY]
+		try:
+			limit = int(self.request.params['limit']) if 'limit' in self.request.params else None
+		except ValueError:
+			raise HTTPBadRequest
+		return {'status': 'OK', 'value': ci_timings.summary(self.request.params.get('repo'), limit)}
+
+
+def includeme(config: Configurator) -> None:
+	"""Pyramid magic function, register views."""
+	config.add_route(ADMIN_PROFILE_ROUTE, '/' + ADMIN_PROFILE_ROUTE)
+	config.add_view(AdminProfileView, attr='status', request_method='GET')
+	config.add_view(AdminProfileView, attr='start', request_method='POST')
+	config.add_view(AdminProfileView, attr='stop', request_method='DELETE')
+	config.add_route(ADMIN_BACKFILL_ROUTE, '/' + ADMIN_BACKFILL_ROUTE)
+	config.add_view(AdminBackfillView, attr='backfill', request_method='POST')
+	config.add_route(ADMIN_CI_SECTIONS_ROUTE, '/' + ADMIN_CI_SECTIONS_ROUTE)
+	config.add_view(AdminCiSectionsView, attr='summary', request_method='GET')
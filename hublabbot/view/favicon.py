@@ -1,13 +1,11 @@
 """Module with view of favicon."""
 from pyramid.interfaces import IRequest, IResponse  # type: ignore
 from pyramid.config import Configurator  # type: ignore
-from pyramid.view import view_config  # type: ignore
 from pyramid.response import FileResponse  # type: ignore
 
 from hublabbot.const import FAVICON_ROUTE
 
 
-@view_config(route_name=FAVICON_ROUTE)
 def favicon_view(request: IRequest) -> IResponse:
 	"""View of favicon."""
 	settings = request.registry.settings['hublabbot']
@@ -18,4 +16,4 @@ def favicon_view(request: IRequest) -> IResponse:
 def includeme(config: Configurator) -> None:
 	"""Pyramid magic function, register views."""
 	config.add_route(FAVICON_ROUTE, '/' + FAVICON_ROUTE)
-	config.scan(__name__)
+	config.add_view(favicon_view, route_name=FAVICON_ROUTE)
@@ -1,22 +1,104 @@
 """Module with view of GitHub webhook."""
+from typing import Callable, Dict, Mapping, Optional, Tuple
 import traceback
+import contextvars
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import hmac
 
 # jscpd:ignore-start
 from pyramid.interfaces import IRequest, IResponse  # type: ignore
-from pyramid.view import (view_config, notfound_view_config, exception_view_config,  # type: ignore
-                          view_defaults)
-from pyramid.httpexceptions import HTTPUnauthorized  # type: ignore
+from pyramid.view import view_defaults  # type: ignore
+from pyramid.httpexceptions import (HTTPUnauthorized, HTTPLengthRequired,  # type: ignore
+                                    HTTPRequestEntityTooLarge)
+from pyramid.decorator import reify  # type: ignore
 from pyramid.response import Response  # type: ignore
 from pyramid.config import Configurator  # type: ignore
 # jscpd:ignore-end
 
-from hublabbot.const import GITHUB_ENDPOINT
+from hublabbot.const import (GITHUB_ENDPOINT, JOURNAL_KEY, SCHEDULER_KEY, CORRELATION_KEY,
+                             OUTBOX_KEY, FAIR_QUEUE_KEY, CI_TIMINGS_KEY)
+from hublabbot.delivery import deduplicated
+from hublabbot.tracing import traced
+from hublabbot.metrics import observed
+from hublabbot.util import JsonDict, json_loads
+from hublabbot.settings import HubLabBotSettings, RepoOptions
+from hublabbot.correlation import CorrelationCache
+from hublabbot.fairness import FairQueue
+from hublabbot.ci_timings import CiTimings
+from hublabbot.outbox import Outbox
 from hublabbot.github.github_webhook import GithubWebhook
+from hublabbot.github.merge_queue import dequeue_failed
 from hublabbot.gitlab.gitlab_webhook import GitlabWebhook
 
 
+DISPATCH: Dict[str, Tuple[str, Callable[[RepoOptions], bool]]] = {
+	'delete': ('payload_delete', lambda repo: repo.gl_auto_delete_branches),
+	'status': ('payload_status', lambda repo: (repo.gh_auto_merge_pr is not None
+	                                           or repo.gh_show_gitlab_ci_fail is not None)),
+	# PRs are also recorded for correlation of status events
+	'pull_request': ('payload_pull_request', lambda repo: (
+		repo.gh_gitlab_ci_for_external_pr or repo.gh_auto_merge_pr is not None
+		or repo.gh_show_gitlab_ci_fail is not None or repo.gl_auto_cancel_pipelines)),
+	'ping': ('payload_ping', lambda repo: True)}
+"""Dispatch table - 'X-Github-Event' to handler name and check that event enabled in repo."""
+
+
+def verify_delivery(registry: JsonDict, signature: Optional[str], headers: Mapping[str, str],
+                    body: bytes) -> bool:
+	"""Check signature of GitHub delivery, record verified delivery in journal if it's enabled.
+
+	Shared by `GithubPayloadView` and `hublabbot.aio.app.AsgiApp`.
+
+	Args:
+		registry: Registry settings of WSGI app.
+		signature: Value of 'X-Hub-Signature' header, like `sha1={hex digest}`.
+		headers: Request headers.
+		body: Raw request body.
+
+	Returns:
+		`False` if signature is missing or wrong.
+
+	"""
+	settings: HubLabBotSettings = registry['hublabbot']
+	expected_signature = hmac.new(settings.gh_secret.encode(), body, hashlib.sha1).hexdigest()
+	if not hmac.compare_digest((signature or '').partition('=')[2], expected_signature):
+		return False
+	journal = registry.get(JOURNAL_KEY)
+	if journal is not None:
+		journal.record_delivery('github', headers, body)
+	return True
+
+
+def check_event(settings: HubLabBotSettings, event: Optional[str],
+                repo_options: Callable[[], RepoOptions]) -> Optional[JsonDict]:
+	"""Check event has handler and is enabled, see `DISPATCH`.
+
+	Shared by `GithubPayloadView` and `hublabbot.aio.app.AsgiApp`.
+
+	Args:
+		settings: `hublabbot.settings.HubLabBotSettings`.
+		event: Value of 'X-Github-Event' header.
+		repo_options: Returns options of repo of delivery, it's not called (payload isn't
+			decoded) if event is disabled in all repos.
+
+	Returns:
+		`{'status': 'IGNORE', ...}` if event is ignored, `None` if it's enabled.
+
+	"""
+	if event not in DISPATCH:
+		return {'status': 'IGNORE'}
+	is_enabled = DISPATCH[event][1]
+	if not any(is_enabled(options) for options in settings.repos):
+		return {'status': 'IGNORE'}
+	options = repo_options()
+	if not is_enabled(options):
+		return {
+			'status': 'IGNORE',
+			'note': f'Event "{event}" disabled for repo {options.gh_repo_path}.'}
+	return None
+
+
 @view_defaults(
 	route_name=GITHUB_ENDPOINT, request_method='POST', renderer='json'
 )
@@ -31,24 +113,71 @@ class GithubPayloadView:
 		"""Pyramid's request object."""
 		self.settings = self.request.registry.settings['hublabbot']
 		"""`hublabbot.settings.HubLabBotSettings`."""
-		self._verify_request()
-		self.payload = self.request.json
-		"""GitHub JSON payload."""
-		self.repo_path = self.payload['repository']['full_name']
+		self._verify_size()
+		signature = self.request.headers.get('X-Hub-Signature')
+		if not verify_delivery(self.request.registry.settings, signature, self.request.headers,
+		                       self.request.body):
+			raise HTTPUnauthorized
+		self.delivery_id = self.request.headers.get('X-GitHub-Delivery')
+		"""Unique ID of delivery, `None` if not sent."""
+		self.event = self.request.headers.get('X-Github-Event')
+		"""Value of 'X-Github-Event' header."""
+
+	@reify
+	def payload(self) -> JsonDict:
+		"""JSON payload from GitHub, decoded on first access."""
+		payload: JsonDict = json_loads(self.request.body)
+		return payload
+
+	@reify
+	def repo_path(self) -> str:
 		"""Path like {namespace}/{repo name} in GitHub."""
-		self.repo_options = self.settings.get_repo_by_github(self.repo_path)
+		repo_path: str = self.payload['repository']['full_name']
+		return repo_path
+
+	@reify
+	def repo_options(self) -> RepoOptions:
 		"""`hublabbot.settings.RepoOptions`."""
-		self.github_bot_wh = GithubWebhook(self.settings, self.repo_path)
+		repo_options: RepoOptions = self.settings.get_repo_by_github(self.repo_path)
+		return repo_options
+
+	@reify
+	def correlation(self) -> CorrelationCache:
+		"""`hublabbot.correlation.CorrelationCache`."""
+		correlation: CorrelationCache = self.request.registry.settings[CORRELATION_KEY]
+		return correlation
+
+	@reify
+	def ci_timings(self) -> CiTimings:
+		"""`hublabbot.ci_timings.CiTimings`."""
+		ci_timings: CiTimings = self.request.registry.settings[CI_TIMINGS_KEY]
+		return ci_timings
+
+	@reify
+	def outbox(self) -> Outbox:
+		"""`hublabbot.outbox.Outbox`."""
+		outbox: Outbox = self.request.registry.settings[OUTBOX_KEY]
+		return outbox
+
+	@reify
+	def github_bot_wh(self) -> GithubWebhook:
 		"""`hublabbot.github.github_webhook.GithubWebhook` with bot credentials."""
-		self.gitlab_wh = GitlabWebhook(self.settings, self.repo_options.gl_repo_path)
+		return GithubWebhook(self.settings, self.repo_path, correlation=self.correlation,
+		                     outbox=self.outbox)
+
+	@reify
+	def gitlab_wh(self) -> GitlabWebhook:
 		"""`hublabbot.gitlab.gitlab_webhook.GitlabWebhook` with your credentials."""
+		return GitlabWebhook(self.settings, self.repo_options.gl_repo_path, self.correlation,
+		                     self.outbox)
 
-	def _verify_request(self) -> None:
-		signature = self.request.headers['X-Hub-Signature'].partition('=')[2]
-		expected_signature = hmac.new(self.settings.gh_secret.encode(), self.request.body,
-		                              hashlib.sha1).hexdigest()
-		if not hmac.compare_digest(signature, expected_signature):
-			raise HTTPUnauthorized
+	# jscpd:ignore-start
+	def _verify_size(self) -> None:
+		if self.request.content_length is None:
+			raise HTTPLengthRequired
+		if self.request.content_length > self.settings.max_payload_size:
+			raise HTTPRequestEntityTooLarge
+	# jscpd:ignore-end
 
 	def _show_gitlabci_fail(self) -> IResponse:
 		if self.repo_options.gh_show_gitlab_ci_fail is None:
@@ -58,16 +187,32 @@ class GithubPayloadView:
 		if (self.payload['state'] == 'error'
 		    and self.payload['description'] == 'Pipeline canceled on GitLab'):
 			return {'status': 'IGNORE'}
-		failed_pipeline = self.gitlab_wh.get_pipeline_by_url(self.payload['target_url'])
-		if failed_pipeline.yaml_errors is not None:
-			return self.github_bot_wh.show_gitlabci_fail(
-				failed_pipeline.sha, 'yaml_errors',
-				failed_pipeline.web_url, failed_pipeline.yaml_errors)
-		failed_job = self.gitlab_wh.get_failed_job(failed_pipeline)
-		assert failed_job is not None
-		failed_job_log = self.gitlab_wh.parse_gitlabci_log(failed_job.trace())
+		# failed jobs recorded from Pipeline Hook, pipeline with jobs has no YAML errors
+		failed_job = self.gitlab_wh.get_recorded_failed_job(self.payload['target_url'])
+		if failed_job is None:
+			failed_pipeline = self.gitlab_wh.get_pipeline_by_url(self.payload['target_url'])
+			if failed_pipeline.yaml_errors is not None:
+				return self.github_bot_wh.show_gitlabci_fail(
+					failed_pipeline.sha, 'yaml_errors',
+					failed_pipeline.web_url, failed_pipeline.yaml_errors)
+			failed_job = self.gitlab_wh.get_failed_job(failed_pipeline)
+			assert failed_job is not None
+		failed_job_log, sections = self.gitlab_wh.read_failed_job_log(failed_job, failed_job.name,
+		                                                              self.ci_timings)
 		return self.github_bot_wh.show_gitlabci_fail(failed_job.pipeline['sha'], failed_job.stage,
-		                                             failed_job.web_url, failed_job_log)
+		                                             failed_job.web_url, failed_job_log, sections)
+
+	def _dequeue_failed(self) -> None:
+		options = self.repo_options.gh_auto_merge_pr
+		if options is None or not options.merge_queue:
+			return
+		sha: str = self.payload['sha']
+
+		def find_pr() -> Optional[int]:
+			pr = self.github_bot_wh.get_pr_by_sha(sha)
+			return pr.number if pr is not None else None
+
+		dequeue_failed(self.request.registry.settings[SCHEDULER_KEY], self.repo_path, sha, find_pr)
 
 	def _delete_merged_branch_in_gl(self) -> IResponse:
 		pr = self.payload['pull_request']
@@ -75,7 +220,28 @@ class GithubPayloadView:
 			return self.gitlab_wh.delete_branch(f'pr-{pr["number"]}')
 		return {'status': 'IGNORE'}
 
-	@view_config(header='X-Github-Event:delete')
+	# jscpd:ignore-start
+	@observed('github', DISPATCH)
+	@traced('github')
+	@deduplicated('github')
+	def dispatch(self) -> IResponse:
+		"""Dispatch payload to handler by 'X-Github-Event' header, see `DISPATCH`.
+
+		Events without handler or disabled in all repos are ignored without decoding payload.
+
+		Returns:
+			Handler's result or `{'status': 'IGNORE', ...}`.
+
+		"""
+		ignored = check_event(self.settings, self.event, lambda: self.repo_options)
+		if ignored is not None:
+			return ignored
+		handler: Callable[[], IResponse] = getattr(self, DISPATCH[self.event][0])
+		fair_queue: FairQueue = self.request.registry.settings[FAIR_QUEUE_KEY]
+		with fair_queue.slot(self.repo_options):
+			return handler()
+	# jscpd:ignore-end
+
 	def payload_delete(self) -> IResponse:
 		"""Handler for 'X-Github-Event: delete'.
 
@@ -87,9 +253,15 @@ class GithubPayloadView:
 		"""
 		if self.payload['ref_type'] != 'branch':
 			return {'status': 'IGNORE'}
-		return self.gitlab_wh.delete_branch(self.payload['ref'])
+		# PR of deleted branch is closed, even if its event is missed
+		self.correlation.forget_pr_ref(self.repo_path, self.payload['ref'])
+		window = self.settings.branch_delete_window
+		if window <= 0:
+			return self.gitlab_wh.delete_branch(self.payload['ref'])
+		# mass cleanup of branches in GitHub is deleted in GitLab by batches
+		return self.gitlab_wh.queue_branch_delete(
+			self.payload['ref'], self.request.registry.settings[SCHEDULER_KEY], window)
 
-	@view_config(header='X-Github-Event:status')
 	def payload_status(self) -> IResponse:
 		"""Handler for 'X-Github-Event: status'.
 
@@ -100,14 +272,14 @@ class GithubPayloadView:
 
 		"""
 		if self.payload['state'] in ('failure', 'error'):
+			self._dequeue_failed()
 			return self._show_gitlabci_fail()
 		elif self.payload['state'] == 'pending':
 			return {'status': 'RUNNING'}
 		elif self.payload['state'] == 'success':
 			sha = self.payload['commit']['sha']
-			return self.github_bot_wh.auto_merge_pr(sha)
+			return self.github_bot_wh.auto_merge_pr(sha, self.request.registry.settings[SCHEDULER_KEY])
 
-	@view_config(header='X-Github-Event:pull_request')
 	def payload_pull_request(self) -> IResponse:
 		"""Handler for 'X-Github-Event: pull_request'.
 
@@ -117,14 +289,55 @@ class GithubPayloadView:
 			`{'status': 'ERROR', ...}` if action failed.
 
 		"""
+		pr = self.payload['pull_request']
+		self.correlation.record_pull_request(self.repo_path, pr)
+		if self.payload['action'] == 'synchronize' and self.repo_options.gl_auto_cancel_pipelines:
+			response: IResponse = {'status': 'IGNORE'}
+			ref = self._superseded_ref_in_gl(pr)
+			if ref is None:
+				if self.repo_options.gh_gitlab_ci_for_external_pr:
+					response = self.github_bot_wh.sync_pr_to_gitlab(pr)
+				return response
+			# reified webhook is built in this thread, worker runs in copy of context,
+			# so its API calls are counted to delivery, see `hublabbot.fairness`
+			gitlab_wh: GitlabWebhook = self.gitlab_wh
+			context = contextvars.copy_context()
+			# pipelines of old head are canceled while new head is pushed to GitLab
+			with ThreadPoolExecutor(max_workers=1) as executor:
+				canceled = executor.submit(context.run, self._cancel_superseded_in_gl, gitlab_wh, ref,
+				                           pr['head']['sha'])
+				if self.repo_options.gh_gitlab_ci_for_external_pr:
+					response = self.github_bot_wh.sync_pr_to_gitlab(pr)
+			if canceled.result() > 0:
+				response = {**response, 'canceled': canceled.result()}
+			return response
+		if not self.repo_options.gh_gitlab_ci_for_external_pr:
+			return {'status': 'IGNORE'}
 		if self.payload['action'] in ('opened', 'synchronize', 'reopened'):
-			pr = self.payload['pull_request']
 			return self.github_bot_wh.sync_pr_to_gitlab(pr)
 		elif self.payload['action'] == 'closed':
 			return self._delete_merged_branch_in_gl()
 		return {'status': 'IGNORE'}
 
-	@view_config(header='X-Github-Event:ping')
+	def _superseded_ref_in_gl(self, pr: JsonDict) -> Optional[str]:
+		# branch of PR in GitLab, `None` if PR isn't pushed to GitLab
+		if not self.github_bot_wh.is_external_pr(pr):
+			ref: str = pr['head']['ref']
+			return ref
+		if self.repo_options.gh_gitlab_ci_for_external_pr:
+			return f'pr-{pr["number"]}'
+		return None
+
+	@staticmethod
+	def _cancel_superseded_in_gl(gitlab_wh: GitlabWebhook, ref: str, head_sha: str) -> int:
+		try:
+			canceled: int = gitlab_wh.cancel_superseded_pipelines(ref, head_sha)
+		except Exception:
+			# early cancel is optimization, Pipeline Hook cancels superseded pipelines anyway
+			traceback.print_exc()
+			return 0
+		return canceled
+
 	def payload_ping(self) -> IResponse:
 		"""Handler for 'X-Github-Event: ping'.
 
@@ -139,7 +352,6 @@ class GithubPayloadView:
 		return {'status': 'OK'}
 
 	# jscpd:ignore-start
-	@notfound_view_config()
 	def notfound(self) -> IResponse:
 		"""Handler for not used events. Ignore its.
 
@@ -149,7 +361,6 @@ class GithubPayloadView:
 		"""
 		return {'status': 'IGNORE'}
 
-	@exception_view_config()
 	def error(self) -> IResponse:
 		"""Handler for exceptions. Sends exceptions in JSON.
 
@@ -172,4 +383,6 @@ class GithubPayloadView:
 def includeme(config: Configurator) -> None:
 	"""Pyramid magic function, register views."""
 	config.add_route(GITHUB_ENDPOINT, '/' + GITHUB_ENDPOINT)
-	config.scan(__name__)
+	config.add_view(GithubPayloadView, attr='dispatch')
+	config.add_notfound_view(GithubPayloadView, attr='notfound')
+	config.add_exception_view(GithubPayloadView, attr='error')
@@ -1,19 +1,42 @@
 """Module with view of GitLab webhook."""
+from typing import Callable, Dict, Tuple
 import traceback
 import hmac
 
 # jscpd:ignore-start
 from pyramid.interfaces import IRequest, IResponse  # type: ignore
-from pyramid.view import (view_config, notfound_view_config, exception_view_config,  # type: ignore
-                          view_defaults)
-from pyramid.httpexceptions import HTTPUnauthorized  # type: ignore
+from pyramid.view import view_defaults  # type: ignore
+from pyramid.httpexceptions import (HTTPUnauthorized, HTTPLengthRequired,  # type: ignore
+                                    HTTPRequestEntityTooLarge)
+from pyramid.decorator import reify  # type: ignore
 from pyramid.response import Response  # type: ignore
 from pyramid.config import Configurator  # type: ignore
 # jscpd:ignore-end
 
-from hublabbot.const import GITLAB_ENDPOINT, GITLAB_BUTTON_API_ENDPOINT
-from hublabbot.gitlab.gitlab_webhook import GitlabWebhook
+from hublabbot.const import (GITLAB_ENDPOINT, GITLAB_BUTTON_API_ENDPOINT, JOURNAL_KEY,
+                             SCHEDULER_KEY, CORRELATION_KEY, OUTBOX_KEY, FAIR_QUEUE_KEY,
+                             CI_TIMINGS_KEY)
+from hublabbot.delivery import deduplicated
+from hublabbot.tracing import traced
+from hublabbot.metrics import PIPELINE_EVENTS_COALESCED, observed
+from hublabbot.scheduler import Scheduler, PIPELINE_JOB
+from hublabbot.util import JsonDict, json_loads
+from hublabbot.settings import RepoOptions
+from hublabbot.correlation import CorrelationCache
+from hublabbot.fairness import FairQueue
+from hublabbot.ci_timings import CiTimings
+from hublabbot.outbox import Outbox
 from hublabbot.github.github_webhook import GithubWebhook
+from hublabbot.gitlab.gitlab_webhook import GitlabWebhook
+
+
+DISPATCH: Dict[str, Tuple[str, Callable[[RepoOptions], bool]]] = {
+	# pipelines are also recorded for correlation of GitHub status events
+	'Pipeline Hook': ('payload_pipeline_hook', lambda repo: (
+		repo.gl_auto_cancel_pipelines or repo.gh_show_gitlab_ci_fail is not None)),
+	'Job Hook': ('payload_job_hook', lambda repo: (
+		repo.gh_show_gitlab_ci_fail is not None and repo.gh_show_gitlab_ci_fail.job_events))}
+"""Dispatch table - 'X-Gitlab-Event' to handler name and check that event enabled in repo."""
 
 
 @view_defaults(
@@ -30,19 +53,58 @@ class GitlabPayloadView:
 		"""Pyramid's request object."""
 		self.settings = self.request.registry.settings['hublabbot']
 		"""`hublabbot.settings.HubLabBotSettings`."""
+		self._verify_size()
 		self._verify_request()
-		self.payload = self.request.json
-		"""GitLab JSON payload."""
-		self.repo_path = self.payload['project']['path_with_namespace']
+		journal = self.request.registry.settings.get(JOURNAL_KEY)
+		if journal is not None:
+			journal.record_delivery('gitlab', self.request.headers, self.request.body)
+		self.delivery_id = self.request.headers.get('X-Gitlab-Event-UUID')
+		"""Unique ID of delivery, `None` if not sent."""
+		self.event = self.request.headers.get('X-Gitlab-Event')
+		"""Value of 'X-Gitlab-Event' header."""
+
+	@reify
+	def payload(self) -> JsonDict:
+		"""JSON payload from GitLab, decoded on first access."""
+		payload: JsonDict = json_loads(self.request.body)
+		return payload
+
+	@reify
+	def repo_path(self) -> str:
 		"""Path like {namespace}/{repo name} in GitLab."""
-		self.repo_options = self.settings.get_repo_by_gitlab(self.repo_path)
+		repo_path: str = self.payload['project']['path_with_namespace']
+		return repo_path
+
+	@reify
+	def repo_options(self) -> RepoOptions:
 		"""`hublabbot.settings.RepoOptions`."""
-		self.gitlab_wh = GitlabWebhook(self.settings, self.repo_path)
+		repo_options: RepoOptions = self.settings.get_repo_by_gitlab(self.repo_path)
+		return repo_options
+
+	@reify
+	def correlation(self) -> CorrelationCache:
+		"""`hublabbot.correlation.CorrelationCache`."""
+		correlation: CorrelationCache = self.request.registry.settings[CORRELATION_KEY]
+		return correlation
+
+	@reify
+	def outbox(self) -> Outbox:
+		"""`hublabbot.outbox.Outbox`."""
+		outbox: Outbox = self.request.registry.settings[OUTBOX_KEY]
+		return outbox
+
+	@reify
+	def gitlab_wh(self) -> GitlabWebhook:
 		"""`hublabbot.gitlab.gitlab_webhook.GitlabWebhook` with your credentials."""
-		self.github_wh = GithubWebhook(self.settings, self.repo_options.gh_repo_path, is_admin=True)
-		"""`hublabbot.github.github_webhook.GithubWebhook` with your credentials."""
+		return GitlabWebhook(self.settings, self.repo_path, self.correlation, self.outbox)
 
 	# jscpd:ignore-start
+	def _verify_size(self) -> None:
+		if self.request.content_length is None:
+			raise HTTPLengthRequired
+		if self.request.content_length > self.settings.max_payload_size:
+			raise HTTPRequestEntityTooLarge
+
 	def _verify_request(self) -> None:
 		signature = self.request.headers['X-Gitlab-Token']
 		expected_signature = self.settings.gl_secret
@@ -50,7 +112,34 @@ class GitlabPayloadView:
 			raise HTTPUnauthorized
 	# jscpd:ignore-end
 
-	@view_config(header='X-Gitlab-Event:Pipeline Hook')
+	# jscpd:ignore-start
+	@observed('gitlab', DISPATCH)
+	@traced('gitlab')
+	@deduplicated('gitlab')
+	def dispatch(self) -> IResponse:
+		"""Dispatch payload to handler by 'X-Gitlab-Event' header, see `DISPATCH`.
+
+		Events without handler or disabled in all repos are ignored without decoding payload.
+
+		Returns:
+			Handler's result or `{'status': 'IGNORE', ...}`.
+
+		"""
+		if self.event not in DISPATCH:
+			return {'status': 'IGNORE'}
+		handler_name, is_enabled = DISPATCH[self.event]
+		if not any(is_enabled(repo_options) for repo_options in self.settings.repos):
+			return {'status': 'IGNORE'}
+		if not is_enabled(self.repo_options):
+			return {
+				'status': 'IGNORE',
+				'note': f'Event "{self.event}" disabled for repo {self.repo_path}.'}
+		handler: Callable[[], IResponse] = getattr(self, handler_name)
+		fair_queue: FairQueue = self.request.registry.settings[FAIR_QUEUE_KEY]
+		with fair_queue.slot(self.repo_options):
+			return handler()
+	# jscpd:ignore-end
+
 	def payload_pipeline_hook(self) -> IResponse:
 		"""Handler for 'X-Gitlab-Event: Pipeline Hook'.
 
@@ -61,22 +150,57 @@ class GitlabPayloadView:
 
 		"""
 		pipeline = self.payload['object_attributes']
+		self.correlation.record_pipeline(self.repo_path, self.payload)
+		if not self.repo_options.gl_auto_cancel_pipelines:
+			return {'status': 'IGNORE'}
 		# don't touch tag pipelines and manually launched pipelines
-		if (pipeline['status'] in ('running', 'pending')
-		    and pipeline['tag'] is False
-		    and pipeline['source'] != 'web'):
-			branch_head = self.github_wh.get_branch_head(pipeline['ref'])
-			if self.github_wh.get_pr_by_sha(branch_head) is not None:
-				if pipeline['source'] == 'external_pull_request_event':
-					return self.gitlab_wh.cancel_old_pipelines(pipeline['id'], pipeline['ref'])
-				else:
-					self.gitlab_wh.cancel_pipeline(pipeline['id'])
-			else:
-				return self.gitlab_wh.cancel_old_pipelines(0, pipeline['ref'])
-		return {'status': 'IGNORE'}
+		if (pipeline['status'] not in ('running', 'pending')
+		    or pipeline['tag'] is not False
+		    or pipeline['source'] == 'web'):
+			return {'status': 'IGNORE'}
+		window = self.settings.pipeline_debounce_window
+		if window <= 0:
+			return self.gitlab_wh.auto_cancel_pipelines(pipeline['id'], pipeline['ref'], pipeline['source'])
+		# burst of hooks (created, pending, running, every stage) is evaluated once, by latest pipeline
+		# of source: push pipeline doesn't supersede evaluation of PR pipeline of same branch
+		scheduler: Scheduler = self.request.registry.settings[SCHEDULER_KEY]
+		events = scheduler.coalesce(
+			PIPELINE_JOB, f'{self.repo_path}:{pipeline["ref"]}:{pipeline["source"]}',
+			{'repo': self.repo_path, 'id': pipeline['id'], 'ref': pipeline['ref'],
+			 'source': pipeline['source']},
+			window, order_by='id')
+		if events > 1:
+			PIPELINE_EVENTS_COALESCED.inc()
+		return {
+			'status': 'OK',
+			'note': f'Evaluation of ref {pipeline["ref"]} queued, hooks coalesced: {events}.'}
+
+	def payload_job_hook(self) -> IResponse:
+		"""Handler for 'X-Gitlab-Event: Job Hook'.
+
+		Fail-report of failed job is posted at once, before pipeline finishes. Report of same job
+		isn't posted again by status event of failed pipeline.
+
+		Returns:
+			`{'status': 'OK', ...}` if action was successful,</br>
+			`{'status': 'IGNORE', ...}` if action ignored,</br>
+			`{'status': 'ERROR', ...}` if action failed.
+
+		"""
+		if self.payload['build_status'] != 'failed' or self.payload['build_allow_failure']:
+			return {'status': 'IGNORE'}
+		job_id: int = self.payload['build_id']
+		# same URL as `web_url` of job in API, so report is deduplicated with one of status event
+		failed_job_url = f'{self.payload["project"]["web_url"]}/-/jobs/{job_id}'
+		ci_timings: CiTimings = self.request.registry.settings[CI_TIMINGS_KEY]
+		failed_job_log, sections = self.gitlab_wh.read_failed_job_log(
+			self.gitlab_wh.get_job(job_id), self.payload['build_name'], ci_timings)
+		github_wh = GithubWebhook(self.settings, self.repo_options.gh_repo_path,
+		                          correlation=self.correlation, outbox=self.outbox)
+		return github_wh.show_gitlabci_fail(self.payload['sha'], self.payload['build_stage'],
+		                                    failed_job_url, failed_job_log, sections)
 
 	# jscpd:ignore-start
-	@notfound_view_config()
 	def notfound(self) -> IResponse:
 		"""Handler for not used events. Ignore its.
 
@@ -86,7 +210,6 @@ class GitlabPayloadView:
 		"""
 		return {'status': 'IGNORE'}
 
-	@exception_view_config()
 	def error(self) -> IResponse:
 		"""Handler for exceptions. Sends exceptions in JSON.
 
@@ -133,7 +256,6 @@ class GitlabButtonApiView:
 			raise HTTPUnauthorized
 	# jscpd:ignore-end
 
-	@view_config(request_method='DELETE', request_param='pipeline_id')
 	def button_api_delete_pipeline(self) -> IResponse:
 		"""Handler for API: delete pipeline.
 
@@ -145,7 +267,6 @@ class GitlabButtonApiView:
 		"""
 		return self.gitlab_wh.button_api_delete_pipeline(self.params['pipeline_id'])
 
-	@view_config(request_method='GET', request_param='is_enabled')
 	def button_api_is_enabled(self) -> IResponse:
 		"""Handler for API: check button is enabled.
 
@@ -158,7 +279,6 @@ class GitlabButtonApiView:
 		return self.gitlab_wh.button_api_is_enabled()
 
 	# jscpd:ignore-start
-	@exception_view_config()
 	def error(self) -> IResponse:
 		"""Handler for exceptions. Sends exceptions in JSON.
 
@@ -182,4 +302,11 @@ def includeme(config: Configurator) -> None:
 	"""Pyramid magic function, register views."""
 	config.add_route(GITLAB_ENDPOINT, '/' + GITLAB_ENDPOINT)
 	config.add_route(GITLAB_BUTTON_API_ENDPOINT, '/' + GITLAB_BUTTON_API_ENDPOINT)
-	config.scan(__name__)
+	config.add_view(GitlabPayloadView, attr='dispatch')
+	config.add_notfound_view(GitlabPayloadView, attr='notfound')
+	config.add_exception_view(GitlabPayloadView, attr='error')
+	config.add_view(GitlabButtonApiView, attr='button_api_delete_pipeline',
+	                request_method='DELETE', request_param='pipeline_id')
+	config.add_view(GitlabButtonApiView, attr='button_api_is_enabled',
+	                request_method='GET', request_param='is_enabled')
+	config.add_exception_view(GitlabButtonApiView, attr='error')
@@ -3,14 +3,12 @@ from string import Template
 
 from pyramid.interfaces import IRequest, IResponse  # type: ignore
 from pyramid.config import Configurator  # type: ignore
-from pyramid.view import view_config  # type: ignore
 from pyramid.response import Response  # type: ignore
 
 import hublabbot
 from hublabbot.const import HOME_ROUTE
 
 
-@view_config(route_name=HOME_ROUTE)
 def favicon_view(request: IRequest) -> IResponse:
 	"""View of home page."""
 	settings = request.registry.settings['hublabbot']
@@ -27,4 +25,4 @@ def favicon_view(request: IRequest) -> IResponse:
 def includeme(config: Configurator) -> None:
 	"""Pyramid magic function, register views."""
 	config.add_route(HOME_ROUTE, '/')
-	config.scan(__name__)
+	config.add_view(favicon_view, route_name=HOME_ROUTE)
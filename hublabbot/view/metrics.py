@@ -0,0 +1,18 @@
+"""Module with view of metrics."""
+from pyramid.interfaces import IRequest, IResponse  # type: ignore
+from pyramid.config import Configurator  # type: ignore
+from pyramid.response import Response  # type: ignore
+
+import hublabbot.metrics as metrics
+from hublabbot.const import METRICS_ROUTE
+
+
+def metrics_view(request: IRequest) -> IResponse:
+	"""View of metrics in Prometheus text format, see `hublabbot.metrics`."""
+	return Response(metrics.render(), content_type='text/plain; version=0.0.4', charset='utf-8')
+
+
+def includeme(config: Configurator) -> None:
+	"""Pyramid magic function, register views."""
+	config.add_route(METRICS_ROUTE, '/' + METRICS_ROUTE)
+	config.add_view(metrics_view, route_name=METRICS_ROUTE, request_method='GET')
@@ -14,8 +14,10 @@ setup(
 	version='UNKNOWN_VERSION',
 	packages=[
 		PKG_DIR,
+		PKG_DIR + '.aio',
 		PKG_DIR + '.github',
 		PKG_DIR + '.gitlab',
+		PKG_DIR + '.standin',
 		PKG_DIR + '.view'],
 	package_data={PKG_DIR: [
 		'assets/favicon.png',
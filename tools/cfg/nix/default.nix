@@ -1,4 +1,8 @@
-{ python37Packages }:
+{ python37Packages, callPackage }:
+
+let
+  python-gitlab = callPackage ./python-gitlab.nix { inherit python37Packages; };
+in
 
 python37Packages.buildPythonPackage rec {
   pname = "hublabbot";
@@ -15,6 +19,9 @@ python37Packages.buildPythonPackage rec {
     pyramid
     pygit2
     PyGithub
+    pyjwt
+    cryptography
+    # `let` binding shadows the one of `with`
     python-gitlab
   ];
 
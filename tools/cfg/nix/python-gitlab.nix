@@ -0,0 +1,25 @@
+{ python37Packages }:
+
+# `list(iterator=True)` and `list(get_all=...)` need python-gitlab >= 3.6,
+# pinned Nixpkgs has older one
+python37Packages.python-gitlab.overridePythonAttrs (old: rec {
+  version = "3.6.0";
+
+  src = python37Packages.fetchPypi {
+    pname = "python-gitlab";
+    inherit version;
+    sha256 = "901c54ff926f10479cb591a34d65f0a3022f2bcc41074f9a192c7fa7e4c57061";
+  };
+
+  # requests of pinned Nixpkgs is older than required, but has all used API
+  postPatch = ''
+    substituteInPlace setup.py --replace '"requests>=2.25.0"' '"requests"'
+  '';
+
+  propagatedBuildInputs = with python37Packages; [
+    requests
+    requests_toolbelt
+  ];
+
+  doCheck = false;
+})
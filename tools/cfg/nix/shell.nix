@@ -36,9 +36,9 @@ stdenv.mkDerivation rec {
     python37Packages.pyramid
     python37Packages.pygit2
     python37Packages.PyGithub
-    python37Packages.python-gitlab
+    (callPackage ./python-gitlab.nix { })
     # optional dependencies:
-    # -
+    python37Packages.orjson
     # other developing tools:
     cacert #WORKAROUND: https://github.com/target/lorri/issues/98
     git